@@ -0,0 +1,236 @@
+"""
+Vectorized aggregations used by the dashboard tabs.
+
+Everything here is plain DataFrame in / DataFrame out with no Streamlit
+calls, so it can be imported, tested and benchmarked without the app
+(see tests/test_analytics.py and tests/test_benchmarks.py).
+"""
+import pandas as pd
+
+# Измерения куба: компания, ее страна и размер, год и GRI sub_code
+CUBE_KEYS = ["company_id", "company", "country", "country_iso3", "company_size", "year", "sub_code"]
+
+
+def build_metric_cube(df_metrics: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pre-aggregates the metrics table to one row per
+    (company_id, year, sub_code) with country and company_size attached.
+    Every metric in the dashboard is a sum over some sub_codes, so it can be
+    sliced from the cube instead of scanning the raw table.
+    """
+    return (
+        df_metrics.astype({"value": "float64"})
+        .groupby(CUBE_KEYS, observed=True)["value"]
+        .sum()
+        .reset_index()
+    )
+
+
+def company_year_sums(df_cube: pd.DataFrame, sub_codes: list) -> pd.DataFrame:
+    """Sum of `sub_codes` per (company, year) from a (filtered) cube."""
+    df_slice = df_cube[df_cube["sub_code"].isin(sub_codes)]
+    return df_slice.groupby(["company", "year"], observed=True)["value"].sum().reset_index()
+
+
+def kpi_counts(df_filtered: pd.DataFrame) -> dict:
+    """Numbers for the 'Our Database Statistics' block."""
+    return {
+        "metric_count": len(df_filtered),
+        "bundle_count": df_filtered["bundle_id"].nunique(),
+        "company_count": df_filtered["company_id"].nunique(),
+        "country_count": df_filtered["country"].nunique(),
+        "min_year": df_filtered["year"].min(),
+        "max_year": df_filtered["year"].max(),
+    }
+
+
+def geo_counts(df_filtered: pd.DataFrame) -> pd.DataFrame:
+    """Unique companies per country for the Geography map."""
+    return (
+        df_filtered.groupby(["country", "country_iso3"], observed=True)["company_id"]
+        .nunique()
+        .reset_index(name="company_count")
+    )
+
+
+def build_geo_cells(df_metrics: pd.DataFrame) -> pd.DataFrame:
+    """
+    Unique companies per (country, country_iso3, company_size), once per
+    snapshot, so the map of any sidebar selection is a sum of these cells
+    (geo_counts_from_cells). A company listed under several sizes in one
+    country would be summed twice: such companies are kept as rows of their
+    own (company_id set, company_count 1) and counted once per country.
+    """
+    keys = ["country", "country_iso3", "company_size"]
+    df_companies = df_metrics[[*keys, "company_id"]].drop_duplicates()
+    multi_size = df_companies.duplicated(["country", "country_iso3", "company_id"], keep=False)
+    df_cells = (
+        df_companies[~multi_size].groupby(keys, observed=True)
+        .size()
+        .reset_index(name="company_count")
+        .assign(company_id=pd.NA)
+    )
+    df_shared = df_companies[multi_size].assign(company_count=1)[df_cells.columns]
+    return pd.concat([df_cells, df_shared], ignore_index=True).astype({"company_id": "Int32"})
+
+
+def geo_counts_from_cells(df_cells_filtered: pd.DataFrame) -> pd.DataFrame:
+    """geo_counts from the (filtered) cells of build_geo_cells."""
+    shared = df_cells_filtered["company_id"].notna()
+    if shared.any():
+        # Компания с несколькими размерами - одна на страну, сколько бы размеров ни выбрали
+        df_cells_filtered = pd.concat([
+            df_cells_filtered[~shared],
+            df_cells_filtered[shared].drop_duplicates(["country", "country_iso3", "company_id"]),
+        ])
+    return (
+        df_cells_filtered.groupby(["country", "country_iso3"], observed=True)["company_count"]
+        .sum()
+        .reset_index()
+    )
+
+
+def category_shares(df_topics_filtered: pd.DataFrame, company_count: int) -> pd.DataFrame:
+    """Companies disclosing each topic category and their share (%) of `company_count`."""
+    df_shares = (
+        df_topics_filtered.groupby("category_name", observed=True)["company"]
+        .nunique()
+        .reset_index(name="company_count")
+    )
+    df_shares["share_pct"] = (df_shares["company_count"] / company_count) * 100
+    return df_shares
+
+
+def topic_shares(df_topics_filtered: pd.DataFrame, company_count: int) -> pd.DataFrame:
+    """Same as category_shares, per (category_name, topic_name)."""
+    df_shares = (
+        df_topics_filtered.groupby(["category_name", "topic_name"], observed=True)["company"]
+        .nunique()
+        .reset_index(name="company_count")
+    )
+    df_shares["share_pct"] = (df_shares["company_count"] / company_count) * 100
+    return df_shares
+
+
+def rank_topics(df_topic_shares: pd.DataFrame, top_n: int = 10) -> pd.DataFrame:
+    """
+    Keeps the `top_n` topics of every category by share_pct and adds
+    `category_rank` and `overall_rank` (rank across all categories). The
+    overall top-N is always a subset of the per-category top-N, so the result
+    is enough to show both "all categories" and any single category.
+    """
+    df_ranked = df_topic_shares.copy()
+    df_ranked["category_rank"] = (
+        df_ranked.groupby("category_name", observed=True)["share_pct"]
+        .rank(method="first", ascending=False)
+        .astype(int)
+    )
+    df_ranked["overall_rank"] = df_ranked["share_pct"].rank(method="first", ascending=False).astype(int)
+    return df_ranked[df_ranked["category_rank"] <= top_n].reset_index(drop=True)
+
+
+def latest_years_average(
+        df_annual_sums: pd.DataFrame,
+        n_years: int = 3,
+        value_col: str = "value",
+        group_col: str = "company",
+) -> pd.DataFrame:
+    """
+    Average of the latest `n_years` annual values for every company.
+
+    `df_annual_sums` has one row per (company, year). Returns one row per
+    company with `average_value`, `years_of_data` and `years` (the years
+    that went into the average, newest first), sorted by the average.
+    """
+    df_sorted = df_annual_sums.sort_values(
+        by=[group_col, "year"], ascending=[True, False]
+    )
+    # Номер года внутри компании: 0 - самый свежий
+    year_rank = df_sorted.groupby(group_col, observed=True).cumcount()
+    df_latest = df_sorted[year_rank < n_years]
+
+    grouped = df_latest.groupby(group_col, observed=True)
+    df_avg = grouped[value_col].agg(average_value="mean", years_of_data="size")
+    df_avg["years"] = grouped["year"].agg(list)
+
+    return (
+        df_avg.reset_index()
+        .sort_values(by="average_value", ascending=False, kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+# Как считать изменение, если между отчетами компании есть пропущенные годы:
+#   "consecutive" - только пары соседних лет (2021 -> 2022), пары с разрывом пропускаются
+#   "annualized"  - среднегодовое (CAGR) изменение за весь разрыв
+#   "previous"    - изменение к предыдущему доступному году, как у pct_change()
+YOY_GAP_POLICIES = ("consecutive", "annualized", "previous")
+
+
+def yoy_changes(
+        df_company_year: pd.DataFrame,
+        gap_policy: str = "consecutive",
+        value_col: str = "value",
+        group_col: str = "company",
+) -> pd.DataFrame:
+    """
+    Per-company year-over-year change in percent.
+
+    `df_company_year` has one row per (company, year). A change is only
+    defined against a non-zero previous value: zero baselines are dropped
+    instead of producing inf. Returns columns company, year, yoy_change_pct.
+    """
+    if gap_policy not in YOY_GAP_POLICIES:
+        raise ValueError(f"Unknown gap_policy '{gap_policy}', expected one of {YOY_GAP_POLICIES}")
+
+    df_sorted = df_company_year.sort_values(by=[group_col, "year"])
+    grouped = df_sorted.groupby(group_col, observed=True)
+    prev_value = grouped[value_col].shift()
+    year_gap = df_sorted["year"] - grouped["year"].shift()
+
+    ratio = df_sorted[value_col] / prev_value
+    valid = prev_value.notna() & (prev_value != 0)
+    if gap_policy == "consecutive":
+        valid &= year_gap == 1
+    elif gap_policy == "annualized":
+        # Дробная степень отрицательного отношения не определена
+        valid &= ratio >= 0
+        ratio = ratio ** (1 / year_gap)
+
+    df_changes = df_sorted.loc[valid, [group_col, "year"]].copy()
+    df_changes["yoy_change_pct"] = (ratio[valid] - 1) * 100
+    return df_changes.reset_index(drop=True)
+
+
+def yoy_summary(df_changes: pd.DataFrame) -> pd.DataFrame:
+    """Mean / median / number of companies of the YoY change for every year."""
+    return (
+        df_changes.groupby("year")["yoy_change_pct"]
+        .agg(mean_yoy_change="mean", median_yoy_change="median", company_count="count")
+        .reset_index()
+        .sort_values(by="year")
+    )
+
+
+def yoy_trend(df_company_year: pd.DataFrame, gap_policy: str = "consecutive"):
+    """Returns (per-company changes, per-year summary)."""
+    df_changes = yoy_changes(df_company_year, gap_policy=gap_policy)
+    return df_changes, yoy_summary(df_changes)
+
+
+def compare_reports(metric_sums: dict, reports: list) -> pd.DataFrame:
+    """
+    Side-by-side values of the selected reports.
+
+    `metric_sums` maps a metric label to its company_year_sums frame,
+    `reports` is a list of (company, year). Returns one row per metric and
+    one column per report ("company (year)"), NaN where not reported.
+    """
+    keys = pd.MultiIndex.from_tuples([(str(company), int(year)) for company, year in reports])
+    rows = {}
+    for label, df_sums in metric_sums.items():
+        values = df_sums.astype({"company": str, "year": "int64"}).set_index(["company", "year"])["value"]
+        rows[label] = values.reindex(keys).to_numpy()
+    return pd.DataFrame.from_dict(
+        rows, orient="index", columns=[f"{company} ({year})" for company, year in keys]
+    )
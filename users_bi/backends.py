@@ -0,0 +1,438 @@
+"""
+Query backends for the dashboard.
+
+Both backends answer the same questions for a sidebar selection (countries
+x company sizes) and return the same small frames:
+
+- PandasBackend (default): in-memory frames, FilterIndex masks and the
+  aggregations from analytics.py.
+- DuckDBBackend (USERS_BI_BACKEND=duckdb): the tables live in an embedded
+  DuckDB database, either registered from the loaded frames or as views
+  over Parquet snapshots. Filters and aggregations run as SQL and only the
+  result frames come back, so with Parquet the data does not have to fit
+  in memory. Requires the optional `duckdb` package.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import analytics
+import ingest
+import perf
+from filter_index import FilterIndex
+
+BACKEND = os.environ.get("USERS_BI_BACKEND", "pandas")
+BACKENDS = ("pandas", "duckdb")
+
+REPORT_COLUMNS = ["company", "country", "industry", "year"]
+LEADER_COLUMNS = ["company", "country", "year", "tier"]
+# Строк на странице в таблицах Reports Used / Industry Leaders
+PAGE_SIZE = 50
+
+
+def reports_list(df_metrics_filtered: pd.DataFrame) -> pd.DataFrame:
+    """Unique (company, country, industry, year) for the 'Reports Used' table."""
+    return (
+        df_metrics_filtered[REPORT_COLUMNS]
+        .drop_duplicates()
+        .sort_values(by=["company", "year"])
+        .reset_index(drop=True)
+    )
+
+
+def leaders_list(df_leaders_filtered: pd.DataFrame, tiers) -> pd.DataFrame:
+    """Unique (company, country, year, tier) of the given tiers for the 'Industry Leaders' table."""
+    return (
+        df_leaders_filtered.loc[df_leaders_filtered["tier"].isin(list(tiers)), LEADER_COLUMNS]
+        .drop_duplicates()
+        .sort_values(by=["company", "year"])
+        .reset_index(drop=True)
+    )
+
+
+def search_and_sort(df: pd.DataFrame, search: str = "", sort_by: str = None, ascending: bool = True) -> pd.DataFrame:
+    """Rows of `df` whose company contains `search` (case-insensitive), sorted by `sort_by` (ties keep the order of `df`)."""
+    if search:
+        df = df[df["company"].astype(str).str.contains(search, case=False, regex=False)]
+    if sort_by:
+        df = df.sort_values(by=sort_by, ascending=ascending, kind="stable")
+    return df
+
+
+def page_of(df: pd.DataFrame, offset: int = 0, limit: int = PAGE_SIZE):
+    """(rows offset..offset+limit of `df`, total rows)."""
+    return df.iloc[offset:offset + limit].reset_index(drop=True), len(df)
+
+
+def paginate(df: pd.DataFrame, search: str = "", sort_by: str = None, ascending: bool = True,
+             offset: int = 0, limit: int = PAGE_SIZE):
+    """One page of search_and_sort(df, ...). Returns (page, total rows)."""
+    return page_of(search_and_sort(df, search, sort_by, ascending), offset, limit)
+
+
+def topic_rankings(backend, countries, sizes, company_count: int, top_n: int = 10):
+    """Top `top_n` categories and the ranked topics (analytics.rank_topics) of any backend."""
+    df_categories = backend.category_shares(countries, sizes, company_count).nlargest(top_n, "share_pct")
+    df_topics = analytics.rank_topics(backend.topic_shares(countries, sizes, company_count), top_n=top_n)
+    return df_categories, df_topics
+
+
+def tier_a_companies(backend, countries, sizes) -> list:
+    """Companies that were Tier A leaders in any year."""
+    df_leaders = backend.filtered("leaders", countries, sizes)
+    return df_leaders[df_leaders["tier"] == "A"]["company"].unique().tolist()
+
+
+def build_pandas_backend(df_metrics: pd.DataFrame, df_topics: pd.DataFrame, df_leaders: pd.DataFrame,
+                         df_company_dim: pd.DataFrame = None) -> "PandasBackend":
+    """PandasBackend (metric cube + FilterIndex) for plain frames, without the app's Streamlit caching."""
+    if df_company_dim is None:
+        df_company_dim = ingest.build_company_dim(df_metrics, df_topics, df_leaders)
+    tables = {
+        'metrics': df_metrics,
+        'cube': analytics.build_metric_cube(df_metrics),
+        'geo_cells': analytics.build_geo_cells(df_metrics),
+        'topics': ingest.attach_company_keys(df_topics, df_company_dim),
+        'leaders': ingest.attach_company_keys(df_leaders, df_company_dim),
+    }
+    index = FilterIndex(
+        countries=sorted(df_metrics['country'].unique()),
+        sizes=sorted(df_metrics['company_size'].unique()),
+    )
+    for name, df in tables.items():
+        index.add_table(name, df)
+    return PandasBackend(tables, index)
+
+
+class PandasBackend:
+    def __init__(self, tables: dict, filter_index, max_cached_lists: int = 8):
+        # tables: metrics, cube, geo_cells, topics, leaders - все зарегистрированы в filter_index
+        self.tables = tables
+        self.filter_index = filter_index
+        self.max_cached_lists = max_cached_lists
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sorted_list(self, key: tuple, build) -> pd.DataFrame:
+        # Список таблицы (выбор + поиск + сортировка) строится один раз, страницы - срезы из него
+        with self._lock:
+            if key in self._lists:
+                self._lists.move_to_end(key)
+                return self._lists[key]
+        df = build()
+        with self._lock:
+            self._lists[key] = df
+            while len(self._lists) > self.max_cached_lists:
+                self._lists.popitem(last=False)
+        return df
+
+    def filtered(self, name: str, countries, sizes) -> pd.DataFrame:
+        with perf.stage(f"filter:{name}") as timing:
+            df = self.filter_index.filter(name, self.tables[name], countries, sizes)
+            timing["rows"] = len(df)
+        return df
+
+    def kpi_counts(self, countries, sizes) -> dict:
+        return analytics.kpi_counts(self.filtered("metrics", countries, sizes))
+
+    def reports_list(self, countries, sizes) -> pd.DataFrame:
+        return reports_list(self.filtered("metrics", countries, sizes))
+
+    def reports_page(self, countries, sizes, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = PAGE_SIZE):
+        key = ("reports", tuple(sorted(countries)), tuple(sorted(sizes)), search, sort_by, ascending)
+        df = self._sorted_list(key, lambda: search_and_sort(self.reports_list(countries, sizes), search, sort_by, ascending))
+        return page_of(df, offset, limit)
+
+    def leaders_page(self, countries, sizes, tiers, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = PAGE_SIZE):
+        key = ("leaders", tuple(sorted(countries)), tuple(sorted(sizes)), tuple(sorted(tiers)), search, sort_by,
+               ascending)
+        df = self._sorted_list(key, lambda: search_and_sort(
+            leaders_list(self.filtered("leaders", countries, sizes), tiers), search, sort_by, ascending,
+        ))
+        return page_of(df, offset, limit)
+
+    def geo_counts(self, countries, sizes) -> pd.DataFrame:
+        # Сумма заранее посчитанных ячеек страна x размер, а не nunique по всем строкам
+        return analytics.geo_counts_from_cells(self.filtered("geo_cells", countries, sizes))
+
+    def category_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return analytics.category_shares(self.filtered("topics", countries, sizes), company_count)
+
+    def topic_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return analytics.topic_shares(self.filtered("topics", countries, sizes), company_count)
+
+    def company_year_sums(self, countries, sizes, sub_codes: list) -> pd.DataFrame:
+        return analytics.company_year_sums(self.filtered("cube", countries, sizes), sub_codes)
+
+    def latest_years_average(self, countries, sizes, sub_codes: list, n_years: int = 3) -> pd.DataFrame:
+        df_annual_sums = self.company_year_sums(countries, sizes, sub_codes)
+        return analytics.latest_years_average(df_annual_sums, n_years=n_years)
+
+    def yoy_trend(self, countries, sizes, sub_codes: list, gap_policy: str = "consecutive"):
+        df_company_year = self.company_year_sums(countries, sizes, sub_codes)
+        return analytics.yoy_trend(df_company_year, gap_policy=gap_policy)
+
+
+# Фильтр сайдбара; $countries и $sizes передаются списками строк
+_SELECTION = "list_contains($countries, country::VARCHAR) AND list_contains($sizes, company_size::VARCHAR)"
+
+_COMPANY_YEAR_SUMS = f"""
+    SELECT company, year, SUM(value::DOUBLE) AS value
+    FROM metrics
+    WHERE {_SELECTION} AND list_contains($sub_codes, sub_code::VARCHAR)
+    GROUP BY company, year
+"""
+
+
+# ingest.build_company_dim на SQL: первая строка компании в metrics (порядок файла),
+# компании только из topics/leaders получают id после максимального, лучший tier за все годы
+_COMPANY_DIM_SQL = """
+    CREATE OR REPLACE TABLE company_dim AS
+    WITH dim AS (
+        SELECT DISTINCT ON (company)
+               company_id::BIGINT AS company_id, company, company_size, country, country_iso3, industry
+        FROM read_parquet({metrics}, file_row_number = true)
+        ORDER BY company, file_row_number
+    ), other AS (
+        SELECT DISTINCT ON (company) company, country, industry, source, file_row_number
+        FROM (
+            SELECT company, country, industry, 0 AS source, file_row_number
+            FROM read_parquet({topics}, file_row_number = true)
+            UNION ALL
+            SELECT company, country, NULL AS industry, 1 AS source, file_row_number
+            FROM read_parquet({leaders}, file_row_number = true)
+        ) ANTI JOIN dim USING (company)
+        ORDER BY company, source, file_row_number
+    ), best_tier AS (
+        SELECT company, MIN(tier) AS tier FROM read_parquet({leaders}) GROUP BY company
+    )
+    SELECT companies.*, best_tier.tier
+    FROM (
+        SELECT * FROM dim
+        UNION ALL BY NAME
+        SELECT (SELECT COALESCE(MAX(company_id), 0) FROM dim)
+                   + ROW_NUMBER() OVER (ORDER BY source, file_row_number) AS company_id,
+               company, country, industry
+        FROM other
+    ) companies LEFT JOIN best_tier USING (company)
+"""
+
+
+class DuckDBBackend:
+    def __init__(self, con):
+        self.con = con
+        # Соединение не потокобезопасно, а зарегистрированные фреймы видны только в нем
+        # (не в con.cursor()), поэтому запросы сессий идут по очереди; каждый запрос
+        # сам распараллеливается внутри DuckDB
+        self._lock = threading.Lock()
+        # Топики и лидеры получают company_size из справочника компаний (как в ingest.attach_company_keys)
+        con.execute("""
+            CREATE OR REPLACE VIEW metrics AS SELECT * FROM metrics_src;
+            CREATE OR REPLACE VIEW topics AS
+                SELECT t.*, d.company_size FROM topics_src t LEFT JOIN company_dim d USING (company);
+            CREATE OR REPLACE VIEW leaders AS
+                SELECT l.*, d.company_id, d.company_size FROM leaders_src l LEFT JOIN company_dim d USING (company);
+            -- Уникальные компании по ячейкам страна x размер, один раз на снапшот (карта Geography);
+            -- компании с несколькими размерами в стране - отдельными строками (analytics.build_geo_cells)
+            CREATE OR REPLACE TABLE geo_cells AS
+                WITH companies AS (
+                    SELECT DISTINCT country, country_iso3, company_size, company_id FROM metrics
+                ), multi_size AS (
+                    SELECT country, country_iso3, company_id FROM companies
+                    GROUP BY country, country_iso3, company_id HAVING COUNT(*) > 1
+                )
+                SELECT country, country_iso3, company_size, COUNT(*) AS company_count, NULL::INTEGER AS company_id
+                FROM companies ANTI JOIN multi_size USING (country, country_iso3, company_id)
+                GROUP BY country, country_iso3, company_size
+                UNION ALL
+                SELECT country, country_iso3, company_size, 1, company_id
+                FROM companies SEMI JOIN multi_size USING (country, country_iso3, company_id);
+        """)
+
+    @classmethod
+    def from_frames(cls, df_metrics, df_topics, df_leaders, df_company_dim):
+        """Registers the loaded frames (Arrow, no copy) as the source tables."""
+        import duckdb
+
+        con = duckdb.connect()
+        for name, df in (("metrics_src", df_metrics), ("topics_src", df_topics),
+                         ("leaders_src", df_leaders), ("company_dim", df_company_dim)):
+            con.register(name, df)
+        return cls(con)
+
+    @classmethod
+    def from_parquet(cls, metrics_path: str, topics_path: str, leaders_path: str, df_company_dim=None,
+                     database: str = ":memory:"):
+        """
+        Source tables as views over Parquet files: they are scanned on every
+        query with filter and projection pushdown, never loaded as a whole.
+        Without `df_company_dim` the company dimension is built from the files
+        in SQL (see company_dim()), so nothing has to be loaded in pandas.
+        """
+        import duckdb
+
+        con = duckdb.connect(database)
+        # Параметры в определении VIEW не поддерживаются, путь подставляется строковым литералом
+        literals = {
+            name: "'" + path.replace("'", "''") + "'"
+            for name, path in (("metrics", metrics_path), ("topics", topics_path), ("leaders", leaders_path))
+        }
+        for name, path_literal in literals.items():
+            con.execute(f"CREATE OR REPLACE VIEW {name}_src AS SELECT * FROM read_parquet({path_literal})")
+        if df_company_dim is None:
+            con.execute(_COMPANY_DIM_SQL.format(**literals))
+        else:
+            con.register("company_dim", df_company_dim)
+        return cls(con)
+
+    def company_dim(self) -> pd.DataFrame:
+        """The company dimension of the database, as ingest.build_company_dim returns it."""
+        with self._lock:
+            df = self.con.execute("SELECT * FROM company_dim ORDER BY company_id").df()
+        return ingest.optimize_dtypes(df[ingest.COMPANY_DIM_COLUMNS])
+
+    def filter_values(self) -> tuple:
+        """(countries, company sizes) for the sidebar, sorted."""
+        with self._lock:
+            return tuple(
+                [value for (value,) in self.con.execute(
+                    f"SELECT DISTINCT {column}::VARCHAR FROM metrics WHERE {column} IS NOT NULL ORDER BY 1"
+                ).fetchall()]
+                for column in ("country", "company_size")
+            )
+
+    def _query(self, sql: str, countries, sizes, **params) -> pd.DataFrame:
+        params = dict(params, countries=[str(c) for c in countries], sizes=[str(s) for s in sizes])
+        with self._lock:
+            return self.con.execute(sql, params).df()
+
+    def filtered(self, name: str, countries, sizes) -> pd.DataFrame:
+        return self._query(f"SELECT * FROM {name} WHERE {_SELECTION}", countries, sizes)
+
+    def kpi_counts(self, countries, sizes) -> dict:
+        row = self._query(f"""
+            SELECT COUNT(*) AS metric_count,
+                   COUNT(DISTINCT bundle_id) AS bundle_count,
+                   COUNT(DISTINCT company_id) AS company_count,
+                   COUNT(DISTINCT country) AS country_count,
+                   MIN(year) AS min_year,
+                   MAX(year) AS max_year
+            FROM metrics WHERE {_SELECTION}
+        """, countries, sizes).iloc[0]
+        return row.to_dict()
+
+    def reports_list(self, countries, sizes) -> pd.DataFrame:
+        return self._query(f"""
+            SELECT DISTINCT company, country, industry, year
+            FROM metrics WHERE {_SELECTION}
+            ORDER BY company, year, country, industry
+        """, countries, sizes)
+
+    def _page(self, rows_sql: str, columns: list, countries, sizes, search: str, sort_by: str, ascending: bool,
+              offset: int, limit: int, **params):
+        # sort_by подставляется в SQL, поэтому только из известных колонок
+        if sort_by and sort_by not in columns:
+            raise ValueError(f"Unknown sort column '{sort_by}', expected one of {columns}")
+        order = ", ".join(([f"{sort_by} {'ASC' if ascending else 'DESC'}"] if sort_by else []) + columns)
+        matching = f"""
+            WITH page_rows AS ({rows_sql})
+            SELECT * FROM page_rows
+            WHERE $search = '' OR contains(lower(company::VARCHAR), lower($search))
+        """
+        params = dict(params, search=search or "")
+        total = int(self._query(f"SELECT COUNT(*) AS n FROM ({matching})", countries, sizes, **params)["n"].iloc[0])
+        df_page = self._query(f"{matching} ORDER BY {order} LIMIT $limit OFFSET $offset", countries, sizes,
+                              limit=limit, offset=offset, **params)
+        return df_page, total
+
+    def reports_page(self, countries, sizes, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = PAGE_SIZE):
+        rows_sql = f"SELECT DISTINCT {', '.join(REPORT_COLUMNS)} FROM metrics WHERE {_SELECTION}"
+        return self._page(rows_sql, ["company", "year", "country", "industry"], countries, sizes,
+                          search, sort_by, ascending, offset, limit)
+
+    def leaders_page(self, countries, sizes, tiers, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = PAGE_SIZE):
+        rows_sql = (f"SELECT DISTINCT {', '.join(LEADER_COLUMNS)} FROM leaders "
+                    f"WHERE {_SELECTION} AND list_contains($tiers, tier::VARCHAR)")
+        return self._page(rows_sql, ["company", "year", "country", "tier"], countries, sizes,
+                          search, sort_by, ascending, offset, limit, tiers=[str(t) for t in tiers])
+
+    def geo_counts(self, countries, sizes) -> pd.DataFrame:
+        return self._query(f"""
+            SELECT country, country_iso3,
+                   (COALESCE(SUM(company_count) FILTER (WHERE company_id IS NULL), 0)
+                    + COUNT(DISTINCT company_id))::BIGINT AS company_count
+            FROM geo_cells WHERE {_SELECTION}
+            GROUP BY country, country_iso3
+            ORDER BY country, country_iso3
+        """, countries, sizes)
+
+    def _shares(self, keys: list, countries, sizes, company_count: int) -> pd.DataFrame:
+        keys_sql = ", ".join(keys)
+        return self._query(f"""
+            SELECT {keys_sql}, COUNT(DISTINCT company) AS company_count,
+                   COUNT(DISTINCT company) / $company_count * 100 AS share_pct
+            FROM topics WHERE {_SELECTION}
+            GROUP BY {keys_sql}
+            ORDER BY {keys_sql}
+        """, countries, sizes, company_count=company_count)
+
+    def category_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return self._shares(["category_name"], countries, sizes, company_count)
+
+    def topic_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return self._shares(["category_name", "topic_name"], countries, sizes, company_count)
+
+    def company_year_sums(self, countries, sizes, sub_codes: list) -> pd.DataFrame:
+        return self._query(f"{_COMPANY_YEAR_SUMS} ORDER BY company, year", countries, sizes,
+                           sub_codes=list(sub_codes))
+
+    def latest_years_average(self, countries, sizes, sub_codes: list, n_years: int = 3) -> pd.DataFrame:
+        df_avg = self._query(f"""
+            WITH sums AS ({_COMPANY_YEAR_SUMS}),
+            latest AS (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY company ORDER BY year DESC) AS year_rank
+                FROM sums
+            )
+            SELECT company,
+                   AVG(value) AS average_value,
+                   COUNT(*) AS years_of_data,
+                   LIST(year ORDER BY year DESC) AS years
+            FROM latest WHERE year_rank <= $n_years
+            GROUP BY company
+            ORDER BY average_value DESC, company
+        """, countries, sizes, sub_codes=list(sub_codes), n_years=n_years)
+        df_avg["years"] = df_avg["years"].map(list)
+        return df_avg
+
+    def yoy_trend(self, countries, sizes, sub_codes: list, gap_policy: str = "consecutive"):
+        # Те же правила, что в analytics.yoy_changes
+        if gap_policy not in analytics.YOY_GAP_POLICIES:
+            raise ValueError(f"Unknown gap_policy '{gap_policy}', expected one of {analytics.YOY_GAP_POLICIES}")
+        condition, ratio = {
+            "consecutive": ("year_gap = 1", "ratio"),
+            "annualized": ("ratio >= 0", "POW(ratio, 1.0 / year_gap)"),
+            "previous": ("TRUE", "ratio"),
+        }[gap_policy]
+
+        df_changes = self._query(f"""
+            WITH sums AS ({_COMPANY_YEAR_SUMS}),
+            lagged AS (
+                SELECT company, year,
+                       value / LAG(value) OVER w AS ratio,
+                       LAG(value) OVER w AS prev_value,
+                       year - LAG(year) OVER w AS year_gap
+                FROM sums
+                WINDOW w AS (PARTITION BY company ORDER BY year)
+            )
+            SELECT company, year, ({ratio} - 1) * 100 AS yoy_change_pct
+            FROM lagged
+            WHERE prev_value IS NOT NULL AND prev_value != 0 AND {condition}
+            ORDER BY company, year
+        """, countries, sizes, sub_codes=list(sub_codes))
+        return df_changes, analytics.yoy_summary(df_changes)
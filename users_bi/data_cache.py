@@ -0,0 +1,262 @@
+"""
+Local cache for the dashboard source tables.
+
+Every downloaded CSV is converted to a typed Parquet snapshot (see
+ingest.py) and stored on disk together with the ETag / Last-Modified
+headers it was served with. While a snapshot is younger than the TTL it is
+used as is; after that it is revalidated with a conditional request. If
+the network is down (or offline mode is on) the last good snapshot is
+served instead.
+
+Downloads go through one pooled session with gzip, timeouts and retries.
+The response body is streamed straight into the CSV parser (string columns
+are parsed directly as categoricals), and fetch_all loads several sources
+concurrently.
+
+Snapshots prepared ahead of time with `python ingest.py ... --out DIR` are
+picked up directly when USERS_BI_SNAPSHOT_DIR points at DIR.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
+
+import ingest
+import perf
+
+logger = logging.getLogger(__name__)
+
+DATA_BASE_URL = os.environ.get(
+    "USERS_BI_DATA_URL",
+    "https://raw.githubusercontent.com/dblnnn/data_projects/refs/heads/main/users_bi",
+)
+CACHE_DIR = os.environ.get(
+    "USERS_BI_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+# Сколько секунд снапшот считается свежим и не перепроверяется
+DEFAULT_TTL = int(os.environ.get("USERS_BI_CACHE_TTL", 3600))
+# Готовые снапшоты из ingest.py (comparable_metrics.parquet и т.д.)
+SNAPSHOT_DIR = os.environ.get("USERS_BI_SNAPSHOT_DIR")
+# USERS_BI_OFFLINE=1 - никогда не ходить в сеть, только локальные снапшоты
+OFFLINE = os.environ.get("USERS_BI_OFFLINE", "0") == "1"
+# (connect, read) таймауты в секундах
+REQUEST_TIMEOUT = (5, 60)
+MAX_RETRIES = 3
+
+
+class DataUnavailableError(RuntimeError):
+    """Raised when a table can be neither downloaded nor read from the cache."""
+
+
+_session = None
+
+
+def get_session() -> requests.Session:
+    # Одна сессия с пулом соединений на процесс; пул urllib3 потокобезопасен
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+        )
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_maxsize=8, max_retries=retry))
+        session.mount("http://", HTTPAdapter(pool_maxsize=8, max_retries=retry))
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        _session = session
+    return _session
+
+
+def source_url(file_name: str) -> str:
+    return f"{DATA_BASE_URL.rstrip('/')}/{file_name}"
+
+
+def _snapshot_paths(url: str):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return (
+        os.path.join(CACHE_DIR, f"{key}.parquet"),
+        os.path.join(CACHE_DIR, f"{key}.json"),
+    )
+
+
+def _read_meta(meta_path: str) -> dict:
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path: str, data: bytes):
+    # Пишем во временный файл и подменяем, чтобы параллельные сессии
+    # никогда не увидели наполовину записанный снапшот
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_meta(meta_path: str, meta: dict):
+    _write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+
+def _read_snapshot(data_path: str) -> pd.DataFrame:
+    with perf.stage("snapshot_read") as timing:
+        df = ingest.read_snapshot(data_path)
+        timing["rows"] = len(df)
+    return df
+
+
+def _prebuilt_snapshot(url: str):
+    if not SNAPSHOT_DIR:
+        return None
+    name = os.path.splitext(os.path.basename(url))[0]
+    path = os.path.join(SNAPSHOT_DIR, f"{name}.parquet")
+    return path if os.path.exists(path) else None
+
+
+def _parse_stream(response: requests.Response) -> pd.DataFrame:
+    """
+    Parses the CSV body while it is being downloaded. No copy of the whole
+    body (response.text / StringIO) is kept next to the parsed frame.
+    """
+    response.raw.decode_content = True  # распаковка gzip на лету
+    df = pd.read_csv(response.raw, dtype=ingest.CSV_DTYPES, low_memory=True)
+    return ingest.optimize_dtypes(df)
+
+
+def fetch_csv(url: str, ttl: int = DEFAULT_TTL, offline: bool = OFFLINE) -> pd.DataFrame:
+    """
+    Returns the CSV behind `url` as a DataFrame, going to the network only
+    when the local snapshot is missing or older than `ttl` seconds.
+    """
+    return _fetch(url, ttl, offline, read=True)
+
+
+def fetch_snapshot(url: str, ttl: int = DEFAULT_TTL, offline: bool = OFFLINE) -> str:
+    """
+    Same as fetch_csv, but returns the path of the up-to-date Parquet
+    snapshot: a snapshot that is still fresh is not read at all.
+    """
+    return _fetch(url, ttl, offline, read=False)
+
+
+def _fetch(url: str, ttl: int, offline: bool, read: bool):
+    prebuilt_path = _prebuilt_snapshot(url)
+    if prebuilt_path:
+        # Снапшот мог быть записан не через ingest.py (например, synthetic_data.py)
+        return ingest.optimize_dtypes(_read_snapshot(prebuilt_path)) if read else prebuilt_path
+
+    data_path, meta_path = _snapshot_paths(url)
+    meta = _read_meta(meta_path)
+    has_snapshot = os.path.exists(data_path)
+
+    if has_snapshot and (offline or time.time() - meta.get("fetched_at", 0) < ttl):
+        return _read_snapshot(data_path) if read else data_path
+    if offline:
+        raise DataUnavailableError(f"Offline mode and no local snapshot for {url}")
+
+    headers = {}
+    if has_snapshot:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        with perf.stage("download"):
+            response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+    except requests.RequestException as exc:
+        if has_snapshot:
+            logger.warning("Network error for %s, serving last snapshot: %s", url, exc)
+            return _read_snapshot(data_path) if read else data_path
+        raise DataUnavailableError(f"Failed to download {url}") from exc
+
+    with response:
+        if response.status_code == 304 and has_snapshot:
+            meta["fetched_at"] = time.time()
+            _write_meta(meta_path, meta)
+            return _read_snapshot(data_path) if read else data_path
+
+        if response.status_code != 200:
+            if has_snapshot:
+                logger.warning("HTTP %s for %s, serving last snapshot", response.status_code, url)
+                return _read_snapshot(data_path) if read else data_path
+            raise DataUnavailableError(f"HTTP {response.status_code} for {url}")
+
+        try:
+            # Тело качается во время разбора, так что это сеть + парсинг
+            with perf.stage("download_parse") as timing:
+                df = _parse_stream(response)
+                timing["rows"] = len(df)
+        except (requests.RequestException, Urllib3HTTPError) as exc:
+            # Чтение response.raw поднимает исключения urllib3, а не requests
+            if has_snapshot:
+                logger.warning("Download of %s interrupted, serving last snapshot: %s", url, exc)
+                return _read_snapshot(data_path) if read else data_path
+            raise DataUnavailableError(f"Failed to download {url}") from exc
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    ingest.write_snapshot(df, data_path)
+    _write_meta(meta_path, {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    })
+    return df if read else data_path
+
+
+def invalidate(url: str = None):
+    """Drops the snapshot for `url`, or the whole cache if no url is given."""
+    if url is None:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        return
+    for path in _snapshot_paths(url):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def snapshot_path(url: str):
+    """Path of the Parquet snapshot currently stored for `url`, or None."""
+    path = _prebuilt_snapshot(url) or _snapshot_paths(url)[0]
+    return path if os.path.exists(path) else None
+
+
+def snapshot_version(url: str) -> str:
+    """
+    Identifier of the snapshot currently stored for `url`. It changes only
+    when a new snapshot is written, so it can key caches of derived data.
+    """
+    path = _prebuilt_snapshot(url) or _snapshot_paths(url)[0]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def fetch_all(urls, ttl: int = DEFAULT_TTL, offline: bool = OFFLINE) -> list:
+    """fetch_csv for several urls at once, in the same order as `urls`."""
+    urls = list(urls)
+    with ThreadPoolExecutor(max_workers=max(1, len(urls))) as pool:
+        # Стадии download/download_parse из потоков пула попадают в запуск вызывающего потока
+        return list(pool.map(perf.in_run(lambda url: fetch_csv(url, ttl=ttl, offline=offline)), urls))
+
+
+def fetch_snapshots(urls, ttl: int = DEFAULT_TTL, offline: bool = OFFLINE) -> list:
+    """fetch_snapshot for several urls at once, in the same order as `urls`."""
+    urls = list(urls)
+    with ThreadPoolExecutor(max_workers=max(1, len(urls))) as pool:
+        return list(pool.map(perf.in_run(lambda url: fetch_snapshot(url, ttl=ttl, offline=offline)), urls))
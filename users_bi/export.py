@@ -0,0 +1,255 @@
+"""
+Headless export of the Industry Overview for every sidebar filter.
+
+Every (country, company size) combination - plus "all countries" and
+"all sizes" - is computed with the same backend and metric catalog as the
+dashboard and written to its own directory:
+
+    <out>/<country>__<size>/
+        summary.json              KPIs, Tier A leaders, YoY insights
+        geo_counts.parquet, top_categories.parquet, top_topics.parquet
+        average__<metric>.parquet, yoy__<metric>.parquet
+        *.html                    static Plotly figures
+    <out>/plotly.min.js, topojson.js, topojson/   shared by the figures
+
+Combinations are spread over a process pool. A directory is renamed into
+place only when it is complete, so an interrupted run is resumed by
+running the same command again (--force recomputes everything).
+
+Usage:
+    python export.py --out exports
+    python export.py --out exports --workers 8 --countries Germany,France --sizes Large
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly.express as px
+import plotly.offline
+
+import backends
+import data_cache
+import geo_assets
+import render_prep
+from metric_catalog import AVERAGE_WINDOW_YEARS, PERFORMANCE_METRICS, TREND_METRICS, YOY_GAP_POLICY
+
+SOURCE_FILES = ("comparable_metrics.csv", "material_topics.csv", "industry_leaders.csv")
+ALL = "all"
+# Один plotly.js на всю выгрузку, HTML ссылаются на него относительным путем
+PLOTLY_JS = "plotly.min.js"
+# Геометрия карты рядом с plotly.js (geo_assets.copy_to), CDN недоступен
+GEO_CONFIG = {"topojsonURL": "../topojson/"}
+GEO_JS = "topojson.js"
+
+# Backend воркера: строится один раз в initializer, а не на каждую комбинацию
+_backend = None
+
+
+def slugify(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", str(text).lower()).strip("-") or "none"
+
+
+def combinations(countries: list, sizes: list) -> list:
+    """(country, size) pairs, ALL standing for every value of the sidebar filter."""
+    return [(country, size) for country in [ALL, *countries] for size in [ALL, *sizes]]
+
+
+def combination_dir(out_dir: str, country: str, size: str) -> str:
+    return os.path.join(out_dir, f"{slugify(country)}__{slugify(size)}")
+
+
+def write_figure(fig, path: str, geo: bool = False):
+    if not geo:
+        fig.write_html(path, include_plotlyjs=f"../{PLOTLY_JS}", full_html=True)
+        return
+    html = fig.to_html(include_plotlyjs=f"../{PLOTLY_JS}", full_html=True, config=GEO_CONFIG)
+    # Страница, открытая с диска, не может загрузить JSON - геометрия подключается скриптом
+    html = html.replace("<body>", f'<body>\n<script src="../{GEO_JS}"></script>', 1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+
+
+def export_views(backend, countries: list, sizes: list, out_dir: str) -> dict:
+    """Computes every dashboard view for one selection into `out_dir`, returns the summary."""
+    kpis = backend.kpi_counts(countries, sizes)
+    summary = {
+        "countries": countries,
+        "sizes": sizes,
+        "kpis": {name: value.item() if hasattr(value, "item") else value for name, value in kpis.items()},
+    }
+    if kpis["metric_count"] == 0:
+        return summary
+
+    df_geo = backend.geo_counts(countries, sizes)
+    df_geo.to_parquet(os.path.join(out_dir, "geo_counts.parquet"), index=False)
+    write_figure(
+        px.choropleth(df_geo, locations="country_iso3", color="company_count", hover_name="country",
+                      color_continuous_scale=px.colors.sequential.Plasma, title="Unique Companies by Country"),
+        os.path.join(out_dir, "geo.html"), geo=True,
+    )
+
+    df_categories, df_topics = backends.topic_rankings(backend, countries, sizes, kpis["company_count"])
+    df_categories = render_prep.drop_unused_categories(df_categories)
+    df_topics = render_prep.drop_unused_categories(df_topics)
+    df_categories.to_parquet(os.path.join(out_dir, "top_categories.parquet"), index=False)
+    df_topics.to_parquet(os.path.join(out_dir, "top_topics.parquet"), index=False)
+    if not df_categories.empty:
+        write_figure(
+            px.bar(df_categories, x="share_pct", y="category_name", orientation="h",
+                   title="Top 10 Categories by disclosure frequency"),
+            os.path.join(out_dir, "top_categories.html"),
+        )
+
+    summary["tier_a_companies"] = backends.tier_a_companies(backend, countries, sizes)
+
+    summary["averages"] = {}
+    for prefix, (metric_options, unit_label) in PERFORMANCE_METRICS.items():
+        for metric_name, sub_codes in metric_options.items():
+            df_avg = backend.latest_years_average(countries, sizes, sub_codes, n_years=AVERAGE_WINDOW_YEARS)
+            if df_avg.empty:
+                continue
+            name = f"{prefix}__{slugify(metric_name)}"
+            df_avg.to_parquet(os.path.join(out_dir, f"average__{name}.parquet"), index=False)
+            summary["averages"][metric_name] = {
+                "file": f"average__{name}.parquet",
+                "unit": unit_label,
+                "companies": len(df_avg),
+                "mean": df_avg["average_value"].mean(),
+                "median": df_avg["average_value"].median(),
+            }
+            df_bins = render_prep.histogram_bins(df_avg["average_value"])
+            fig = px.bar(df_bins, x="bin_mid", y="count", title=f"Histogram of Average {metric_name}",
+                         labels={"bin_mid": f"Average {unit_label}", "count": "Count"})
+            fig.update_traces(width=df_bins["bin_end"] - df_bins["bin_start"])
+            fig.update_layout(bargap=0)
+            write_figure(fig, os.path.join(out_dir, f"average__{name}.html"))
+
+    summary["trends"] = {}
+    for metric_name, sub_codes in TREND_METRICS.items():
+        df_changes, df_avg_yoy = backend.yoy_trend(countries, sizes, sub_codes, gap_policy=YOY_GAP_POLICY)
+        if df_changes.empty:
+            continue
+        name = slugify(metric_name)
+        df_avg_yoy.to_parquet(os.path.join(out_dir, f"yoy__{name}.parquet"), index=False)
+        summary["trends"][metric_name] = {
+            "file": f"yoy__{name}.parquet",
+            "overall_average_pct": df_avg_yoy["mean_yoy_change"].mean(),
+            "highest_growth_year": int(df_avg_yoy.loc[df_avg_yoy["mean_yoy_change"].idxmax(), "year"]),
+            "largest_decline_year": int(df_avg_yoy.loc[df_avg_yoy["mean_yoy_change"].idxmin(), "year"]),
+        }
+        fig = px.line(df_avg_yoy, x="year", y="mean_yoy_change", markers=True,
+                      title=f"Average Year-over-Year Change in {metric_name}",
+                      labels={"year": "Year", "mean_yoy_change": "Average YoY Change (%)"})
+        fig.add_hline(y=0, line_dash="dash", line_color="gray")
+        write_figure(fig, os.path.join(out_dir, f"yoy__{name}.html"))
+    return summary
+
+
+def _init_worker(df_metrics: pd.DataFrame, df_topics: pd.DataFrame, df_leaders: pd.DataFrame):
+    global _backend
+    _backend = backends.build_pandas_backend(df_metrics, df_topics, df_leaders)
+
+
+def export_combination(country: str, size: str, all_countries: list, all_sizes: list, out_dir: str) -> dict:
+    """Worker task: writes one combination directory, returns its summary."""
+    final_dir = combination_dir(out_dir, country, size)
+    tmp_dir = f"{final_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    countries = all_countries if country == ALL else [country]
+    sizes = all_sizes if size == ALL else [size]
+    start = time.perf_counter()
+    summary = export_views(_backend, countries, sizes, tmp_dir)
+    summary["seconds"] = time.perf_counter() - start
+
+    # summary.json пишется последним, каталог подменяется целиком - недописанных не бывает
+    with open(os.path.join(tmp_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+    return summary
+
+
+def is_done(out_dir: str, country: str, size: str) -> bool:
+    return os.path.exists(os.path.join(combination_dir(out_dir, country, size), "summary.json"))
+
+
+def run(out_dir: str, workers: int, countries: list = None, sizes: list = None, force: bool = False) -> int:
+    """Exports all combinations not exported yet, returns the number of failures."""
+    df_metrics, df_topics, df_leaders = data_cache.fetch_all(data_cache.source_url(name) for name in SOURCE_FILES)
+    all_countries = sorted(df_metrics['country'].unique())
+    all_sizes = sorted(df_metrics['company_size'].unique())
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, PLOTLY_JS), "w", encoding="utf-8") as f:
+        f.write(plotly.offline.get_plotlyjs())
+    geo_assets.copy_to(out_dir)
+
+    # Каталоги, недописанные прерванным запуском
+    for name in os.listdir(out_dir):
+        if name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+
+    pairs = combinations(countries or all_countries, sizes or all_sizes)
+    todo = [(country, size) for country, size in pairs if force or not is_done(out_dir, country, size)]
+    print(f"{len(pairs) - len(todo)} of {len(pairs)} combinations already exported, {len(todo)} to go")
+
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(df_metrics, df_topics, df_leaders)) as pool:
+        futures = {
+            pool.submit(export_combination, country, size, all_countries, all_sizes, out_dir): (country, size)
+            for country, size in todo
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            country, size = futures[future]
+            try:
+                summary = future.result()
+                status = f"{summary['kpis']['metric_count']:,} data points in {summary['seconds']:.1f} s"
+            except Exception as e:
+                failures += 1
+                status = f"FAILED: {e!r}"
+            elapsed = time.perf_counter() - start
+            eta = elapsed / done * (len(todo) - done)
+            print(f"[{done}/{len(todo)}] {country} / {size}: {status} (elapsed {elapsed:.0f} s, eta {eta:.0f} s)",
+                  flush=True)
+
+    manifest = [
+        {"country": country, "size": size, "dir": os.path.basename(combination_dir(out_dir, country, size))}
+        for country, size in pairs
+        if is_done(out_dir, country, size)
+    ]
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export every Industry Overview filter combination.")
+    parser.add_argument("--out", default="exports", help="Output directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--countries", help="Comma-separated countries (default: all)")
+    parser.add_argument("--sizes", help="Comma-separated company sizes (default: all)")
+    parser.add_argument("--force", action="store_true", help="Recompute combinations that are already exported")
+    args = parser.parse_args()
+
+    failures = run(
+        args.out,
+        args.workers,
+        countries=args.countries.split(",") if args.countries else None,
+        sizes=args.sizes.split(",") if args.sizes else None,
+        force=args.force,
+    )
+    if failures:
+        raise SystemExit(f"{failures} combinations failed, run again to retry them")
+
+
+if __name__ == "__main__":
+    main()
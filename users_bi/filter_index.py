@@ -0,0 +1,75 @@
+"""
+Shared index for the sidebar filter (country x company_size).
+
+Every row of every registered table is mapped once to an integer "cell"
+id of its (country, company_size) pair. A sidebar selection is turned into
+a small lookup table over cells, and the row mask is a single gather from
+it - no string comparisons. Masks are cached per selection, so reruns with
+an unchanged sidebar reuse them.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class FilterIndex:
+    def __init__(self, countries, sizes, max_cached_masks: int = 32):
+        self.countries = list(countries)
+        self.sizes = list(sizes)
+        self.max_cached_masks = max_cached_masks
+        self._cells = {}
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def n_cells(self) -> int:
+        # +1: код -1 (страна/размер не из справочника) получает свою ячейку,
+        # которая никогда не выбирается
+        return (len(self.countries) + 1) * (len(self.sizes) + 1)
+
+    def _cell_id(self, country_codes, size_codes):
+        return (country_codes + 1) * (len(self.sizes) + 1) + (size_codes + 1)
+
+    def add_table(self, name: str, df: pd.DataFrame, country_col: str = "country", size_col: str = "company_size"):
+        """Registers `df`; masks for it follow its current row order."""
+        country_codes = pd.Categorical(df[country_col], categories=self.countries).codes.astype(np.int32)
+        size_codes = pd.Categorical(df[size_col], categories=self.sizes).codes.astype(np.int32)
+        with self._lock:
+            self._cells[name] = self._cell_id(country_codes, size_codes)
+            # Старые маски для этой таблицы больше не валидны
+            for key in [key for key in self._masks if key[0] == name]:
+                del self._masks[key]
+
+    def _selected_cells(self, countries, sizes) -> np.ndarray:
+        country_pos = {country: i for i, country in enumerate(self.countries)}
+        size_pos = {size: i for i, size in enumerate(self.sizes)}
+        country_codes = np.array([country_pos[c] for c in countries if c in country_pos], dtype=np.int32)
+        size_codes = np.array([size_pos[s] for s in sizes if s in size_pos], dtype=np.int32)
+
+        selected = np.zeros(self.n_cells, dtype=bool)
+        if len(country_codes) and len(size_codes):
+            selected[self._cell_id(country_codes[:, None], size_codes[None, :]).ravel()] = True
+        return selected
+
+    def mask(self, name: str, countries, sizes) -> np.ndarray:
+        """Boolean row mask of table `name` for the given selection."""
+        key = (name, tuple(sorted(countries)), tuple(sorted(sizes)))
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+            cells = self._cells[name]
+
+        row_mask = self._selected_cells(countries, sizes)[cells]
+        row_mask.flags.writeable = False
+
+        with self._lock:
+            self._masks[key] = row_mask
+            while len(self._masks) > self.max_cached_masks:
+                self._masks.popitem(last=False)
+        return row_mask
+
+    def filter(self, name: str, df: pd.DataFrame, countries, sizes) -> pd.DataFrame:
+        return df[self.mask(name, countries, sizes)]
@@ -0,0 +1,181 @@
+"""
+Map geometry served by the dashboard itself instead of the plotly CDN.
+
+Plotly choropleths load the country outlines (topojson) in the browser from
+cdn.plot.ly by default. The deployment has no internet access, so the
+files are shipped with the app in static/topojson/. Streamlit serves
+static/ under app/static/ when server.enableStaticServing is on
+(.streamlit/config.toml and serve.py turn it on), and the charts get a
+plotly config pointing there. Without the files or static serving the map
+shows an error instead of silently going to the CDN.
+
+The files are refreshed from a machine with internet access with
+
+    python geo_assets.py                               plotly's own files from the CDN
+    python geo_assets.py --natural-earth countries.shp  built from a Natural Earth shapefile
+
+The bundled world_110m.json is built from the Natural Earth 1:110m admin-0
+countries (public domain): country outlines with ISO-3 ids, land and
+coastlines; the layers plotly only draws on request (ocean, lakes, rivers,
+subunits) are empty.
+"""
+import argparse
+import functools
+import json
+import os
+
+import requests
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+TOPOJSON_DIR = os.path.join(STATIC_DIR, "topojson")
+# Относительный URL: работает и при server.baseUrlPath
+TOPOJSON_URL = "app/static/topojson/"
+# Значение topojsonURL по умолчанию в plotly.js 3
+CDN_URL = "https://cdn.plot.ly/un/"
+# <scope>_<resolution>m.json; px.choropleth рисует scope world с разрешением 110
+TOPOJSON_FILES = ("world_110m.json",)
+# Слои, которые plotly.js читает из topojson (locationmode ISO-3 -> countries)
+TOPOJSON_LAYERS = ("countries", "subunits", "land", "coastlines", "ocean", "lakes", "rivers")
+
+
+class MapGeometryError(RuntimeError):
+    """Raised when the bundled map geometry is missing or cannot be served."""
+
+
+def bundled() -> bool:
+    return all(os.path.exists(os.path.join(TOPOJSON_DIR, name)) for name in TOPOJSON_FILES)
+
+
+@functools.lru_cache(maxsize=2)
+def plotly_config(static_serving: bool) -> dict:
+    """`config` for st.plotly_chart pointing plotly at the bundled topojson."""
+    if not bundled():
+        raise MapGeometryError(f"Map geometry is missing in {TOPOJSON_DIR}, run 'python geo_assets.py'")
+    if not static_serving:
+        raise MapGeometryError("Map geometry needs server.enableStaticServing=true (see .streamlit/config.toml)")
+    return {"topojsonURL": TOPOJSON_URL}
+
+
+def copy_to(out_dir: str) -> str:
+    """
+    Copies the geometry next to exported HTML: `<out_dir>/topojson/` for the
+    topojsonURL config, and `<out_dir>/topojson.js` preloading it for pages
+    opened from disk (browsers do not fetch JSON over file://).
+    """
+    if not bundled():
+        raise MapGeometryError(f"Map geometry is missing in {TOPOJSON_DIR}, run 'python geo_assets.py'")
+    os.makedirs(os.path.join(out_dir, "topojson"), exist_ok=True)
+    lines = ["window.PlotlyGeoAssets = window.PlotlyGeoAssets || {topojson: {}};"]
+    for name in TOPOJSON_FILES:
+        with open(os.path.join(TOPOJSON_DIR, name), encoding="utf-8") as f:
+            content = f.read()
+        with open(os.path.join(out_dir, "topojson", name), "w", encoding="utf-8") as f:
+            f.write(content)
+        # plotly.js ищет уже загруженную геометрию в PlotlyGeoAssets.topojson[<scope>_<resolution>m]
+        lines.append(f"window.PlotlyGeoAssets.topojson[{json.dumps(name[:-len('.json')])}] = {content};")
+    path = os.path.join(out_dir, "topojson.js")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def _write(path: str, content: bytes):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def download(base_url: str = CDN_URL, out_dir: str = TOPOJSON_DIR) -> list:
+    """Downloads the topojson files into `out_dir`, returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for name in TOPOJSON_FILES:
+        response = requests.get(base_url + name, timeout=(5, 60))
+        response.raise_for_status()
+        path = os.path.join(out_dir, name)
+        _write(path, response.content)
+        paths.append(path)
+    return paths
+
+
+def build_topology(shapefile_path: str, precision: int = 3) -> dict:
+    """
+    Topojson in plotly's layout from a Natural Earth admin-0 shapefile
+    (fields iso_a3 and name). Arcs are not shared or quantized: one arc per
+    ring, which plotly.js reads like any other topology.
+    """
+    # Нужны только для пересборки файла, приложению не требуются
+    import shapefile
+    from shapely.geometry import mapping, shape
+    from shapely.geometry.polygon import orient
+    from shapely.ops import unary_union
+
+    arcs = []
+
+    def add_arc(coords) -> int:
+        arcs.append([[round(x, precision), round(y, precision)] for x, y in coords])
+        return len(arcs) - 1
+
+    def polygon_arcs(polygon) -> list:
+        # d3-geo (и plotly.js) ждет внешнее кольцо по часовой стрелке
+        polygon = orient(polygon, sign=-1.0)
+        return [[add_arc(polygon.exterior.coords)], *([add_arc(ring.coords)] for ring in polygon.interiors)]
+
+    def area_geometry(geometry, **extra) -> dict:
+        polygons = list(geometry.geoms) if geometry.geom_type == "MultiPolygon" else [geometry]
+        if len(polygons) == 1:
+            return {"type": "Polygon", "arcs": polygon_arcs(polygons[0]), **extra}
+        return {"type": "MultiPolygon", "arcs": [polygon_arcs(p) for p in polygons], **extra}
+
+    countries, shapes = [], []
+    for record in shapefile.Reader(shapefile_path).iterShapeRecords():
+        geometry = shape(record.shape.__geo_interface__)
+        shapes.append(geometry)
+        iso3 = record.record["iso_a3"]
+        # "-99": территории без кода ISO (Косово, Сомалиленд) - к ним нечего привязать
+        if iso3 == "-99":
+            continue
+        centroid = geometry.representative_point()
+        countries.append(area_geometry(geometry, id=iso3, properties={
+            "name": record.record["name"],
+            "ct": [round(centroid.x, 2), round(centroid.y, 2)],
+        }))
+
+    land = unary_union(shapes)
+    boundary = mapping(land.boundary)
+    lines = boundary["coordinates"] if boundary["type"] == "MultiLineString" else [boundary["coordinates"]]
+    empty = {"type": "GeometryCollection", "geometries": []}
+    objects = {layer: empty for layer in TOPOJSON_LAYERS}
+    objects.update({
+        "countries": {"type": "GeometryCollection", "geometries": countries},
+        "land": {"type": "GeometryCollection", "geometries": [area_geometry(land)]},
+        "coastlines": {"type": "GeometryCollection", "geometries": [
+            {"type": "MultiLineString", "arcs": [[add_arc(line)] for line in lines]},
+        ]},
+    })
+    return {"type": "Topology", "objects": objects, "arcs": arcs}
+
+
+def build(shapefile_path: str, out_dir: str = TOPOJSON_DIR) -> list:
+    """Writes world_110m.json built from `shapefile_path` into `out_dir`."""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "world_110m.json")
+    _write(path, json.dumps(build_topology(shapefile_path), separators=(",", ":")).encode("utf-8"))
+    return [path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bundle the plotly map geometry with the app.")
+    parser.add_argument("--base-url", default=CDN_URL, help="Where to download the topojson files from")
+    parser.add_argument("--natural-earth", metavar="SHP",
+                        help="Build world_110m.json from a Natural Earth admin-0 shapefile instead")
+    parser.add_argument("--out", default=TOPOJSON_DIR, help="Output directory")
+    args = parser.parse_args()
+    paths = build(args.natural_earth, args.out) if args.natural_earth else download(args.base_url, args.out)
+    for path in paths:
+        print(f"{path}: {os.path.getsize(path) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+Incremental ingest of the append-only source tables.
+
+Every report is a new bundle_id and reports are only ever added, so
+comparable_metrics and material_topics only grow. Instead of downloading
+and parsing them in full on every refresh, each of them gets a local store:
+
+    <CACHE_DIR>/incremental/<table>/
+        part-00000.parquet, ...   rows added by one refresh each
+        cube-00000.parquet        metric cube (comparable_metrics only)
+        state.json                watermark, byte offset, KPI accumulators
+
+A refresh asks only for the bytes after the stored offset (HTTP Range with
+a small overlap; its hash proves the file was only appended to), and all
+complete lines in them are new rows. The body is streamed into the CSV
+parser, never held in memory as a whole. If the server ignores Range, the
+bytes before the offset are skipped as they arrive. If the overlap shows
+the file was rewritten, the store is built again from the whole file.
+The metric cube and the KPI counts are updated from the new rows only.
+
+Turned on with USERS_BI_INCREMENTAL=1. Other tables, and everything when
+the mode is off, go through data_cache as before.
+"""
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+
+import analytics
+import data_cache
+import ingest
+import perf
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("USERS_BI_INCREMENTAL", "0") == "1"
+STORE_DIR = os.path.join(data_cache.CACHE_DIR, "incremental")
+METRICS_TABLE = "comparable_metrics"
+# Таблицы, в которые новые отчеты только дописываются
+INCREMENTAL_TABLES = (METRICS_TABLE, "material_topics")
+# Сколько байт перед offset запрашивается повторно для проверки, что файл только дописали
+OVERLAP_BYTES = 4096
+# Когда частей больше, они сливаются в одну
+MAX_PARTS = 16
+# Размер куска при чтении ответа
+CHUNK_BYTES = 1 << 20
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def table_name(url: str) -> str:
+    return os.path.splitext(os.path.basename(url))[0]
+
+
+def is_incremental(url: str) -> bool:
+    return table_name(url) in INCREMENTAL_TABLES
+
+
+def _store_dir(url: str) -> str:
+    return os.path.join(STORE_DIR, table_name(url))
+
+
+def _lock(url: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(table_name(url), threading.Lock())
+
+
+def _read_state(store_dir: str) -> dict:
+    try:
+        with open(os.path.join(store_dir, "state.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(store_dir: str, state: dict):
+    # state.json пишется последним: пока он не подменен, читатели видят старые части
+    path = os.path.join(store_dir, "state.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _load_parts(store_dir: str, state: dict) -> pd.DataFrame:
+    frames = [ingest.read_snapshot(os.path.join(store_dir, part)) for part in state["parts"]]
+    # У частей разные словари категорий, concat дает object -> снова category
+    return ingest.optimize_dtypes(pd.concat(frames, ignore_index=True))
+
+
+def _skip(chunks, size: int):
+    """
+    Consumes the first `size` bytes of `chunks`. Returns the last
+    OVERLAP_BYTES of them (None if the body is shorter) and the rest.
+    """
+    kept = b""
+    for chunk in chunks:
+        if len(chunk) >= size:
+            kept = (kept + chunk[max(0, size - OVERLAP_BYTES):size])[-OVERLAP_BYTES:]
+            return kept, itertools.chain([chunk[size:]], chunks)
+        kept = (kept + chunk[-OVERLAP_BYTES:])[-OVERLAP_BYTES:]
+        size -= len(chunk)
+    return None, chunks
+
+
+def _first_line(chunks):
+    """The first line of `chunks` (the CSV header, empty if unfinished) and the rest."""
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        end = head.find(b"\n") + 1
+        if end:
+            return head[:end], itertools.chain([head[end:]], chunks)
+    return b"", iter([head])
+
+
+class _CompleteLines(io.RawIOBase):
+    """
+    Read-only stream for pd.read_csv: `header`, then the body chunks up to
+    the last complete line. An unfinished last line is held back and read
+    again on the next refresh. `size` counts the body bytes passed on and
+    `tail` keeps the last OVERLAP_BYTES before them (starting from `tail`).
+    """
+
+    def __init__(self, chunks, header: bytes, tail: bytes):
+        self._chunks = chunks
+        self._pending = memoryview(header)
+        self._held = b""
+        self.size = 0
+        self.tail = tail
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            data = self._held + chunk if self._held else chunk
+            cut = data.rfind(b"\n") + 1
+            self._held = data[cut:]
+            if cut:
+                self.size += cut
+                self.tail = (self.tail + data[max(0, cut - OVERLAP_BYTES):cut])[-OVERLAP_BYTES:]
+                self._pending = memoryview(data)[:cut]
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _get(url: str, headers: dict) -> requests.Response:
+    # Смещения в байтах имеют смысл только для несжатого файла
+    return data_cache.get_session().get(url, headers={"Accept-Encoding": "identity", **headers},
+                                        timeout=data_cache.REQUEST_TIMEOUT, stream=True)
+
+
+def _download(url: str, state: dict):
+    """
+    Opens the body of `url`. Returns (response, chunks, overlap): with
+    `overlap` (the OVERLAP_BYTES before the stored offset) the file was only
+    appended to and `chunks` start at the offset; with None `chunks` are
+    the whole file.
+    """
+    offset = state.get("offset", 0)
+    if offset:
+        body_start = max(0, offset - OVERLAP_BYTES)
+        response = _get(url, {"Range": f"bytes={body_start}-"})
+        if response.status_code in (200, 206):
+            if response.status_code == 200:
+                # Сервер не поддерживает Range и прислал весь файл: уже прочитанное пропускаем
+                body_start = 0
+            overlap, chunks = _skip(response.iter_content(CHUNK_BYTES), offset - body_start)
+            if overlap is not None and hashlib.sha1(overlap).hexdigest() == state.get("tail_sha"):
+                return response, chunks, overlap
+            logger.info("%s was rewritten, reading it in full", url)
+        elif response.status_code != 416:
+            response.close()
+            raise data_cache.DataUnavailableError(f"HTTP {response.status_code} for {url}")
+        response.close()
+
+    response = _get(url, {})
+    if response.status_code != 200:
+        response.close()
+        raise data_cache.DataUnavailableError(f"HTTP {response.status_code} for {url}")
+    return response, response.iter_content(CHUNK_BYTES), None
+
+
+def _parse_new_rows(chunks, overlap, state: dict):
+    """New rows of the file (complete lines only) and the state fields describing what was read."""
+    if overlap is not None:
+        header, offset, tail = state["header"].encode("utf-8"), state["offset"], overlap
+    else:
+        header, chunks = _first_line(chunks)
+        offset, tail = len(header), header[-OVERLAP_BYTES:]
+
+    lines = _CompleteLines(chunks, header, tail)
+    try:
+        df_new = pd.read_csv(io.BufferedReader(lines, CHUNK_BYTES), dtype=ingest.CSV_DTYPES, low_memory=True)
+    except pd.errors.EmptyDataError:
+        # Пустой файл или недописанный заголовок
+        df_new = None
+    return (
+        ingest.optimize_dtypes(df_new) if df_new is not None else None,
+        {
+            "offset": offset + lines.size,
+            "tail_sha": hashlib.sha1(lines.tail).hexdigest(),
+            "header": header.decode("utf-8"),
+        },
+    )
+
+
+def _update_kpis(kpi: dict, df_new: pd.DataFrame) -> dict:
+    """KPI accumulators (see analytics.kpi_counts) updated with the new rows."""
+    # Строки без страны или размера не проходят ни один фильтр в сайдбаре
+    df_new = df_new[df_new["country"].notna() & df_new["company_size"].notna()]
+    if df_new.empty:
+        return kpi
+    # Бандл может прийти не по порядку или дописываться частями - считаем множества, а не прирост
+    bundle_ids = set(kpi.get("bundle_ids", [])) | set(df_new["bundle_id"].astype(int).tolist())
+    company_ids = set(kpi.get("company_ids", [])) | set(df_new["company_id"].astype(int).tolist())
+    countries = set(kpi.get("countries", [])) | set(df_new["country"].astype(str).tolist())
+    min_year, max_year = int(df_new["year"].min()), int(df_new["year"].max())
+    return {
+        "metric_count": kpi.get("metric_count", 0) + len(df_new),
+        "bundle_ids": sorted(bundle_ids),
+        "company_ids": sorted(company_ids),
+        "countries": sorted(countries),
+        "min_year": min(kpi.get("min_year", min_year), min_year),
+        "max_year": max(kpi.get("max_year", max_year), max_year),
+    }
+
+
+def _merge_cube(store_dir: str, state: dict, df_new: pd.DataFrame) -> str:
+    df_cube = analytics.build_metric_cube(df_new)
+    if state.get("cube"):
+        df_old = ingest.read_snapshot(os.path.join(store_dir, state["cube"]))
+        df_all = ingest.optimize_dtypes(pd.concat([df_old, df_cube], ignore_index=True))
+        df_cube = (
+            df_all.astype({"value": "float64"})
+            .groupby(analytics.CUBE_KEYS, observed=True)["value"]
+            .sum()
+            .reset_index()
+        )
+    cube_name = f"cube-{state['version']:05d}.parquet"
+    ingest.write_snapshot(df_cube, os.path.join(store_dir, cube_name))
+    return cube_name
+
+
+def _append(url: str, store_dir: str, state: dict, df_new: pd.DataFrame) -> dict:
+    state = dict(state, version=state.get("version", -1) + 1)
+    parts = list(state.get("parts", []))
+    part_name = f"part-{state['version']:05d}.parquet"
+    ingest.write_snapshot(df_new, os.path.join(store_dir, part_name))
+    parts.append(part_name)
+
+    if len(parts) > MAX_PARTS:
+        part_name = f"part-{state['version']:05d}-all.parquet"
+        ingest.write_snapshot(_load_parts(store_dir, {"parts": parts}), os.path.join(store_dir, part_name))
+        parts = [part_name]
+
+    if table_name(url) == METRICS_TABLE:
+        state["cube"] = _merge_cube(store_dir, state, df_new)
+        state["kpi"] = _update_kpis(state.get("kpi", {}), df_new)
+    state["parts"] = parts
+    state["watermark"] = max(state.get("watermark", -1), int(df_new["bundle_id"].max()))
+    return state
+
+
+def _remove_unreferenced(store_dir: str, state: dict):
+    keep = set(state.get("parts", [])) | {state.get("cube"), "state.json"}
+    for name in os.listdir(store_dir):
+        if name.endswith(".parquet") and name not in keep:
+            os.remove(os.path.join(store_dir, name))
+
+
+def _refresh(url: str, store_dir: str, state: dict) -> pd.DataFrame:
+    with perf.stage("download"):
+        response, chunks, overlap = _download(url, state)
+    with response, perf.stage("download_parse") as timing:
+        df_new, read_state = _parse_new_rows(chunks, overlap, state)
+        timing["rows"] = 0 if df_new is None else len(df_new)
+
+    if overlap is None and state.get("parts"):
+        # Файл переписан: прежние части, куб и KPI больше ему не соответствуют, собираем заново
+        logger.info("%s: rebuilding the store from the whole file", url)
+        state = {"version": state["version"]}
+    if df_new is not None and not df_new.empty:
+        logger.info("%s: %d new rows", url, len(df_new))
+        state = _append(url, store_dir, state, df_new)
+
+    state.update(read_state, fetched_at=time.time())
+    _write_state(store_dir, state)
+    _remove_unreferenced(store_dir, state)
+    if not state.get("parts"):
+        raise data_cache.DataUnavailableError(f"No rows in {url}")
+    return _load_parts(store_dir, state)
+
+
+def fetch_csv(url: str, ttl: int = data_cache.DEFAULT_TTL, offline: bool = data_cache.OFFLINE) -> pd.DataFrame:
+    """
+    data_cache.fetch_csv for the append-only tables: only rows appended
+    since the last refresh are downloaded and parsed.
+    """
+    if not is_incremental(url):
+        return data_cache.fetch_csv(url, ttl=ttl, offline=offline)
+
+    store_dir = _store_dir(url)
+    with _lock(url):
+        state = _read_state(store_dir)
+        has_store = bool(state.get("parts"))
+        if has_store and (offline or time.time() - state.get("fetched_at", 0) < ttl):
+            return _load_parts(store_dir, state)
+        if offline:
+            raise data_cache.DataUnavailableError(f"Offline mode and no local store for {url}")
+
+        os.makedirs(store_dir, exist_ok=True)
+        try:
+            return _refresh(url, store_dir, state)
+        except (requests.RequestException, data_cache.DataUnavailableError) as exc:
+            if has_store:
+                logger.warning("Incremental refresh of %s failed, serving stored rows: %s", url, exc)
+                return _load_parts(store_dir, state)
+            if isinstance(exc, data_cache.DataUnavailableError):
+                raise
+            raise data_cache.DataUnavailableError(f"Failed to download {url}") from exc
+
+
+def fetch_all(urls, ttl: int = data_cache.DEFAULT_TTL, offline: bool = data_cache.OFFLINE) -> list:
+    """fetch_csv for several urls at once, in the same order as `urls`."""
+    urls = list(urls)
+    with ThreadPoolExecutor(max_workers=max(1, len(urls))) as pool:
+        # Стадии download/download_parse из потоков пула попадают в запуск вызывающего потока
+        return list(pool.map(perf.in_run(lambda url: fetch_csv(url, ttl=ttl, offline=offline)), urls))
+
+
+def metric_cube(url: str) -> pd.DataFrame:
+    """The metric cube (analytics.build_metric_cube) kept up to date by the refreshes."""
+    # Под блокировкой: обновление может как раз удалять файл прошлого куба
+    with _lock(url):
+        state = _read_state(_store_dir(url))
+        if not state.get("cube"):
+            raise data_cache.DataUnavailableError(f"No incremental store for {url}")
+        return ingest.read_snapshot(os.path.join(_store_dir(url), state["cube"]))
+
+
+def kpi_counts(url: str) -> dict:
+    """analytics.kpi_counts over the whole metrics table, from the stored accumulators."""
+    with _lock(url):
+        kpi = _read_state(_store_dir(url)).get("kpi")
+    if not kpi:
+        raise data_cache.DataUnavailableError(f"No incremental store for {url}")
+    return {
+        "metric_count": kpi["metric_count"],
+        "bundle_count": len(kpi["bundle_ids"]),
+        "company_count": len(kpi["company_ids"]),
+        "country_count": len(kpi["countries"]),
+        "min_year": kpi["min_year"],
+        "max_year": kpi["max_year"],
+    }
+
+
+def snapshot_version(url: str) -> str:
+    """data_cache.snapshot_version for both kinds of tables."""
+    if not is_incremental(url):
+        return data_cache.snapshot_version(url)
+    state = _read_state(_store_dir(url))
+    if not state.get("parts"):
+        return "missing"
+    return f"inc-{state['version']}-{state['watermark']}"
+
+
+def invalidate(url: str):
+    """
+    Makes the next fetch_csv go to the network. The incremental store is
+    kept, so only new bundles are downloaded; other tables are dropped.
+    """
+    if not is_incremental(url):
+        data_cache.invalidate(url)
+        return
+    store_dir = _store_dir(url)
+    with _lock(url):
+        state = _read_state(store_dir)
+        if state:
+            _write_state(store_dir, dict(state, fetched_at=0))
+
+
+def rebuild(url: str):
+    """Drops the incremental store of `url`; the next fetch reads the whole file again."""
+    with _lock(url):
+        shutil.rmtree(_store_dir(url), ignore_errors=True)
@@ -1,32 +1,229 @@
-import streamlit as st
-import pandas as pd
-import numpy as np
-import plotly.express as px
-import altair as alt
-import requests
-from io import StringIO
+import functools
+import hashlib
+
+import perf
+
+# Тайминги этого запуска скрипта (панель отладки, лог, метрики)
+perf.start_run()
+
+# Первый запуск скрипта в процессе платит за импорт, дальше модули уже в sys.modules.
+# plotly.express и altair импортируются внутри вкладок - KPI видны раньше
+with perf.stage("imports"):
+    import streamlit as st
+    import pandas as pd
+    import numpy as np
+
+    import analytics
+    import backends
+    import data_cache
+    import incremental
+    import geo_assets
+    import ingest
+    import partitions
+    import peer_index
+    import percentiles
+    import render_prep
+    import result_cache
+    import shared_store
+    from filter_index import FilterIndex
+    from metric_catalog import (
+        AVERAGE_WINDOW_YEARS, COMPARE_METRICS, ENERGY_METRICS, TREND_METRICS, WASTE_METRICS, WATER_METRICS,
+        YOY_GAP_POLICY,
+    )
 
+# Сколько похожих компаний показывать
+PEER_COUNT = 10
+# С кем сравнивается выбранная компания в Performance: название -> tiers (None - все)
+PEER_GROUPS = {
+    "All companies": None,
+    "Tier A leaders": ["A"],
+    "Tier B leaders": ["B"],
+    "Non-leaders": [percentiles.NO_TIER],
+}
+
+
+
+@st.cache_data(ttl=data_cache.DEFAULT_TTL, show_spinner="Loading data...")
+def load_original_data(urls):
+    # Память (st.cache_data, общая для всех сессий) -> снапшот на диске -> сеть;
+    # все таблицы качаются параллельно, в инкрементальном режиме - только новые отчеты
+    loader = incremental if incremental.ENABLED else data_cache
+    try:
+        return loader.fetch_all(urls)
+    except data_cache.DataUnavailableError:
+        st.error("Failed to load data from GitHub.")
+        st.stop()
 
 
-def load_original_data(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return pd.read_csv(StringIO(response.text))
-    else:
+@st.cache_data(ttl=data_cache.DEFAULT_TTL, show_spinner="Loading data...")
+def load_snapshot_paths(urls):
+    # Как load_original_data, но только обновляет Parquet-снапшоты на диске: DuckDB читает их сам
+    try:
+        return data_cache.fetch_snapshots(urls)
+    except data_cache.DataUnavailableError:
         st.error("Failed to load data from GitHub.")
+        st.stop()
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def build_metric_cube(_df_metrics: pd.DataFrame, url: str, snapshot_version: str):
+    # Куб строится один раз на снапшот и общий для всех сессий;
+    # _df_metrics не хэшируется, ключом служит snapshot_version
+    if incremental.ENABLED:
+        # Куб уже обновлен по новым отчетам при загрузке
+        return incremental.metric_cube(url)
+    return analytics.build_metric_cube(_df_metrics)
+
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def build_company_tables(_df_metrics: pd.DataFrame, _df_topics: pd.DataFrame, _df_leaders: pd.DataFrame,
+                         snapshot_key: tuple):
+    # Справочник компаний + company_id/company_size в df_topics и df_leaders (один раз на снапшот)
+    df_company_dim = ingest.build_company_dim(_df_metrics, _df_topics, _df_leaders)
+    return (
+        df_company_dim,
+        ingest.attach_company_keys(_df_topics, df_company_dim),
+        ingest.attach_company_keys(_df_leaders, df_company_dim),
+    )
+
+
+@st.cache_resource(show_spinner="Opening snapshot...", max_entries=1)
+def build_duckdb_backend(paths: tuple, snapshot_key: tuple):
+    # Таблицы не загружаются в pandas: DuckDB читает Parquet-снапшоты с диска, справочник
+    # компаний и значения фильтров сайдбара тоже считаются в SQL (один раз на снапшот)
+    backend = backends.DuckDBBackend.from_parquet(*paths)
+    return backend, backend.company_dim(), backend.filter_values()
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    # Один кэш результатов на процесс, общий для всех сессий
+    return result_cache.ResultCache()
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def build_backend(_tables: dict, _df_company_dim: pd.DataFrame, snapshot_key: tuple, urls: tuple):
+    # Один backend на снапшот; фильтры сайдбара передаются в каждый запрос.
+    # Одна запись: после смены снапшота старый backend (и отображение общего снимка,
+    # на которое ссылаются его таблицы) освобождается, память воркера не растет
+    if backends.BACKEND == "duckdb":
+        # Фреймы уже в памяти (общий снимок или инкрементальное хранилище) - DuckDB читает их без копии
+        return backends.DuckDBBackend.from_frames(
+            _tables['metrics'], _tables['topics'], _tables['leaders'], _df_company_dim
+        )
+    tables = {
+        'metrics': _tables['metrics'],
+        # Куб company_id x year x sub_code; в общем снимке он уже посчитан
+        'cube': _tables['cube'] if 'cube' in _tables else build_metric_cube(_tables['metrics'], urls[0], snapshot_key[0]),
+        # Уникальные компании по ячейкам страна x размер для карты
+        'geo_cells': _tables['geo_cells'] if 'geo_cells' in _tables else analytics.build_geo_cells(_tables['metrics']),
+        'topics': _tables['topics_merged'],
+        'leaders': _tables['leaders_merged'],
+    }
+    return backends.PandasBackend(tables, build_filter_index(tables, snapshot_key))
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_partition_store(version: str):
+    # Один store на версию снимка: новая версия в manifest.json подменяет старую целиком
+    return partitions.PartitionStore(manifest=partitions.read_manifest())
+
+
+@st.cache_resource(show_spinner="Opening shared snapshot...", max_entries=1)
+def get_shared_snapshot(version: str):
+    # Одна версия на процесс: после публикации новой старое отображение освобождается
+    return shared_store.SharedSnapshot(manifest=shared_store.read_manifest())
+
+
+# Одна запись: индекс прошлого снапшота (или прошлого набора отраслей) освобождается,
+# как только построен новый, и не живет дольше выгруженных отраслей PartitionStore
+@st.cache_resource(show_spinner="Building peer index...", max_entries=1)
+def build_peer_index(_backend, _df_company_dim: pd.DataFrame, snapshot_key: tuple, everything: tuple):
+    # Векторы компаний и их ближайшие соседи считаются один раз на снапшот и набор отраслей
+    with perf.stage("peer_index") as timing:
+        df_features = peer_index.company_features(_backend, *everything, n_years=AVERAGE_WINDOW_YEARS)
+        index = peer_index.PeerIndex(df_features, _df_company_dim[['company', 'country', 'company_size', 'industry']])
+        timing["rows"] = len(index)
+    return index
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def build_percentile_index(_backend, _df_company_dim: pd.DataFrame, snapshot_key: tuple, everything: tuple,
+                           sub_codes: tuple, n_years: int):
+    # Отсортированные средние по ячейкам (country, size, tier), один раз на снапшот и метрику
+    with perf.stage("percentile_index") as timing:
+        df_avg = _backend.latest_years_average(*everything, list(sub_codes), n_years=n_years)
+        index = percentiles.PercentileIndex(df_avg, _df_company_dim)
+        timing["rows"] = len(index)
+    return index
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def build_filter_index(_tables: dict, snapshot_key: tuple):
+    # Один индекс на снапшот, маски внутри кэшируются по выбору в сайдбаре
+    index = FilterIndex(
+        countries=sorted(_tables['metrics']['country'].unique()),
+        sizes=sorted(_tables['metrics']['company_size'].unique()),
+    )
+    for name, df in _tables.items():
+        index.add_table(name, df)
+    return index
+
+
+
+def render_company_percentile(key_prefix: str, companies: pd.Series, unit_label: str, percentile_index,
+                              selection: tuple):
+    """
+    Выбор компании и ее перцентиль среди компаний сайдбара (и выбранной группы tier).
+    Возвращает (company, value) для подсветки на графиках или None.
+    """
+    col_company, col_peers = st.columns([3, 2])
+    company = col_company.selectbox(
+        "Highlight company",
+        sorted(companies.astype(str)),
+        index=None,
+        placeholder="Choose a company to see its percentile",
+        key=f"{key_prefix}_highlight",
+    )
+    peer_group = col_peers.selectbox("Peer group", list(PEER_GROUPS), key=f"{key_prefix}_peer_group")
+    if company is None:
         return None
-        
-        
+
+    with perf.stage(f"percentile:{key_prefix}"):
+        result = percentile_index.percentile(company, *selection, tiers=PEER_GROUPS[peer_group])
+    if result is None:
+        st.info(f"No companies in the '{peer_group}' group for the selected filters.")
+        return None
+
+    cols = st.columns(3)
+    cols[0].metric(f"Average ({unit_label})", f"{result['value']:,.2f}")
+    cols[1].metric("Percentile", f"{result['percentile']:.0f}")
+    cols[2].metric("Rank (highest first)", f"{result['rank']} of {result['total']}")
+    return company, result['value']
+
+
+def highlight_company(fig, highlight):
+    # Вертикальная линия на значении выбранной компании
+    if highlight is not None:
+        company, value = highlight
+        fig.add_vline(x=value, line_dash="dash", line_color="orange", annotation_text=company)
+
+
+@st.fragment
 def create_performance_analytics_tab(
-        df_filtered: pd.DataFrame,
+        backend,
+        selection: tuple,
         metric_options: dict,
         metric_key_prefix: str,
         unit_label: str,
-        tier_a_leaders_list: list
+        tier_a_leaders_list: list,
+        get_percentile_index,
+        n_years: int = AVERAGE_WINDOW_YEARS,
 ):
     """
     Генерирует одну подвкладку (GHG, Energy, Waste, Water)
     """
+    import plotly.express as px  # импорт при первой отрисовке вкладки
 
     # 1. Выбор метрики
     selected_metric_name = st.radio(
@@ -36,53 +233,31 @@ def create_performance_analytics_tab(
     )
     selected_sub_codes = metric_options[selected_metric_name]
 
-    # 2. Фильтрация данных
-    df_metric = df_filtered[
-        (df_filtered["sub_code"].isin(selected_sub_codes))
-    ].copy()
+    # 2-3. Суммы по компании и году и средние за последние n_years лет
+    # (один проход по всем компаниям)
+    with perf.stage(f"average:{metric_key_prefix}") as timing:
+        df_avg_results = backend.latest_years_average(*selection, selected_sub_codes, n_years=n_years)
+        timing["rows"] = len(df_avg_results)
 
-    if df_metric.empty:
+    if df_avg_results.empty:
         st.warning(f"No data found for '{selected_metric_name}'.")
         return  # Выходим, если данных нет
 
-    # 3. Расчет средних (ВАШ СУЩЕСТВУЮЩИЙ КОД)
-    df_annual_sums = (
-        df_metric.groupby(["company", "year"])["value"].sum().reset_index()
+    df_avg_results['Company Type'] = np.where(
+        df_avg_results['company'].isin(tier_a_leaders_list), "Tier A Leader", "Other Company"
     )
-    company_averages = []
-    for company in df_annual_sums["company"].unique():
-        df_company_data = df_annual_sums[
-            df_annual_sums["company"] == company
-            ].sort_values(by="year", ascending=False)
-        latest_3_values = df_company_data.head(3)["value"]
-        if not latest_3_values.empty:
-            avg_value = latest_3_values.mean()
-            company_averages.append(
-                {
-                    "company": company,
-                    "average_value": avg_value,  # Используем общее имя
-                    "years_of_data": len(latest_3_values),
-                }
-            )
 
-    if not company_averages:
-        st.warning("Not enough data to calculate averages.")
-        return
+    st.subheader(f"Average {selected_metric_name} Distribution")
 
-    df_avg_results = pd.DataFrame(company_averages).sort_values(
-        by="average_value", ascending=False
+    # Перцентиль - бинарный поиск в заранее отсортированных значениях, без пересчета средних
+    highlight = render_company_percentile(
+        metric_key_prefix,
+        df_avg_results['company'],
+        unit_label,
+        get_percentile_index(tuple(selected_sub_codes), n_years),
+        selection,
     )
 
-    def get_company_type(company_name):
-        if company_name in tier_a_leaders_list:
-            return "Tier A Leader"
-        else:
-            return "Other Company"
-
-    df_avg_results['Company Type'] = df_avg_results['company'].apply(get_company_type)
-
-    st.subheader(f"Average {selected_metric_name} Distribution")
-
     # 4. Выбор типа графика
     chart_type = st.radio(
         "Выберите тип графика:",
@@ -94,87 +269,97 @@ def create_performance_analytics_tab(
 
     # 5. Отрисовка графиков (ВАШ КОД, но с 'average_value' и unit_label)
 
-    if chart_type == "Histogram":
-        st.markdown("###### Distribution (Histogram)")
-        q_low = df_avg_results["average_value"].quantile(0.05)
-        q_high = df_avg_results["average_value"].quantile(0.95)
-        df_hist = df_avg_results[
-            (df_avg_results["average_value"] >= q_low)
-            & (df_avg_results["average_value"] <= q_high)
-            ]
-        df_hist['Company Type'] = df_hist['company'].apply(get_company_type)
-        st.warning(
-            "Histogram excludes the lowest and highest 5% of values to reduce outlier impact."
-        )
-        fig_hist = px.histogram(
-            df_hist,
-            x="average_value",
-            nbins=30,
-            title=f"Histogram of Average {selected_metric_name}",
-            labels={"average_value": f"Average {unit_label}"},
-        )
-        st.plotly_chart(fig_hist, use_container_width=True)
-
-    elif chart_type == "Violin Plot":
-        if len(df_avg_results) < 2:
-            st.warning("Not enough data points (minimum 2) to draw a violin plot.")
-        else:
-            st.markdown(f"###### Key Statistics ({unit_label})")
-            avg_val = df_avg_results["average_value"].mean()
-            median_val = df_avg_results["average_value"].median()
-            # ... (ваши st.columns с метриками)
-            stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
-            stat_col1.metric("Average", f"{avg_val:,.2f}")
-            stat_col2.metric("Median", f"{median_val:,.2f}")
-            # ...
-
-            st.markdown("###### Distribution (Violin Plot)")
-            fig_violin = px.violin(
-                df_avg_results,
-                x="average_value",
-                box=True,
-                points="all",
-                title=f"Distribution of Average {selected_metric_name}",
-                labels={"average_value": f"Average {unit_label}"},
+    with perf.stage(f"chart:{metric_key_prefix}:{chart_type}"):
+        if chart_type == "Histogram":
+            st.markdown("###### Distribution (Histogram)")
+            q_low = df_avg_results["average_value"].quantile(0.05)
+            q_high = df_avg_results["average_value"].quantile(0.95)
+            df_hist = df_avg_results[
+                (df_avg_results["average_value"] >= q_low)
+                & (df_avg_results["average_value"] <= q_high)
+                ]
+            st.warning(
+                "Histogram excludes the lowest and highest 5% of values to reduce outlier impact."
+            )
+            # Бины считаются на сервере, в браузер уходят только HISTOGRAM_BINS столбцов
+            df_bins = render_prep.histogram_bins(df_hist["average_value"])
+            fig_hist = px.bar(
+                df_bins,
+                x="bin_mid",
+                y="count",
+                title=f"Histogram of Average {selected_metric_name}",
+                labels={"bin_mid": f"Average {unit_label}", "count": "Count"},
             )
-            st.plotly_chart(fig_violin, use_container_width=True)
+            fig_hist.update_traces(width=df_bins["bin_end"] - df_bins["bin_start"])
+            fig_hist.update_layout(bargap=0)
+            highlight_company(fig_hist, highlight)
+            st.plotly_chart(fig_hist, width="stretch")
+
+        elif chart_type == "Violin Plot":
+            if len(df_avg_results) < 2:
+                st.warning("Not enough data points (minimum 2) to draw a violin plot.")
+            else:
+                st.markdown(f"###### Key Statistics ({unit_label})")
+                avg_val = df_avg_results["average_value"].mean()
+                median_val = df_avg_results["average_value"].median()
+                # ... (ваши st.columns с метриками)
+                stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
+                stat_col1.metric("Average", f"{avg_val:,.2f}")
+                stat_col2.metric("Median", f"{median_val:,.2f}")
+                # ...
+
+                st.markdown("###### Distribution (Violin Plot)")
+                df_violin = render_prep.sample_by_rank(df_avg_results, "average_value")
+                if len(df_violin) < len(df_avg_results):
+                    st.caption(f"Violin drawn from {len(df_violin)} of {len(df_avg_results)} companies sampled evenly by rank.")
+                fig_violin = px.violin(
+                    df_violin,
+                    x="average_value",
+                    box=True,
+                    points="all",
+                    title=f"Distribution of Average {selected_metric_name}",
+                    labels={"average_value": f"Average {unit_label}"},
+                )
+                highlight_company(fig_violin, highlight)
+                st.plotly_chart(fig_violin, width="stretch")
+
+        elif chart_type == 'Treemap':
+            st.markdown("###### Comparison (Treemap)")
+            df_treemap = df_avg_results[df_avg_results['average_value'] > 0]
+            if df_treemap.empty:
+                st.warning(f"No positive {unit_label} data available for Treemap.")
+            else:
+                # Хвост мелких компаний сворачивается в одну плитку "Other"
+                fig_treemap = px.treemap(
+                    render_prep.fold_tail(df_treemap, 'average_value'),
+                    path=[px.Constant("All Companies"), 'company'],
+                    values='average_value',
+                    title=f"Average {selected_metric_name} by Company",
+                    hover_data=['average_value']
+                )
+                st.plotly_chart(fig_treemap, width="stretch")
 
-    elif chart_type == 'Treemap':
-        st.markdown("###### Comparison (Treemap)")
-        df_treemap = df_avg_results[df_avg_results['average_value'] > 0]
-        if df_treemap.empty:
-            st.warning(f"No positive {unit_label} data available for Treemap.")
-        else:
-            fig_treemap = px.treemap(
-                df_treemap,
-                path=[px.Constant("All Companies"), 'company'],
-                values='average_value',
-                title=f"Average {selected_metric_name} by Company",
-                hover_data=['average_value']
+        elif chart_type == 'Bar Chart':
+            st.markdown("###### Company Ranking (Top 50)")
+
+            # Берем Top 50, иначе график будет нечитаемым
+            df_bar = df_avg_results.head(50)
+
+            fig_bar = px.bar(
+                df_bar.sort_values(by="average_value", ascending=True),  # Сортируем для Bar chart
+                y="company",
+                x="average_value",
+                color="Company Type",  # <--- ВОТ ВАШИ "ФЛАЖКИ" С ПОДПИСЯМИ
+                title=f"Top 50 Companies by {selected_metric_name}",
+                labels={"average_value": f"Average {unit_label}", "company": "Company"},
+                color_discrete_map={
+                    'Tier A Leader': 'orange',
+                    'Other Company': 'steelblue'
+                },
+                height=800  # Может понадобиться высота для 50 компаний
             )
-            st.plotly_chart(fig_treemap, use_container_width=True)
-
-    elif chart_type == 'Bar Chart':
-        st.markdown("###### Company Ranking (Top 50)")
-
-        # Берем Top 50, иначе график будет нечитаемым
-        df_bar = df_avg_results.head(50)
-
-        fig_bar = px.bar(
-            df_bar.sort_values(by="average_value", ascending=True),  # Сортируем для Bar chart
-            y="company",
-            x="average_value",
-            color="Company Type",  # <--- ВОТ ВАШИ "ФЛАЖКИ" С ПОДПИСЯМИ
-            title=f"Top 50 Companies by {selected_metric_name}",
-            labels={"average_value": f"Average {unit_label}", "company": "Company"},
-            color_discrete_map={
-                'Tier A Leader': 'orange',
-                'Other Company': 'steelblue'
-            },
-            height=800  # Может понадобиться высота для 50 компаний
-        )
-        fig_bar.update_layout(yaxis_title="Company")
-        st.plotly_chart(fig_bar, use_container_width=True)
+            fig_bar.update_layout(yaxis_title="Company")
+            st.plotly_chart(fig_bar, width="stretch")
 
     # 6. Экспандер с данными
     with st.expander("Show detailed average data (including outliers)"):
@@ -185,134 +370,153 @@ def create_performance_analytics_tab(
                     f"Avg. {unit_label}", format="%.2f"
                 ),
                 "years_of_data": st.column_config.NumberColumn(
-                    "Data Points (Max 3)", format="%d"
+                    f"Data Points (Max {n_years})", format="%d"
                 ),
+                "years": st.column_config.ListColumn("Years"),
             },
-            use_container_width=True,
+            width="stretch",
             hide_index=True,
         )
 
-# --- Основная часть приложения ---
-
-# 1. Настройка страницы
-st.set_page_config(layout="wide", page_title="Industry Overview Dashboard")
-st.title("Industry Overview Dashboard")
-
-# 2. Загрузка данных
-# В реальном коде замените это на:
-try:
-    df_metrics = load_original_data('https://raw.githubusercontent.com/dblnnn/data_projects/refs/heads/main/users_bi/comparable_metrics.csv')
-    df_topics = load_original_data('https://raw.githubusercontent.com/dblnnn/data_projects/refs/heads/main/users_bi/material_topics.csv')
-    df_leaders = load_original_data('https://raw.githubusercontent.com/dblnnn/data_projects/refs/heads/main/users_bi/industry_leaders.csv')
-
-    size_map = df_metrics[['company', 'company_size']].drop_duplicates()
-    # 1. Обогащаем 'df_leaders' данными о размере
-    df_leaders_merged = df_leaders.merge(size_map, on='company', how='left')
-
-except FileNotFoundError:
-    st.error(
-        "Error: CSV files not found. Make sure 'comparable_metrics.csv', 'material_topics.csv' and 'industry_leaders.csv' are in the same folder."
-    )
-    st.stop()
-# df_metrics, df_topics = load_mock_data()
-
-# 3. Фильтры в боковой панели
-st.sidebar.header("Filters")
-
-# Фильтр по стране
-unique_countries = sorted(df_metrics['country'].unique())
-select_all_countries = st.sidebar.checkbox("Select All Countries", value=True)
-
-if select_all_countries:
-    selected_countries = st.sidebar.multiselect(
-        'Country',
-        options=unique_countries,
-        default=list(unique_countries)
+@st.dialog("Compare selected", width="large")
+def show_comparison(backend, selection: tuple, everything: tuple, reports: list, get_peer_index):
+    """Значения метрик выбранных отчетов рядом + похожие компании"""
+    # Один столбец на (company, year); выбор в таблицах мог не совпадать с текущим сайдбаром,
+    # поэтому значения берутся без фильтров
+    reports = list(dict.fromkeys(reports))
+    with perf.stage("compare") as timing:
+        metric_sums = {
+            label: backend.company_year_sums(*everything, sub_codes)
+            for label, sub_codes in COMPARE_METRICS.items()
+        }
+        df_compare = analytics.compare_reports(metric_sums, reports)
+        timing["rows"] = len(reports)
+    st.dataframe(df_compare, width="stretch")
+
+    st.subheader("Similar companies")
+    company = st.selectbox("Company", list(dict.fromkeys(company for company, _ in reports)), key="peer_company")
+    with perf.stage("peers") as timing:
+        df_peers = get_peer_index().peers(company, n=PEER_COUNT, countries=selection[0], sizes=selection[1])
+        timing["rows"] = len(df_peers)
+    if df_peers.empty:
+        st.info("Not enough reported metrics to find similar companies.")
+        return
+    st.caption(
+        f"Nearest companies by {', '.join(peer_index.PEER_FEATURES)} "
+        f"(latest {AVERAGE_WINDOW_YEARS} years, log-scaled), within the sidebar filters."
     )
-else:
-    selected_countries = st.sidebar.multiselect(
-        'Country',
-        options=unique_countries,
-        default=[]
+    st.dataframe(
+        df_peers,
+        column_config={
+            "similarity": st.column_config.ProgressColumn("Similarity", min_value=0.0, max_value=1.0, format="%.2f"),
+            "shared_metrics": st.column_config.NumberColumn("Metrics compared"),
+        },
+        width="stretch",
+        hide_index=True,
     )
 
-# Фильтр по размеру компании
-st.sidebar.markdown("---")
-st.sidebar.subheader('Company Size')
-unique_sizes = sorted(df_metrics['company_size'].unique())
-selected_sizes = []
 
-for size in unique_sizes:
-    if st.sidebar.checkbox(size, value=True):
-        selected_sizes.append(size)
+def _sync_compare(table_key: str, editor_key: str):
+    # on_change data_editor: переносим галочки "compare" текущей страницы в общий набор
+    selected = st.session_state[f"{table_key}_compare"]
+    row_ids = st.session_state[f"{table_key}_page_ids"]
+    for row, changes in st.session_state[editor_key]["edited_rows"].items():
+        if "compare" in changes:
+            (selected.add if changes["compare"] else selected.discard)(row_ids[int(row)])
 
-# 4. Применение фильтров
-df_filtered = df_metrics[
-    (df_metrics['country'].isin(selected_countries)) &
-    (df_metrics['company_size'].isin(selected_sizes))
-    ]
 
-# Проверка, есть ли данные после фильтрации
-if df_filtered.empty:
-    st.warning("No data for selected filters.")
-    st.stop()
-
-# --- Подготовка общих данных для вкладок ---
-# Карта 'company' -> 'company_size' (нужна для df_topics и df_leaders)
-# (Перенесено из вкладки 2)
-size_map = df_metrics[['company', 'company_size']].drop_duplicates()
-
-# 5. Блок 1: Статистические данные (KPIs)
-st.header("Our Database Statistics")
-st.markdown("---")
+def _reset_page(table_key: str):
+    st.session_state[f"{table_key}_page"] = 1
 
-cols = st.columns(5)  # Создаем 5 колонок для метрик
 
-# Метрика 1: Количество экстрагированных метрик
-kpi_metric_count = df_filtered.shape[0]
-cols[0].metric(label="Total Data Points", value=kpi_metric_count)
-
-# Метрика 2: Количество уникальных бандлов
-kpi_bundle_count = df_filtered['bundle_id'].nunique()
-cols[1].metric(label="Unique Reports", value=kpi_bundle_count)
-
-# Метрика 3: Количество компаний
-kpi_company_count = df_filtered['company_id'].nunique()
-cols[2].metric(label="Unique Companies", value=kpi_company_count)
-
-# Метрика 4: Количество стран
-kpi_country_count = df_filtered['country'].nunique()
-cols[3].metric(label="Countries Covered", value=kpi_country_count)
-
-# Метрика 5: Диапазон годов
-min_year = df_filtered['year'].min()
-max_year = df_filtered['year'].max()
-cols[4].metric(label="Year Range", value=f"{min_year} - {max_year}")
-
-st.markdown("---")
+def render_paged_table(table_key: str, fetch_page, scope: tuple, sort_columns: list, id_columns: list,
+                       report_link: str, column_config: dict, column_order: tuple):
+    """
+    Search, sort and page controls plus one page of rows in a data_editor.
+    `fetch_page(search, sort_by, ascending, offset, limit)` returns (page, total):
+    search and sort run in the backend and only the page goes to the browser.
+    `scope` is the filter selection behind `fetch_page` (part of the editor key).
+    Ticked "compare" rows are kept in st.session_state[f"{table_key}_compare"]
+    as tuples of `id_columns` and stay ticked across pages.
+    """
+    selected = st.session_state.setdefault(f"{table_key}_compare", set())
 
-# 6. Блок 2: Таблица со списком использованных файлов (под спойлером)
-st.header("Reports Used")
+    col_search, col_sort, col_order = st.columns([3, 2, 1])
+    search = col_search.text_input(
+        "Search company", key=f"{table_key}_search", on_change=_reset_page, args=(table_key,)
+    )
+    sort_by = col_sort.selectbox(
+        "Sort by", sort_columns, key=f"{table_key}_sort", on_change=_reset_page, args=(table_key,)
+    )
+    ascending = col_order.toggle(
+        "Ascending", value=True, key=f"{table_key}_ascending", on_change=_reset_page, args=(table_key,)
+    )
 
-with st.expander("Click to show list", expanded=True):
-    # Добавляем "фейковую" кнопку "Compare" (теперь ВНУТРИ спойлера)
-    st.button("Compare selected", key="compare_main")
+    page_key = f"{table_key}_page"
+    page = st.session_state.get(page_key, 1)
+    with perf.stage(f"{table_key}_page") as timing:
+        df_page, total = fetch_page(search, sort_by, ascending, (page - 1) * backends.PAGE_SIZE, backends.PAGE_SIZE)
+        n_pages = max(1, -(-total // backends.PAGE_SIZE))
+        if page > n_pages:
+            # Страница пропала после изменения фильтров - переходим на последнюю
+            page = n_pages
+            df_page, total = fetch_page(search, sort_by, ascending, (page - 1) * backends.PAGE_SIZE, backends.PAGE_SIZE)
+        timing["rows"] = len(df_page)
+    st.session_state[page_key] = page
+
+    if total == 0:
+        st.warning("Нет данных, соответствующих выбранным фильтрам.")
+        return
 
-    # Готовим таблицу: компания, страна, индустрия, год
-    # Нам нужны только уникальные комбинации
-    df_reports_list = df_filtered[
-        ['company', 'country', 'industry', 'year']
-    ].drop_duplicates().sort_values(by=['company', 'year']).reset_index(drop=True)
+    row_ids = [
+        tuple(value.item() if hasattr(value, "item") else value for value in row)
+        for row in df_page[id_columns].itertuples(index=False, name=None)
+    ]
+    st.session_state[f"{table_key}_page_ids"] = row_ids
+    df_page["compare"] = [row_id in selected for row_id in row_ids]
+    df_page["report_link"] = report_link
+
+    # Ключ редактора свой для каждого выбора сайдбара/страницы/поиска/сортировки: правки по номеру
+    # строки не должны переезжать на другие строки
+    scope_hash = hashlib.sha1(repr(scope).encode("utf-8")).hexdigest()[:12]
+    editor_key = f"{table_key}_editor_{scope_hash}_{page}_{search}_{sort_by}_{ascending}"
+    st.data_editor(
+        df_page,
+        key=editor_key,
+        on_change=_sync_compare,
+        args=(table_key, editor_key),
+        column_config=column_config,
+        column_order=column_order,
+        disabled=[col for col in column_order if col != "compare"],
+        width="stretch",
+        hide_index=True,
+    )
 
-    # 1. Добавляем поле для чекбокса "compare"
-    df_reports_list['compare'] = False
+    col_info, col_page = st.columns([4, 1])
+    col_info.caption(
+        f"{total} rows, page {page} of {n_pages}. {len(selected)} selected for comparison."
+    )
+    col_page.number_input("Page", min_value=1, max_value=n_pages, step=1, key=page_key)
 
-    # 2. Добавляем поле-placeholder для ссылки
-    df_reports_list['report_link'] = "http://etoso.io/placeholder_link"
 
-    # Используем st.data_editor для интерактивной таблицы
-    edited_df = st.data_editor(
-        df_reports_list,
+@st.fragment
+def render_reports_table(backend, selection: tuple, everything: tuple, get_peer_index):
+    """Reports Used: страница уникальных (company, country, industry, year)"""
+    if st.button("Compare selected", key="compare_main"):
+        selected = st.session_state.get("reports_compare", set())
+        if selected:
+            reports = [(company, year) for company, _, _, year in sorted(selected)]
+            show_comparison(backend, selection, everything, reports, get_peer_index)
+        else:
+            st.info("Tick reports in the \"To Comparison\" column first.")
+
+    render_paged_table(
+        "reports",
+        lambda *args: backend.reports_page(*selection, *args),
+        scope=result_cache.filter_signature((), *selection),
+        sort_columns=['company', 'country', 'industry', 'year'],
+        id_columns=['company', 'country', 'industry', 'year'],
+        report_link="http://etoso.io/placeholder_link",
         column_config={
             "compare": st.column_config.CheckboxColumn(
                 "To Comparison",
@@ -325,39 +529,32 @@ with st.expander("Click to show list", expanded=True):
         },
         # Меняем порядок столбцов, 'compare' теперь последний
         column_order=('company', 'country', 'industry', 'year', 'report_link', 'compare'),
-        use_container_width=True,
-        hide_index=True,
     )
 
-st.markdown("---")
-
-# 1. Фильтруем 'df_leaders_merged' по *фильтрам сайдбара*
-# (df_leaders_merged у нас уже загружен и кэширован)
-df_leaders_sidebar_filtered = df_leaders_merged[
-    (df_leaders_merged['country'].isin(selected_countries)) &
-    (df_leaders_merged['company_size'].isin(selected_sizes))
-]
-
-# 2. Из них выбираем *только* Tier A и получаем уникальный список
-tier_a_companies_list = df_leaders_sidebar_filtered[
-    df_leaders_sidebar_filtered['tier'] == "A"
 
-]['company'].unique().tolist()
-# 7. Блок 3: Вкладки с аналитикой (НОВЫЙ БЛОК)
-st.header("Industry Overview")
-
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["Geography", "Common Disclosures", "Industry Leaders", "Performance", "Trends"])
-
-# --- Вкладка 1: География ---
-with tab1:
+@st.fragment
+def render_geography_tab(backend, selection: tuple):
+    """Вкладка 1: карта компаний по странам"""
+    import plotly.express as px  # импорт при первой отрисовке вкладки
     st.subheader("Companies Map")
 
     # Готовим данные для карты: считаем уникальные компании по странам
-    df_geo = df_filtered.groupby(['country', 'country_iso3'])['company_id'].nunique().reset_index(name='company_count')
+    with perf.stage("geo_counts") as timing:
+        df_geo = backend.geo_counts(*selection)
+        timing["rows"] = len(df_geo)
 
     if df_geo.empty:
         st.warning("Нет данных для отображения карты.")
-    else:
+        return
+    try:
+        # Геометрия стран с нашего сервера (static/topojson), без запроса к CDN
+        geo_config = geo_assets.plotly_config(st.get_option("server.enableStaticServing"))
+    except geo_assets.MapGeometryError as exc:
+        # Без геометрии не рисуется только карта, остальные вкладки работают
+        st.error(str(exc))
+        return
+
+    with perf.stage("chart:geo"):
         fig = px.choropleth(
             df_geo,
             locations="country_iso3",  # Используем ISO код для построения
@@ -368,101 +565,101 @@ with tab1:
         )
         # Убираем лишние отступы, чтобы карта занимала больше места
         fig.update_layout(margin={"r": 0, "t": 40, "l": 0, "b": 0})
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(fig, width="stretch", config=geo_config)
 
-# --- Вкладка 2: Common Disclosures ---
-with tab2:
-    st.subheader("Common Disclosures (Top 10)")
-    st.write("Click on a category to see the top 10 topics for that category.")
 
-    # 1. Обогащаем df_topics информацией о размере
-    df_topics_merged = df_topics.merge(size_map, on='company', how='left')
+def build_topic_rankings(backend, selection: tuple, kpi_company_count: int):
+    # Топ-10 категорий, Топ-10 топиков в каждой категории и общий ранг по всем категориям
+    top_10_categories, top_topics = backends.topic_rankings(backend, *selection, kpi_company_count, top_n=10)
+    return render_prep.drop_unused_categories(top_10_categories), render_prep.drop_unused_categories(top_topics)
 
-    # 2. Фильтруем df_topics по фильтрам из сайдбара
-    df_topics_filtered = df_topics_merged[
-        (df_topics_merged['country'].isin(selected_countries)) &
-        (df_topics_merged['company_size'].isin(selected_sizes))
-        ]
 
-    if df_topics_filtered.empty or kpi_company_count == 0:
+@st.fragment
+def render_disclosures_tab(backend, selection: tuple, kpi_company_count: int):
+    """Вкладка 2: Common Disclosures"""
+    import altair as alt  # импорт при первой отрисовке вкладки
+    st.subheader("Common Disclosures (Top 10)")
+    st.write("Click on a category to see the top 10 topics for that category.")
+
+    # 3-4. Данные для графиков считаются на сервере: в браузер уходят
+    # только Топ-10 категорий и Топ-10 топиков каждой категории
+    # Кэш результатов по состоянию фильтров (снапшот + страны + размеры)
+    with perf.stage("topic_rankings"):
+        top_10_categories, top_topics = backend.cached(
+            "topic_rankings", *selection,
+            lambda: build_topic_rankings(backend, selection, kpi_company_count),
+            company_count=kpi_company_count,
+        ) if kpi_company_count else (None, None)
+
+    if top_10_categories is None or top_10_categories.empty:
         st.warning("Нет данных по темам для выбранных фильтров.")
     else:
-        # 3. Готовим данные для ГРАФИКА 1 (Категории)
-        companies_per_category = df_topics_filtered.groupby('category_name')['company'].nunique().reset_index(
-            name='company_count')
-        companies_per_category['share_pct'] = (companies_per_category['company_count'] / kpi_company_count) * 100
-        # Берем Топ-10
-        top_10_categories = companies_per_category.nlargest(10, 'share_pct')
-
-        # 4. Готовим данные для ГРАФИКА 2 (Топики)
-        # ВАЖНО: здесь мы берем ВСЕ топики, а не топ-10,
-        # так как Топ-10 будет считаться *после* фильтрации
-        companies_per_topic = df_topics_filtered.groupby(['category_name', 'topic_name'])[
-            'company'].nunique().reset_index(name='company_count')
-        companies_per_topic['share_pct'] = (companies_per_topic['company_count'] / kpi_company_count) * 100
 
         # 5. Создаем селектор (выбор)
         # empty='all' означает, что по умолчанию выбраны ВСЕ категории
         category_selection = alt.selection_point(
-            fields=['category_name'], empty='all'
+            name='category_select', fields=['category_name'], empty='all'
+        )
+        # Ничего не выбрано -> общий Топ-10, выбрана категория -> ее Топ-10
+        top_topic_filter = (
+            "length(data('category_select_store'))"
+            " ? vlSelectionTest('category_select_store', datum) && datum.category_rank <= 10"
+            " : datum.overall_rank <= 10"
         )
 
         # 6. Создаем колонки для графиков
-        col1, col2 = st.columns(2)
-
-        with col1:
-            # --- ГРАФИК 1: КАТЕГОРИИ ---
-            st.subheader("Top 10 Categories")
-            chart_cat = alt.Chart(top_10_categories).mark_bar().encode(
-                x=alt.X('share_pct', title="Доля компаний (%)"),
-                y=alt.Y('category_name', title="Категория", sort='-x'),
-                # Цвет меняется при клике
-                color=alt.condition(
-                    category_selection,
-                    alt.value('orange'),  # Цвет при выборе
-                    alt.value('steelblue') # Стандартный цвет
-                ),
-                tooltip=[
-                    alt.Tooltip('category_name', title='Категория'),
-                    alt.Tooltip('company_count', title='Кол-во компаний'),
-                    alt.Tooltip('share_pct', title='Доля', format='.1f')
-                ]
-            ).add_params(
-                category_selection # Применяем селектор
-            ).properties(
-                title="Top 10 Categories by disclosure frequency"
-            ).interactive() # Позволяет зумить (хотя здесь не нужно, но полезно)
-
-
-        with col2:
-            # --- ГРАФИК 2: ТОПИКИ (Фильтруемый) ---
-            st.subheader("Top 10 topics")
-
-            chart_topic = alt.Chart(companies_per_topic).mark_bar().encode(
-                x=alt.X('share_pct', title="Доля компаний (%)"),
-                y=alt.Y('topic_name', title="Топик", sort='-x'), # Сортировка по убыванию
-                tooltip=[
-                    alt.Tooltip('topic_name', title='Топик'),
-                    alt.Tooltip('company_count', title='Кол-во компаний'),
-                    alt.Tooltip('share_pct', title='Доля', format='.1f')
-                ]
-            ).transform_filter(
-                category_selection # <--- ГЛАВНАЯ СВЯЗЬ: фильтруем по выбору
-            ).transform_window(
-                # Ранжируем топики *после* фильтрации
-                rank='rank()',
-                sort=[alt.SortField('share_pct', order='descending')]
-            ).transform_filter(
-                alt.datum.rank <= 10 # Оставляем только Топ 10
-            ).properties(
-                title="Top 10 topics in selected category"
-            ).interactive()
-
-    combined_chart = chart_cat | chart_topic
-    st.altair_chart(combined_chart, use_container_width=True)
-
-# --- Вкладка 3: Industry Leaders ---
-with tab3:
+        with perf.stage("chart:disclosures"):
+            col1, col2 = st.columns(2)
+
+            with col1:
+                # --- ГРАФИК 1: КАТЕГОРИИ ---
+                st.subheader("Top 10 Categories")
+                chart_cat = alt.Chart(top_10_categories).mark_bar().encode(
+                    x=alt.X('share_pct', title="Доля компаний (%)"),
+                    y=alt.Y('category_name', title="Категория", sort='-x'),
+                    # Цвет меняется при клике
+                    color=alt.condition(
+                        category_selection,
+                        alt.value('orange'),  # Цвет при выборе
+                        alt.value('steelblue') # Стандартный цвет
+                    ),
+                    tooltip=[
+                        alt.Tooltip('category_name', title='Категория'),
+                        alt.Tooltip('company_count', title='Кол-во компаний'),
+                        alt.Tooltip('share_pct', title='Доля', format='.1f')
+                    ]
+                ).add_params(
+                    category_selection # Применяем селектор
+                ).properties(
+                    title="Top 10 Categories by disclosure frequency"
+                ).interactive() # Позволяет зумить (хотя здесь не нужно, но полезно)
+
+
+            with col2:
+                # --- ГРАФИК 2: ТОПИКИ (Фильтруемый) ---
+                st.subheader("Top 10 topics")
+
+                chart_topic = alt.Chart(top_topics).mark_bar().encode(
+                    x=alt.X('share_pct', title="Доля компаний (%)"),
+                    y=alt.Y('topic_name', title="Топик", sort='-x'), # Сортировка по убыванию
+                    tooltip=[
+                        alt.Tooltip('topic_name', title='Топик'),
+                        alt.Tooltip('company_count', title='Кол-во компаний'),
+                        alt.Tooltip('share_pct', title='Доля', format='.1f')
+                    ]
+                ).transform_filter(
+                    top_topic_filter # <--- ГЛАВНАЯ СВЯЗЬ: фильтруем по выбору
+                ).properties(
+                    title="Top 10 topics in selected category"
+                ).interactive()
+
+            combined_chart = chart_cat | chart_topic
+            st.altair_chart(combined_chart, width="stretch")
+
+
+@st.fragment
+def render_leaders_tab(backend, selection: tuple, everything: tuple, get_peer_index):
+    """Вкладка 3: Industry Leaders"""
     st.subheader("Industry Leaders")
 
     # 3.1 Фильтры для Tier
@@ -476,328 +673,266 @@ with tab3:
     if tier_b_selected:
         selected_tiers.append("B")
 
-    # 3.2 Фильтрация данных df_leaders
+    # 3.3 Кнопка Сравнения
+    if st.button("Compare selected Leaders", key="compare_leaders"):
+        selected = st.session_state.get("leaders_compare", set())
+        if selected:
+            reports = [(company, year) for company, _, year, _ in sorted(selected)]
+            show_comparison(backend, selection, everything, reports, get_peer_index)
+        else:
+            st.info("Tick leaders in the \"To comparison\" column first.")
+
+    # 3.4-3.5 Фильтры сайдбара и tier применяются в backend, в таблицу уходит одна страница
+    # (bundle_id,company,year,tier,country)
+    render_paged_table(
+        "leaders",
+        lambda *args: backend.leaders_page(*selection, selected_tiers, *args),
+        scope=result_cache.filter_signature((), *selection, tiers=selected_tiers),
+        sort_columns=['company', 'country', 'year', 'tier'],
+        id_columns=['company', 'country', 'year', 'tier'],
+        report_link="http://etoso.io/leader_report_link",
+        column_config={
+            "compare": st.column_config.CheckboxColumn(
+                "To comparison",
+                default=False,
+            ),
+            "report_link": st.column_config.LinkColumn(
+                "Report Link",
+                display_text="🔗 View"
+            )
+        },
+        column_order=('company', 'country', 'year', 'tier', 'report_link', 'compare'),
+    )
+
 
-    # 2. Применяем все фильтры (из сайдбара и из вкладки)
-    df_leaders_filtered = df_leaders_merged[
-        (df_leaders_merged['country'].isin(selected_countries)) &
-        (df_leaders_merged['company_size'].isin(selected_sizes)) &
-        (df_leaders_merged['tier'].isin(selected_tiers))
-        ]
+@st.fragment
+def render_ghg_subtab(backend, selection: tuple, get_percentile_index):
+    """Подвкладка GHG: суммирование по выбранным Scopes"""
+    import plotly.express as px  # импорт при первой отрисовке вкладки
+    st.subheader("GHG Emissions (Scope 1, 2, 3) Analysis")
 
-    if df_leaders_filtered.empty:
-        st.warning("Нет данных, соответствующих выбранным фильтрам.")
-    else:
-        # 3.3 Кнопка Сравнения
-        st.button("Compare selected Leaders", key="compare_leaders")
-
-        # 3.4 Подготовка таблицы
-        # (bundle_id,company,year,tier,country)
-        df_leaders_display = df_leaders_filtered[
-            ['company', 'country', 'year', 'tier']
-        ].drop_duplicates().sort_values(by=['company', 'year'])
-
-        # Добавляем 'compare' и 'report_link'
-        df_leaders_display['compare'] = False
-        df_leaders_display['report_link'] = "http://etoso.io/leader_report_link"
-
-        # 3.5 Отображение таблицы
-        st.data_editor(
-            df_leaders_display,
-            column_config={
-                "compare": st.column_config.CheckboxColumn(
-                    "To comparison",
-                    default=False,
-                ),
-                "report_link": st.column_config.LinkColumn(
-                    "Report Link",
-                    display_text="🔗 View"
-                )
-            },
-            column_order=('company', 'country', 'year', 'tier', 'report_link', 'compare'),
-            use_container_width=True,
-            hide_index=True,
-        )
+    # Чекбоксы для Scopes
+    st.markdown("**Select Scopes to aggregate:**")
+    cols_scope = st.columns(3)
+    use_scope1 = cols_scope[0].checkbox("Scope 1 (GRI 305-1-a)", value=True, key="ghg_scope1")
+    use_scope2 = cols_scope[1].checkbox("Scope 2 (GRI 305-2-a)", value=True, key="ghg_scope2")
+    use_scope3 = cols_scope[2].checkbox("Scope 3 (GRI 305-3-a)", value=True, key="ghg_scope3")
 
-# --- Tab 4: Performance ---
-with tab4:
-    st.subheader("Performance Analytics")
+    selected_scopes = []
+    if use_scope1: selected_scopes.append('305-1-a')
+    if use_scope2: selected_scopes.append('305-2-a')
+    if use_scope3: selected_scopes.append('305-3-a')
 
-    # Создаем подвкладки
-    subtab_ghg, subtab_energy, subtab_waste, subtab_water = st.tabs(
-        ["GHG Emissions", "Energy Consumption", "Waste", "Water"])
-
-    # --- Подвкладка 1: GHG (как и была) ---
-    with subtab_ghg:
-        st.subheader("GHG Emissions (Scope 1, 2, 3) Analysis")
-
-        # Чекбоксы для Scopes
-        st.markdown("**Select Scopes to aggregate:**")
-        cols_scope = st.columns(3)
-        use_scope1 = cols_scope[0].checkbox("Scope 1 (GRI 305-1-a)", value=True, key="ghg_scope1")
-        use_scope2 = cols_scope[1].checkbox("Scope 2 (GRI 305-2-a)", value=True, key="ghg_scope2")
-        use_scope3 = cols_scope[2].checkbox("Scope 3 (GRI 305-3-a)", value=True, key="ghg_scope3")
-
-        selected_scopes = []
-        if use_scope1: selected_scopes.append('305-1-a')
-        if use_scope2: selected_scopes.append('305-2-a')
-        if use_scope3: selected_scopes.append('305-3-a')
-
-        if not selected_scopes:
-            st.warning("Please select at least one Scope.")
+    if not selected_scopes:
+        st.warning("Please select at least one Scope.")
+    else:
+        with perf.stage("average:ghg") as timing:
+            df_avg_results = backend.latest_years_average(
+                *selection, selected_scopes, n_years=AVERAGE_WINDOW_YEARS
+            ).rename(columns={'average_value': 'average_ghg'})
+            timing["rows"] = len(df_avg_results)
+
+        if df_avg_results.empty:
+            st.warning("No GHG data found for the selected filters and Scopes.")
         else:
-            df_ghg = df_filtered[df_filtered['sub_code'].isin(selected_scopes)].copy()
+            st.subheader("Average Emissions Distribution")
+
+            highlight = render_company_percentile(
+                "ghg",
+                df_avg_results['company'],
+                "tCO2e",
+                get_percentile_index(tuple(selected_scopes), AVERAGE_WINDOW_YEARS),
+                selection,
+            )
 
-            if df_ghg.empty:
-                st.warning("No GHG data found for the selected filters and Scopes.")
-            else:
-                df_annual_sums = df_ghg.groupby(['company', 'year'])['value'].sum().reset_index()
-                company_averages = []
-
-                for company in df_annual_sums['company'].unique():
-                    df_company_data = df_annual_sums[df_annual_sums['company'] == company].sort_values(by='year',
-                                                                                                       ascending=False)
-                    latest_3_values = df_company_data.head(3)['value']
-
-                    if not latest_3_values.empty:
-                        avg_value = latest_3_values.mean()
-                        company_averages.append({
-                            'company': company,
-                            'average_ghg': avg_value,
-                            'years_of_data': len(latest_3_values)
-                        })
-
-                if not company_averages:
-                    st.warning("Not enough data to calculate averages.")
-                else:
-                    df_avg_results = pd.DataFrame(company_averages).sort_values(by='average_ghg', ascending=False)
-                    st.subheader("Average Emissions Distribution")
-
-                    chart_type = st.radio(
-                        "Выберите тип графика:",
-                        ('Histogram', 'Violin Plot', 'Treemap'),
-                        horizontal=True,
-                        label_visibility="collapsed",
-                        key="ghg_chart_type"
-                    )
+            chart_type = st.radio(
+                "Выберите тип графика:",
+                ('Histogram', 'Violin Plot', 'Treemap'),
+                horizontal=True,
+                label_visibility="collapsed",
+                key="ghg_chart_type"
+            )
 
-                    if chart_type == 'Histogram':
-                        st.markdown("###### Distribution (Histogram)")
-                        # Exclude 5% outliers on each side for histogram
-                        q_low = df_avg_results['average_ghg'].quantile(0.05)
-                        q_high = df_avg_results['average_ghg'].quantile(0.95)
-                        df_hist = df_avg_results[
-                            (df_avg_results['average_ghg'] >= q_low) & (df_avg_results['average_ghg'] <= q_high)
-                        ]
-                        st.warning("Histogram excludes the lowest and highest 5% of values to reduce outlier impact.")
-                        fig_ghg_hist = px.histogram(
-                            df_hist,
+            with perf.stage(f"chart:ghg:{chart_type}"):
+                if chart_type == 'Histogram':
+                    st.markdown("###### Distribution (Histogram)")
+                    # Exclude 5% outliers on each side for histogram
+                    q_low = df_avg_results['average_ghg'].quantile(0.05)
+                    q_high = df_avg_results['average_ghg'].quantile(0.95)
+                    df_hist = df_avg_results[
+                        (df_avg_results['average_ghg'] >= q_low) & (df_avg_results['average_ghg'] <= q_high)
+                    ]
+                    st.warning("Histogram excludes the lowest and highest 5% of values to reduce outlier impact.")
+                    df_bins = render_prep.histogram_bins(df_hist['average_ghg'])
+                    fig_ghg_hist = px.bar(
+                        df_bins,
+                        x='bin_mid',
+                        y='count',
+                        title="Histogram of Average GHG Emissions per Company",
+                        labels={'bin_mid': 'Average Emissions (tCO2e)'}
+                    )
+                    fig_ghg_hist.update_traces(width=df_bins['bin_end'] - df_bins['bin_start'])
+                    fig_ghg_hist.update_layout(xaxis_title="Average Emissions (tCO2e)", yaxis_title="Count", bargap=0)
+                    highlight_company(fig_ghg_hist, highlight)
+                    st.plotly_chart(fig_ghg_hist, width="stretch")
+
+                elif chart_type == 'Violin Plot':
+                    if len(df_avg_results) < 2:
+                        st.warning("Not enough data points (minimum 2) to draw a violin plot.")
+                    else:
+                        # --- START: Новый блок статистики ---
+                        st.markdown("###### Key Statistics (tCO2e)")
+                        avg_val = df_avg_results['average_ghg'].mean()
+                        median_val = df_avg_results['average_ghg'].median()
+                        min_val = df_avg_results['average_ghg'].min()
+                        max_val = df_avg_results['average_ghg'].max()
+
+                        stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
+                        stat_col1.metric("Average", f"{avg_val:,.2f}")
+                        stat_col2.metric("Median", f"{median_val:,.2f}")
+                        stat_col3.metric("Min", f"{min_val:,.2f}")
+                        stat_col4.metric("Max", f"{max_val:,.2f}")
+                        # --- END: Новый блок статистики ---
+
+                        st.markdown("###### Distribution (Violin Plot)")
+                        df_violin = render_prep.sample_by_rank(df_avg_results, 'average_ghg')
+                        if len(df_violin) < len(df_avg_results):
+                            st.caption(
+                                f"Violin drawn from {len(df_violin)} of {len(df_avg_results)} companies sampled evenly by rank."
+                            )
+                        fig_ghg_violin = px.violin(
+                            df_violin,
                             x='average_ghg',
-                            nbins=30,
-                            title="Histogram of Average GHG Emissions per Company",
+                            box=True,
+                            points='all',
+                            title="Distribution of Average GHG Emissions per Company",
                             labels={'average_ghg': 'Average Emissions (tCO2e)'}
                         )
-                        fig_ghg_hist.update_layout(xaxis_title="Average Emissions (tCO2e)", yaxis_title="Count")
-                        st.plotly_chart(fig_ghg_hist, use_container_width=True)
-
-                    elif chart_type == 'Violin Plot':
-                        if len(df_avg_results) < 2:
-                            st.warning("Not enough data points (minimum 2) to draw a violin plot.")
-                        else:
-                            # --- START: Новый блок статистики ---
-                            st.markdown("###### Key Statistics (tCO2e)")
-                            avg_val = df_avg_results['average_ghg'].mean()
-                            median_val = df_avg_results['average_ghg'].median()
-                            min_val = df_avg_results['average_ghg'].min()
-                            max_val = df_avg_results['average_ghg'].max()
-
-                            stat_col1, stat_col2, stat_col3, stat_col4 = st.columns(4)
-                            stat_col1.metric("Average", f"{avg_val:,.2f}")
-                            stat_col2.metric("Median", f"{median_val:,.2f}")
-                            stat_col3.metric("Min", f"{min_val:,.2f}")
-                            stat_col4.metric("Max", f"{max_val:,.2f}")
-                            # --- END: Новый блок статистики ---
-
-                            st.markdown("###### Distribution (Violin Plot)")
-                            fig_ghg_violin = px.violin(
-                                df_avg_results,
-                                x='average_ghg',
-                                box=True,
-                                points='all',
-                                title="Distribution of Average GHG Emissions per Company",
-                                labels={'average_ghg': 'Average Emissions (tCO2e)'}
-                            )
-                            fig_ghg_violin.update_layout(xaxis_title="Average Emissions (tCO2e)")
-                            st.plotly_chart(fig_ghg_violin, use_container_width=True)
-
-                    elif chart_type == 'Treemap':
-                        st.markdown("###### Comparison (Treemap)")
-                        df_treemap = df_avg_results[df_avg_results['average_ghg'] > 0]
-                        if df_treemap.empty:
-                            st.warning("No positive emission data available for Treemap.")
-                        else:
-                            fig_ghg_treemap = px.treemap(
-                                df_treemap,
-                                path=[px.Constant("All Companies"), 'company'],
-                                values='average_ghg',
-                                title="Average GHG Emissions by Company (Treemap)",
-                                hover_data=['average_ghg']
-                            )
-                            fig_ghg_treemap.update_traces(textinfo="label+value")
-                            st.plotly_chart(fig_ghg_treemap, use_container_width=True)
-
-                    with st.expander("Show detailed average data (including outliers)"):
-                        st.dataframe(
-                            df_avg_results,
-                            column_config={
-                                "average_ghg": st.column_config.NumberColumn("Avg. GHG", format="%.2f"),
-                                "years_of_data": st.column_config.NumberColumn("Data Points (Max 3)", format="%d")
-                            },
-                            use_container_width=True,
-                            hide_index=True
+                        fig_ghg_violin.update_layout(xaxis_title="Average Emissions (tCO2e)")
+                        highlight_company(fig_ghg_violin, highlight)
+                        st.plotly_chart(fig_ghg_violin, width="stretch")
+
+                elif chart_type == 'Treemap':
+                    st.markdown("###### Comparison (Treemap)")
+                    df_treemap = df_avg_results[df_avg_results['average_ghg'] > 0]
+                    if df_treemap.empty:
+                        st.warning("No positive emission data available for Treemap.")
+                    else:
+                        fig_ghg_treemap = px.treemap(
+                            render_prep.fold_tail(df_treemap, 'average_ghg'),
+                            path=[px.Constant("All Companies"), 'company'],
+                            values='average_ghg',
+                            title="Average GHG Emissions by Company (Treemap)",
+                            hover_data=['average_ghg']
                         )
+                        fig_ghg_treemap.update_traces(textinfo="label+value")
+                        st.plotly_chart(fig_ghg_treemap, width="stretch")
 
-        # --- Подвкладка 2: Energy Consumption ---
+            with st.expander("Show detailed average data (including outliers)"):
+                st.dataframe(
+                    df_avg_results,
+                    column_config={
+                        "average_ghg": st.column_config.NumberColumn("Avg. GHG", format="%.2f"),
+                        "years_of_data": st.column_config.NumberColumn(
+                            f"Data Points (Max {AVERAGE_WINDOW_YEARS})", format="%d"
+                        ),
+                        "years": st.column_config.ListColumn("Years")
+                    },
+                    width="stretch",
+                    hide_index=True
+                )
 
-    with subtab_energy:
-        metric_options = {
-            "Total energy consumption (GRI 302-1-e)": ['302-1-e'],
-            "Consumption of electricity, heating, etc. (GRI 302-1-c)": ['302-1-c'],
-            "Fuel consumption (GRI 302-1-a + 302-1-b)": ['302-1-a', '302-1-b']
-        }
-        create_performance_analytics_tab(
-            df_filtered,
-            metric_options,
-            metric_key_prefix="energy",
-            unit_label="GJ",
-            tier_a_leaders_list=tier_a_companies_list
-        )
 
-    with subtab_waste:
-        metric_options = {
-            "Generated waste (GRI 306-3-a)": ['306-3-a'],
-            "Recycled waste (GRI 306-4-a)": ['306-4-a'],
-            "Landfilled waste (GRI 306-5-c)": ['306-5-c'],
-            "Incinerated waste (GRI 306-5-a)": ['306-5-a']
-        }
-        create_performance_analytics_tab(
-            df_filtered,
-            metric_options,
-            metric_key_prefix="waste",
-            unit_label="tons",
-            tier_a_leaders_list=tier_a_companies_list
-        )
+def render_performance_tab(backend, selection: tuple, tier_a_companies_list: list, get_percentile_index):
+    """Вкладка 4: Performance, считается только открытая подвкладка"""
+    st.subheader("Performance Analytics")
+
+    # Создаем подвкладки
+    subtab_ghg, subtab_energy, subtab_waste, subtab_water = st.tabs(
+        ["GHG Emissions", "Energy Consumption", "Waste", "Water"], key="performance_subtab", on_change="rerun")
+
+    if subtab_ghg.open:
+        with subtab_ghg:
+            render_ghg_subtab(backend, selection, get_percentile_index)
+
+    for subtab, metric_options, metric_key_prefix, unit_label in (
+            (subtab_energy, ENERGY_METRICS, "energy", "GJ"),
+            (subtab_waste, WASTE_METRICS, "waste", "tons"),
+            (subtab_water, WATER_METRICS, "water", "m3"),
+    ):
+        if subtab.open:
+            with subtab:
+                create_performance_analytics_tab(
+                    backend,
+                    selection,
+                    metric_options,
+                    metric_key_prefix=metric_key_prefix,
+                    unit_label=unit_label,
+                    tier_a_leaders_list=tier_a_companies_list,
+                    get_percentile_index=get_percentile_index,
+                )
 
-    with subtab_water:
-        metric_options = {
-            "Water consumption (GRI 303-5-a)": ['303-5-a'],
-            "Water consumption from water-stressed areas (GRI 303-5-b)": ['303-5-b']
-        }
-        create_performance_analytics_tab(
-            df_filtered,
-            metric_options,
-            metric_key_prefix="water",
-            unit_label="m3",
-            tier_a_leaders_list=tier_a_companies_list
-        )
 
-# --- Tab 5: Trends ---
-with tab5:
+@st.fragment
+def render_trends_tab(backend, selection: tuple):
+    """Вкладка 5: Year-over-Year Trends"""
+    import plotly.express as px  # импорт при первой отрисовке вкладки
     st.subheader("Year-over-Year Trends")
     st.write("Analyze the average relative percentage change in metrics across companies.")
 
     # Metric selection
-    trend_metrics = {
-        "GHG Emissions (Scope 1+2+3)": ['305-1-a', '305-2-a', '305-3-a'],
-        "Total Energy Consumption (GRI 302-1-e)": ['302-1-e'],
-        "Generated Waste (GRI 306-3-a)": ['306-3-a'],
-        "Water Consumption (GRI 303-5-a)": ['303-5-a']
-    }
-
     selected_trend_metric = st.selectbox(
         "Select metric to analyze:",
-        options=trend_metrics.keys(),
+        options=TREND_METRICS.keys(),
         key="trend_metric_select"
     )
 
-    selected_trend_codes = trend_metrics[selected_trend_metric]
+    selected_trend_codes = TREND_METRICS[selected_trend_metric]
 
-    # Filter data
-    df_trend = df_filtered[df_filtered['sub_code'].isin(selected_trend_codes)].copy()
+    # Sum values by company and year (in case multiple sub_codes are selected), then
+    # YoY change for every company and the per-year mean/median/count in one pass
+    # (zero baselines are skipped, year gaps follow YOY_GAP_POLICY)
+    with perf.stage("yoy_trend") as timing:
+        df_company_changes, df_avg_yoy = backend.yoy_trend(*selection, selected_trend_codes, gap_policy=YOY_GAP_POLICY)
+        timing["rows"] = len(df_company_changes)
 
-    if df_trend.empty:
-        st.warning(f"No data found for '{selected_trend_metric}'.")
+    if df_company_changes.empty:
+        st.warning(
+            "Not enough data to calculate year-over-year changes. Each company needs at least 2 consecutive years of data.")
     else:
-        # Sum values by company and year (in case multiple sub_codes are selected)
-        df_company_year = df_trend.groupby(['company', 'year'])['value'].sum().reset_index()
-        df_company_year = df_company_year.sort_values(by=['company', 'year'])
-
-        # Calculate YoY change for each company
-        company_changes = []
-
-        for company in df_company_year['company'].unique():
-            df_company = df_company_year[df_company_year['company'] == company].copy()
 
-            # Calculate percentage change for this company
-            df_company['yoy_change_pct'] = df_company['value'].pct_change() * 100
+        # Create line chart
+        st.markdown("###### Average Year-over-Year Percentage Change")
 
-            # Only keep rows with valid YoY changes
-            df_company_valid = df_company[df_company['yoy_change_pct'].notna()]
+        # Key insights
+        st.markdown("###### Key Insights")
+        cols_insights = st.columns(3)
 
-            # Add to our list
-            for _, row in df_company_valid.iterrows():
-                company_changes.append({
-                    'company': company,
-                    'year': row['year'],
-                    'yoy_change_pct': row['yoy_change_pct']
-                })
+        # Average growth rate
+        overall_avg = df_avg_yoy['mean_yoy_change'].mean()
+        cols_insights[0].metric("Overall Average YoY Change", f"{overall_avg:.2f}%")
 
-        if not company_changes:
-            st.warning(
-                "Not enough data to calculate year-over-year changes. Each company needs at least 2 consecutive years of data.")
-        else:
-            df_company_changes = pd.DataFrame(company_changes)
-
-            # Calculate average YoY change per year across all companies
-            df_avg_yoy = df_company_changes.groupby('year').agg({
-                'yoy_change_pct': ['mean', 'median', 'count']
-            }).reset_index()
-
-            # Flatten column names
-            df_avg_yoy.columns = ['year', 'mean_yoy_change', 'median_yoy_change', 'company_count']
-            df_avg_yoy = df_avg_yoy.sort_values(by='year')
-
-            # Create line chart
-            st.markdown("###### Average Year-over-Year Percentage Change")
-
-            # Key insights
-            st.markdown("###### Key Insights")
-            cols_insights = st.columns(3)
-
-            # Average growth rate
-            overall_avg = df_avg_yoy['mean_yoy_change'].mean()
-            cols_insights[0].metric("Overall Average YoY Change", f"{overall_avg:.2f}%")
-
-            # Max growth
-            max_growth = df_avg_yoy['mean_yoy_change'].max()
-            max_growth_year = df_avg_yoy.loc[df_avg_yoy['mean_yoy_change'].idxmax(), 'year']
-            cols_insights[1].metric(
-                "Highest Average Growth",
-                f"{max_growth:.2f}%",
-                delta=f"in {int(max_growth_year)}"
-            )
+        # Max growth
+        max_growth = df_avg_yoy['mean_yoy_change'].max()
+        max_growth_year = df_avg_yoy.loc[df_avg_yoy['mean_yoy_change'].idxmax(), 'year']
+        cols_insights[1].metric(
+            "Highest Average Growth",
+            f"{max_growth:.2f}%",
+            delta=f"in {int(max_growth_year)}"
+        )
 
-            # Max decline
-            min_growth = df_avg_yoy['mean_yoy_change'].min()
-            min_growth_year = df_avg_yoy.loc[df_avg_yoy['mean_yoy_change'].idxmin(), 'year']
-            cols_insights[2].metric(
-                "Largest Average Decline",
-                f"{min_growth:.2f}%",
-                delta=f"in {int(min_growth_year)}"
-            )
+        # Max decline
+        min_growth = df_avg_yoy['mean_yoy_change'].min()
+        min_growth_year = df_avg_yoy.loc[df_avg_yoy['mean_yoy_change'].idxmin(), 'year']
+        cols_insights[2].metric(
+            "Largest Average Decline",
+            f"{min_growth:.2f}%",
+            delta=f"in {int(min_growth_year)}"
+        )
 
-            st.info(f"This chart shows the average YoY change calculated across individual companies for each year.")
+        st.info(f"This chart shows the average YoY change calculated across individual companies for each year.")
 
+        with perf.stage("chart:trends"):
             fig_trend = px.line(
                 df_avg_yoy,
                 x='year',
@@ -837,20 +972,306 @@ with tab5:
                 hovermode='x unified'
             )
 
-            st.plotly_chart(fig_trend, use_container_width=True)
+            st.plotly_chart(fig_trend, width="stretch")
+
+        # Show detailed data in expander
+        with st.expander("Show detailed trend data"):
+            display_df = df_avg_yoy.copy()
+            display_df.columns = ['Year', 'Mean YoY Change (%)', 'Median YoY Change (%)', 'Number of Companies']
+            st.dataframe(
+                display_df,
+                column_config={
+                    "Year": st.column_config.NumberColumn("Year", format="%d"),
+                    "Mean YoY Change (%)": st.column_config.NumberColumn("Mean YoY Change (%)", format="%.2f"),
+                    "Median YoY Change (%)": st.column_config.NumberColumn("Median YoY Change (%)", format="%.2f"),
+                    "Number of Companies": st.column_config.NumberColumn("Companies", format="%d")
+                },
+                width="stretch",
+                hide_index=True
+            )
 
-            # Show detailed data in expander
-            with st.expander("Show detailed trend data"):
-                display_df = df_avg_yoy.copy()
-                display_df.columns = ['Year', 'Mean YoY Change (%)', 'Median YoY Change (%)', 'Number of Companies']
-                st.dataframe(
-                    display_df,
-                    column_config={
-                        "Year": st.column_config.NumberColumn("Year", format="%d"),
-                        "Mean YoY Change (%)": st.column_config.NumberColumn("Mean YoY Change (%)", format="%.2f"),
-                        "Median YoY Change (%)": st.column_config.NumberColumn("Median YoY Change (%)", format="%.2f"),
-                        "Number of Companies": st.column_config.NumberColumn("Companies", format="%d")
-                    },
-                    use_container_width=True,
-                    hide_index=True
-                )
+
+# --- Основная часть приложения ---
+
+# 1. Настройка страницы
+st.set_page_config(layout="wide", page_title="Industry Overview Dashboard")
+st.title("Industry Overview Dashboard")
+
+# 2. Загрузка данных
+# В реальном коде замените это на:
+metrics_url = data_cache.source_url('comparable_metrics.csv')
+topics_url = data_cache.source_url('material_topics.csv')
+leaders_url = data_cache.source_url('industry_leaders.csv')
+shared = None
+duckdb_backend = None
+if partitions.PARTITION_DIR:
+    # Снимок, разбитый по отраслям (partitions.py): в память попадают только выбранные отрасли
+    store = get_partition_store(partitions.read_manifest()["version"])
+    snapshot_key = (store.version,)
+    df_company_dim = store.df_company_dim
+elif shared_store.SHARED_DIR:
+    # Общий снимок всех процессов сервера (shared_store.py): таблицы отображены из файлов, без копий
+    manifest = shared_store.read_manifest() or shared_store.publish_sources()
+    with perf.stage("load") as timing:
+        shared = get_shared_snapshot(manifest["version"])
+        timing["rows"] = len(shared["metrics"])
+    snapshot_key = (shared.version,)
+    df_metrics, df_topics, df_leaders = shared["metrics"], shared["topics"], shared["leaders"]
+    df_company_dim, df_topics_merged, df_leaders_merged = (
+        shared["company_dim"], shared["topics_merged"], shared["leaders_merged"]
+    )
+elif backends.BACKEND == "duckdb" and not incremental.ENABLED:
+    # Данные больше памяти: воркер держит только справочник компаний, запросы идут в Parquet
+    with perf.stage("load"):
+        paths = load_snapshot_paths((metrics_url, topics_url, leaders_url))
+    snapshot_key = tuple(data_cache.snapshot_version(url) for url in (metrics_url, topics_url, leaders_url))
+    duckdb_backend, df_company_dim, filter_values = build_duckdb_backend(tuple(paths), snapshot_key)
+else:
+    try:
+        with perf.stage("load") as timing:
+            df_metrics, df_topics, df_leaders = load_original_data((metrics_url, topics_url, leaders_url))
+            timing["rows"] = len(df_metrics) + len(df_topics) + len(df_leaders)
+
+        snapshot_key = tuple(incremental.snapshot_version(url) for url in (metrics_url, topics_url, leaders_url))
+        # 1. Справочник компаний; 'df_topics' и 'df_leaders' получают company_id и размер
+        with perf.stage("merge") as timing:
+            df_company_dim, df_topics_merged, df_leaders_merged = build_company_tables(
+                df_metrics, df_topics, df_leaders, snapshot_key
+            )
+            timing["rows"] = len(df_company_dim)
+
+    except FileNotFoundError:
+        st.error(
+            "Error: CSV files not found. Make sure 'comparable_metrics.csv', 'material_topics.csv' and 'industry_leaders.csv' are in the same folder."
+        )
+        st.stop()
+# df_metrics, df_topics = load_mock_data()
+
+# 3. Фильтры в боковой панели
+st.sidebar.header("Filters")
+
+# Ручной сброс кэша: память + снапшоты на диске
+if st.sidebar.button("Refresh data", help="Drop cached tables and download them again"):
+    if partitions.PARTITION_DIR:
+        # Загруженные отрасли выгружаются, manifest.json читается заново
+        get_partition_store.clear()
+    elif shared is not None:
+        # Новая версия публикуется для всех процессов, они перейдут на нее при следующем запуске
+        data_cache.invalidate()
+        with st.spinner("Publishing snapshot..."):
+            shared_store.publish_sources(force=True)
+    elif incremental.ENABLED:
+        # Хранилище остается, докачаются только новые отчеты
+        for url in (metrics_url, topics_url, leaders_url):
+            incremental.invalidate(url)
+    else:
+        data_cache.invalidate()
+    load_original_data.clear()
+    load_snapshot_paths.clear()
+    st.rerun()
+
+if partitions.PARTITION_DIR:
+    # Несколько отраслей - сводные цифры собираются из агрегатов каждой отрасли
+    selected_industries = st.sidebar.multiselect(
+        'Industry',
+        options=store.industries,
+        default=store.industries[:1],
+    )
+    unique_countries, unique_sizes = store.filter_values(selected_industries)
+    st.sidebar.markdown("---")
+elif duckdb_backend is not None:
+    selected_industries = []
+    unique_countries, unique_sizes = filter_values
+else:
+    selected_industries = []
+    unique_countries = sorted(df_metrics['country'].unique())
+    unique_sizes = sorted(df_metrics['company_size'].unique())
+
+# Фильтр по стране
+select_all_countries = st.sidebar.checkbox("Select All Countries", value=True)
+
+if select_all_countries:
+    selected_countries = st.sidebar.multiselect(
+        'Country',
+        options=unique_countries,
+        default=list(unique_countries)
+    )
+else:
+    selected_countries = st.sidebar.multiselect(
+        'Country',
+        options=unique_countries,
+        default=[]
+    )
+
+# Фильтр по размеру компании
+st.sidebar.markdown("---")
+st.sidebar.subheader('Company Size')
+selected_sizes = []
+
+for size in unique_sizes:
+    if st.sidebar.checkbox(size, value=True):
+        selected_sizes.append(size)
+
+# 4. Применение фильтров
+# pandas (куб + маски FilterIndex) или DuckDB (USERS_BI_BACKEND=duckdb), один на снапшот;
+# все запросы ниже получают выбор сайдбара и возвращают уже агрегированные фреймы.
+# Результаты общие для всех сессий: одинаковый выбор в сайдбаре считается один раз
+with perf.stage("backend"):
+    if partitions.PARTITION_DIR:
+        # Отрасли входят в ключ кэша результатов: переключение отраслей не сбрасывает кэш
+        backend = result_cache.CachedBackend(
+            partitions.IndustryBackend(store, selected_industries),
+            get_result_cache(),
+            snapshot_key,
+            scope=sorted(selected_industries),
+        )
+    elif duckdb_backend is not None:
+        backend = result_cache.CachedBackend(duckdb_backend, get_result_cache(), snapshot_key)
+    else:
+        backend = result_cache.CachedBackend(
+            build_backend(
+                shared.tables if shared is not None else
+                {'metrics': df_metrics, 'topics': df_topics, 'leaders': df_leaders,
+                 'topics_merged': df_topics_merged, 'leaders_merged': df_leaders_merged},
+                df_company_dim,
+                snapshot_key,
+                (metrics_url, topics_url, leaders_url),
+            ),
+            get_result_cache(),
+            snapshot_key,
+        )
+selection = (selected_countries, selected_sizes)
+# Весь справочник без фильтров сайдбара (сравнение отчетов, индекс похожих компаний)
+everything = (tuple(unique_countries), tuple(unique_sizes))
+# Индексы строятся по данным выбранных отраслей - отрасли входят в их ключ
+index_key = snapshot_key + tuple(sorted(selected_industries))
+# Индекс похожих компаний строится по первому запросу сравнения
+get_peer_index = functools.partial(build_peer_index, backend, df_company_dim, index_key, everything)
+# Отсортированные значения метрики для перцентилей: get_percentile_index(sub_codes, n_years)
+get_percentile_index = functools.partial(build_percentile_index, backend, df_company_dim, index_key, everything)
+
+with perf.stage("kpi") as timing:
+    if incremental.ENABLED and not partitions.PARTITION_DIR and len(selected_countries) == len(unique_countries) and len(selected_sizes) == len(unique_sizes):
+        # Без фильтров KPI берутся из счетчиков, обновляемых при загрузке
+        kpis = incremental.kpi_counts(metrics_url)
+    else:
+        kpis = backend.kpi_counts(*selection)
+    timing["rows"] = kpis['metric_count']
+kpi_company_count = kpis['company_count']
+
+# Проверка, есть ли данные после фильтрации
+if kpis['metric_count'] == 0:
+    st.warning("No data for selected filters.")
+    st.stop()
+
+# 5. Блок 1: Статистические данные (KPIs)
+st.header("Our Database Statistics")
+st.markdown("---")
+
+cols = st.columns(5)  # Создаем 5 колонок для метрик
+
+# Метрика 1: Количество экстрагированных метрик
+cols[0].metric(label="Total Data Points", value=kpis['metric_count'])
+
+# Метрика 2: Количество уникальных бандлов
+cols[1].metric(label="Unique Reports", value=kpis['bundle_count'])
+
+# Метрика 3: Количество компаний
+cols[2].metric(label="Unique Companies", value=kpi_company_count)
+
+# Метрика 4: Количество стран
+cols[3].metric(label="Countries Covered", value=kpis['country_count'])
+
+# Метрика 5: Диапазон годов
+cols[4].metric(label="Year Range", value=f"{kpis['min_year']} - {kpis['max_year']}")
+
+# KPI уже отправлены в браузер: время от начала запуска до первой полезной отрисовки
+perf.record_stage("first_paint", perf.run_elapsed())
+
+st.markdown("---")
+
+# 6. Блок 2: Таблица со списком использованных файлов (под спойлером)
+st.header("Reports Used")
+
+# Таблица строится, только когда спойлер открыт (on_change="rerun" + .open)
+reports_expander = st.expander("Click to show list", key="reports_expander", on_change="rerun")
+if reports_expander.open:
+    with reports_expander:
+        render_reports_table(backend, selection, everything, get_peer_index)
+
+st.markdown("---")
+
+# Tier A лидеры среди компаний, прошедших фильтры сайдбара
+with perf.stage("leaders") as timing:
+    tier_a_companies_list = backend.cached(
+        "tier_a_companies", *selection,
+        lambda: backends.tier_a_companies(backend, *selection),
+    )
+    timing["rows"] = len(tier_a_companies_list)
+# 7. Блок 3: Вкладки с аналитикой (НОВЫЙ БЛОК)
+st.header("Industry Overview")
+
+# Вкладки рендерятся лениво: on_change="rerun" + tab.open, поэтому считается
+# только открытая вкладка, а виджеты внутри вкладки (fragment) перезапускают
+# только свою вкладку, а не весь дашборд
+tab1, tab2, tab3, tab4, tab5 = st.tabs(
+    ["Geography", "Common Disclosures", "Industry Leaders", "Performance", "Trends"],
+    key="main_tab",
+    on_change="rerun",
+)
+
+if tab1.open:
+    with tab1:
+        render_geography_tab(backend, selection)
+
+if tab2.open:
+    with tab2:
+        render_disclosures_tab(backend, selection, kpi_company_count)
+
+if tab3.open:
+    with tab3:
+        render_leaders_tab(backend, selection, everything, get_peer_index)
+
+if tab4.open:
+    with tab4:
+        render_performance_tab(backend, selection, tier_a_companies_list, get_percentile_index)
+
+if tab5.open:
+    with tab5:
+        render_trends_tab(backend, selection)
+
+# 8. Панель производительности (USERS_BI_DEBUG=1 или ?debug=1)
+cache_stats = backend.cache.stats()
+for name in ("hits", "misses", "evictions", "entries"):
+    perf.set_gauge(f"result_cache_{name}", cache_stats[name], f"Result cache {name}.")
+memory = shared_store.memory_usage() if shared is not None else {}
+for name, value in memory.items():
+    perf.set_gauge(f"process_{name}_mb", value, f"Process memory ({name}), MB.")
+if perf.DEBUG or st.query_params.get("debug") == "1":
+    with st.sidebar.expander("Performance (debug)"):
+        df_timings = pd.DataFrame(perf.run_records(), columns=["stage", "seconds", "rows"])
+        st.dataframe(
+            df_timings.assign(ms=df_timings["seconds"] * 1000).drop(columns="seconds").astype({"rows": "Int64"}),
+            column_config={"ms": st.column_config.NumberColumn("ms", format="%.1f")},
+            hide_index=True,
+        )
+        first_paint = df_timings.loc[df_timings["stage"] == "first_paint", "seconds"]
+        if len(first_paint):
+            over_budget = " - over budget!" if first_paint.iloc[0] > perf.FIRST_PAINT_BUDGET else ""
+            st.caption(f"First paint {first_paint.iloc[0]:.2f} s (budget {perf.FIRST_PAINT_BUDGET:.1f} s){over_budget}")
+        st.caption(
+            f"Result cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries, {cache_stats['size_mb']:.1f} of {cache_stats['budget_mb']:.0f} MB"
+        )
+        if partitions.PARTITION_DIR:
+            store_stats = store.stats()
+            st.caption(
+                f"Industries loaded: {', '.join(store_stats['loaded']) or 'none'}, "
+                f"{store_stats['size_mb']:.1f} of {store_stats['budget_mb']:.0f} MB "
+                f"({store_stats['loads']} loads, {store_stats['unloads']} unloads)"
+            )
+        if memory:
+            st.caption(
+                f"Shared snapshot {shared.version}: process RSS {memory['rss']:.0f} MB, "
+                f"PSS {memory['pss']:.0f} MB (shared pages split between workers)"
+            )
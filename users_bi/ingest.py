@@ -0,0 +1,129 @@
+"""
+Ingest step: raw CSV -> typed columnar snapshot (Parquet).
+
+Repeated strings (company, country, topic_name, ...) become categoricals,
+ids and years get the smallest integer dtype that fits, so the snapshot is
+small on disk and cheap to keep in memory for every worker.
+
+Usage:
+    python ingest.py comparable_metrics.csv material_topics.csv industry_leaders.csv --out snapshots
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Строковые колонки с большим числом повторов -> category
+CATEGORY_COLUMNS = [
+    "company", "company_size", "country", "country_iso3", "industry",
+    "sub_code", "topic_name", "category_name", "tier",
+]
+INTEGER_COLUMNS = ["year", "bundle_id", "company_id"]
+# dtype для pd.read_csv: строки сразу парсятся в category, без object-копии
+CSV_DTYPES = {col: "category" for col in CATEGORY_COLUMNS}
+FLOAT_COLUMNS = ["value"]
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns a copy of `df` with compact dtypes for the known columns."""
+    df = df.copy()
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in INTEGER_COLUMNS:
+        if col in df.columns:
+            # Если в колонке есть пропуски, to_numeric оставит float
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            values = pd.to_numeric(df[col])
+            as_float32 = values.astype(np.float32)
+            # float32 только если он ничего не теряет, иначе суммы поплывут
+            if np.array_equal(as_float32.to_numpy(np.float64), values.to_numpy(np.float64), equal_nan=True):
+                values = as_float32
+            df[col] = values
+    return df
+
+
+# Колонки справочника компаний
+COMPANY_DIM_COLUMNS = ["company_id", "company", "company_size", "country", "country_iso3", "industry", "tier"]
+
+
+def build_company_dim(df_metrics: pd.DataFrame, df_topics: pd.DataFrame, df_leaders: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per company with its integer id, size, country, industry and
+    best leader tier. Companies that appear only in topics or leaders get
+    ids after the largest id from the metrics table.
+    """
+    attrs = ["company_id", "company", "company_size", "country", "country_iso3", "industry"]
+    # Категории у трех таблиц разные, поэтому собираем справочник на object-колонках
+    df_dim = (
+        df_metrics[attrs].drop_duplicates(subset="company")
+        .astype({col: object for col in attrs if col != "company_id"})
+        .astype({"company_id": "int64"})
+    )
+
+    df_other = pd.concat(
+        [df_topics[["company", "country", "industry"]].astype(object),
+         df_leaders[["company", "country"]].astype(object)],
+        ignore_index=True,
+    ).drop_duplicates(subset="company")
+    df_other = df_other[~df_other["company"].isin(df_dim["company"])]
+    if not df_other.empty:
+        first_new_id = int(df_dim["company_id"].max()) + 1 if len(df_dim) else 1
+        df_other = df_other.assign(company_id=np.arange(first_new_id, first_new_id + len(df_other)))
+        df_dim = pd.concat([df_dim, df_other], ignore_index=True)
+
+    # 'A' < 'B': лучший tier компании за все годы
+    best_tier = df_leaders[["company", "tier"]].astype(object).groupby("company")["tier"].min()
+    df_dim["tier"] = df_dim["company"].map(best_tier)
+
+    return optimize_dtypes(df_dim[COMPANY_DIM_COLUMNS].sort_values(by="company_id").reset_index(drop=True))
+
+
+def attach_company_keys(df: pd.DataFrame, df_dim: pd.DataFrame) -> pd.DataFrame:
+    """Adds company_id and company_size from the dimension by a positional lookup on the name."""
+    pos = pd.Index(df_dim["company"].astype(object)).get_indexer(df["company"].astype(object))
+    missing = pos < 0
+
+    company_ids = df_dim["company_id"].to_numpy()[pos]
+    size_codes = df_dim["company_size"].cat.codes.to_numpy()[pos]
+    size_codes[missing] = -1
+
+    df = df.copy()
+    df["company_id"] = np.where(missing, -1, company_ids)
+    df["company_size"] = pd.Categorical.from_codes(size_codes, dtype=df_dim["company_size"].dtype)
+    return df
+
+
+def write_snapshot(df: pd.DataFrame, path: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str) -> pd.DataFrame:
+    return pd.read_parquet(path)
+
+
+def csv_to_snapshot(csv_path: str, out_dir: str) -> str:
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    out_path = os.path.join(out_dir, f"{name}.parquet")
+    write_snapshot(optimize_dtypes(pd.read_csv(csv_path)), out_path)
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert source CSVs into typed Parquet snapshots.")
+    parser.add_argument("csv_files", nargs="+")
+    parser.add_argument("--out", default="snapshots", help="Output directory")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for csv_path in args.csv_files:
+        print(csv_to_snapshot(csv_path, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Metrics shown by the dashboard: GRI sub_codes behind every metric option
+and the averaging/YoY settings. Shared by the Streamlit app and the
+headless export (export.py), so both compute the same views.
+"""
+
+# Среднее считается по последним N годам отчетности каждой компании
+AVERAGE_WINDOW_YEARS = 3
+# Политика для разрывов между годами в YoY (см. analytics.YOY_GAP_POLICIES)
+YOY_GAP_POLICY = "consecutive"
+
+# Метрики подвкладок Performance и вкладки Trends: название -> GRI sub_codes
+GHG_METRICS = {
+    "GHG Emissions (Scope 1+2+3)": ['305-1-a', '305-2-a', '305-3-a']
+}
+ENERGY_METRICS = {
+    "Total energy consumption (GRI 302-1-e)": ['302-1-e'],
+    "Consumption of electricity, heating, etc. (GRI 302-1-c)": ['302-1-c'],
+    "Fuel consumption (GRI 302-1-a + 302-1-b)": ['302-1-a', '302-1-b']
+}
+WASTE_METRICS = {
+    "Generated waste (GRI 306-3-a)": ['306-3-a'],
+    "Recycled waste (GRI 306-4-a)": ['306-4-a'],
+    "Landfilled waste (GRI 306-5-c)": ['306-5-c'],
+    "Incinerated waste (GRI 306-5-a)": ['306-5-a']
+}
+WATER_METRICS = {
+    "Water consumption (GRI 303-5-a)": ['303-5-a'],
+    "Water consumption from water-stressed areas (GRI 303-5-b)": ['303-5-b']
+}
+TREND_METRICS = {
+    "GHG Emissions (Scope 1+2+3)": ['305-1-a', '305-2-a', '305-3-a'],
+    "Total Energy Consumption (GRI 302-1-e)": ['302-1-e'],
+    "Generated Waste (GRI 306-3-a)": ['306-3-a'],
+    "Water Consumption (GRI 303-5-a)": ['303-5-a']
+}
+# Метрики в окне сравнения отчетов
+COMPARE_METRICS = {
+    "Scope 1 (GRI 305-1-a)": ['305-1-a'],
+    "Scope 2 (GRI 305-2-a)": ['305-2-a'],
+    "Scope 3 (GRI 305-3-a)": ['305-3-a'],
+    **ENERGY_METRICS,
+    **WASTE_METRICS,
+    **WATER_METRICS,
+}
+
+# Подвкладки Performance: префикс -> (метрики, единица измерения)
+PERFORMANCE_METRICS = {
+    "ghg": (GHG_METRICS, "tCO2e"),
+    "energy": (ENERGY_METRICS, "GJ"),
+    "waste": (WASTE_METRICS, "tons"),
+    "water": (WATER_METRICS, "m3"),
+}
@@ -0,0 +1,311 @@
+"""
+Industry-partitioned snapshots, loaded on demand.
+
+`python partitions.py --out partitions` writes the three source tables as
+Parquet datasets partitioned by industry (and optionally year):
+
+    <out>/manifest.json                     current version, industries
+    <out>/<version>/company_dim.parquet     all companies, small
+    <out>/<version>/<table>/industry=<name>/[year=<year>/]*.parquet
+
+The manifest is replaced atomically after a version is fully written, so a
+running app keeps reading the old version until it reloads.
+
+PartitionStore loads one industry at a time into a PandasBackend and
+unloads the least recently used industries once the loaded ones go over a
+memory budget. IndustryBackend answers the usual backend queries for a set
+of industries by querying each industry and merging the aggregates: a
+company belongs to exactly one industry, so counts add up and per-company
+results are concatenated.
+
+Usage:
+    python partitions.py --out partitions
+    python partitions.py --out partitions --by-year comparable_metrics.csv material_topics.csv industry_leaders.csv
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import analytics
+import backends
+import data_cache
+import ingest
+import perf
+
+PARTITION_DIR = os.environ.get("USERS_BI_PARTITION_DIR")
+# Память под загруженные отрасли, МБ
+DEFAULT_BUDGET_MB = int(os.environ.get("USERS_BI_PARTITION_BUDGET_MB", 512))
+TABLES = ("metrics", "topics", "leaders")
+SOURCE_FILES = {
+    "metrics": "comparable_metrics.csv",
+    "topics": "material_topics.csv",
+    "leaders": "industry_leaders.csv",
+}
+# Компании без отрасли (есть только в industry_leaders.csv)
+UNKNOWN_INDUSTRY = "Unknown"
+MANIFEST = "manifest.json"
+
+
+def _with_industry(df: pd.DataFrame, industry_of: pd.Series) -> pd.DataFrame:
+    # Отрасль строки - отрасль компании из справочника: компания целиком лежит в одной партиции
+    df = df.copy()
+    df["industry"] = df["company"].astype(object).map(industry_of).fillna(UNKNOWN_INDUSTRY).astype("category")
+    return df
+
+
+def write_partitions(df_metrics: pd.DataFrame, df_topics: pd.DataFrame, df_leaders: pd.DataFrame,
+                     out_dir: str, by_year: bool = False) -> dict:
+    """Writes a new version of the partitioned snapshot and switches the manifest to it."""
+    df_company_dim = ingest.build_company_dim(df_metrics, df_topics, df_leaders)
+    industry_of = pd.Series(df_company_dim["industry"].astype(object).to_numpy(),
+                            index=df_company_dim["company"].astype(object))
+    df_company_dim = _with_industry(df_company_dim, industry_of)
+
+    version = time.strftime("%Y%m%d-%H%M%S")
+    version_dir = os.path.join(out_dir, version)
+    os.makedirs(version_dir)
+    partition_by = ["industry", "year"] if by_year else ["industry"]
+    for name, df in zip(TABLES, (df_metrics, df_topics, df_leaders)):
+        df = _with_industry(df, industry_of)
+        df.to_parquet(os.path.join(version_dir, name), partition_cols=partition_by, index=False)
+        if name == "metrics":
+            # Значения фильтров сайдбара по отраслям - чтобы построить сайдбар, ничего не загружая
+            filters = {
+                str(industry): {
+                    "countries": sorted(group["country"].astype(str).unique()),
+                    "sizes": sorted(group["company_size"].astype(str).unique()),
+                }
+                for industry, group in df.groupby("industry", observed=True)
+            }
+    df_company_dim.to_parquet(os.path.join(version_dir, "company_dim.parquet"), index=False)
+
+    manifest = {
+        "version": version,
+        "partition_by": partition_by,
+        "industries": sorted(df_company_dim["industry"].astype(str).unique()),
+        "filters": filters,
+    }
+    tmp_path = os.path.join(out_dir, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST))
+    _remove_old_versions(out_dir, keep=2)
+    return manifest
+
+
+def _remove_old_versions(out_dir: str, keep: int):
+    # Предыдущую версию оставляем: ее может читать процесс, еще не перечитавший manifest
+    versions = sorted(
+        name for name in os.listdir(out_dir)
+        if os.path.isdir(os.path.join(out_dir, name)) and name[:1].isdigit()
+    )
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+
+
+def _frame_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def read_manifest(root: str = PARTITION_DIR) -> dict:
+    with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class PartitionStore:
+    def __init__(self, root: str = PARTITION_DIR, budget_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024,
+                 manifest: dict = None):
+        manifest = manifest or read_manifest(root)
+        self.root = root
+        self.version = manifest["version"]
+        self.industries = manifest["industries"]
+        self.partition_by = manifest["partition_by"]
+        self._filters = manifest["filters"]
+        self.budget_bytes = budget_bytes
+        self.path = os.path.join(root, self.version)
+        self.df_company_dim = ingest.read_snapshot(os.path.join(self.path, "company_dim.parquet"))
+        self.loads = 0
+        self.unloads = 0
+        self._loaded = OrderedDict()  # industry -> (backend, nbytes)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def _read(self, table: str, industry: str) -> pd.DataFrame:
+        df = pd.read_parquet(os.path.join(self.path, table), filters=[("industry", "==", industry)])
+        # Колонки разбиения читаются как category: год возвращаем в целые
+        for col in self.partition_by:
+            if col in ingest.INTEGER_COLUMNS:
+                df[col] = df[col].astype("int64")
+        return ingest.optimize_dtypes(df)
+
+    def _load(self, industry: str):
+        with perf.stage("partition_load") as timing:
+            frames = [self._read(table, industry) for table in TABLES]
+            df_dim = self.df_company_dim[self.df_company_dim["industry"] == industry]
+            backend = backends.build_pandas_backend(*frames, df_company_dim=df_dim)
+            nbytes = sum(_frame_nbytes(df) for df in backend.tables.values())
+            timing["rows"] = sum(len(df) for df in frames)
+        return backend, nbytes
+
+    def backend(self, industry: str):
+        """PandasBackend of one industry, loaded on first use."""
+        with self._lock:
+            if industry in self._loaded:
+                self._loaded.move_to_end(industry)
+                return self._loaded[industry][0]
+
+            backend, nbytes = self._load(industry)
+            self._loaded[industry] = (backend, nbytes)
+            self._nbytes += nbytes
+            self.loads += 1
+            # Выгружаем давно не использованные отрасли; только что загруженная остается всегда
+            while self._nbytes > self.budget_bytes and len(self._loaded) > 1:
+                _, (_, evicted_bytes) = self._loaded.popitem(last=False)
+                self._nbytes -= evicted_bytes
+                self.unloads += 1
+            return backend
+
+    def filter_values(self, industries) -> tuple:
+        """Sorted (countries, sizes) of the sidebar for the given industries."""
+        countries, sizes = set(), set()
+        for industry in industries:
+            countries.update(self._filters.get(industry, {}).get("countries", []))
+            sizes.update(self._filters.get(industry, {}).get("sizes", []))
+        return sorted(countries), sorted(sizes)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": list(self._loaded),
+                "size_mb": self._nbytes / 1024 / 1024,
+                "budget_mb": self.budget_bytes / 1024 / 1024,
+                "loads": self.loads,
+                "unloads": self.unloads,
+            }
+
+
+class IndustryBackend:
+    """Backend over several industries: every query runs per industry and the results are merged."""
+
+    def __init__(self, store: PartitionStore, industries):
+        self.store = store
+        self.industries = list(industries)
+
+    def _each(self, method: str, *args, **kwargs) -> list:
+        # Отрасли грузятся по одной, поэтому одновременно в памяти не больше бюджета + одна отрасль
+        return [getattr(self.store.backend(industry), method)(*args, **kwargs) for industry in self.industries]
+
+    @staticmethod
+    def _concat(frames: list) -> pd.DataFrame:
+        # Пустые результаты отраслей не участвуют в concat (иначе теряются типы колонок)
+        non_empty = [df for df in frames if len(df)]
+        if not non_empty:
+            return frames[0] if frames else pd.DataFrame()
+        return pd.concat(non_empty, ignore_index=True)
+
+    def filtered(self, name: str, countries, sizes) -> pd.DataFrame:
+        return self._concat(self._each("filtered", name, countries, sizes))
+
+    def kpi_counts(self, countries, sizes) -> dict:
+        kpis = [kpi for kpi in self._each("kpi_counts", countries, sizes) if kpi["metric_count"]]
+        if not kpis:
+            return {"metric_count": 0, "bundle_count": 0, "company_count": 0, "country_count": 0,
+                    "min_year": None, "max_year": None}
+        countries_covered = set()
+        for df_geo in self._each("geo_counts", countries, sizes):
+            countries_covered.update(df_geo["country"].astype(str))
+        return {
+            "metric_count": sum(kpi["metric_count"] for kpi in kpis),
+            # Отчет и компания принадлежат одной отрасли - счетчики складываются
+            "bundle_count": sum(kpi["bundle_count"] for kpi in kpis),
+            "company_count": sum(kpi["company_count"] for kpi in kpis),
+            "country_count": len(countries_covered),
+            "min_year": min(kpi["min_year"] for kpi in kpis),
+            "max_year": max(kpi["max_year"] for kpi in kpis),
+        }
+
+    def reports_list(self, countries, sizes) -> pd.DataFrame:
+        df = self._concat(self._each("reports_list", countries, sizes))
+        return df.sort_values(by=["company", "year"], kind="stable").reset_index(drop=True) if len(df) else df
+
+    def reports_page(self, countries, sizes, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = backends.PAGE_SIZE):
+        return backends.paginate(self.reports_list(countries, sizes), search, sort_by, ascending, offset, limit)
+
+    def leaders_page(self, countries, sizes, tiers, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = backends.PAGE_SIZE):
+        df = self._concat([
+            backends.leaders_list(df_leaders, tiers) for df_leaders in self._each("filtered", "leaders", countries, sizes)
+        ])
+        if len(df):
+            df = df.sort_values(by=["company", "year"], kind="stable").reset_index(drop=True)
+        return backends.paginate(df, search, sort_by, ascending, offset, limit)
+
+    def geo_counts(self, countries, sizes) -> pd.DataFrame:
+        df = self._concat(self._each("geo_counts", countries, sizes))
+        if df.empty:
+            return df
+        return (
+            df.astype({"country": str, "country_iso3": str})
+            .groupby(["country", "country_iso3"])["company_count"].sum()
+            .reset_index()
+        )
+
+    def _shares(self, method: str, keys: list, countries, sizes, company_count: int) -> pd.DataFrame:
+        df = self._concat(self._each(method, countries, sizes, company_count))
+        if df.empty:
+            return df
+        df = df.astype({key: str for key in keys}).groupby(keys)["company_count"].sum().reset_index()
+        df["share_pct"] = (df["company_count"] / company_count) * 100
+        return df
+
+    def category_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return self._shares("category_shares", ["category_name"], countries, sizes, company_count)
+
+    def topic_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return self._shares("topic_shares", ["category_name", "topic_name"], countries, sizes, company_count)
+
+    def company_year_sums(self, countries, sizes, sub_codes: list) -> pd.DataFrame:
+        return self._concat(self._each("company_year_sums", countries, sizes, sub_codes))
+
+    def latest_years_average(self, countries, sizes, sub_codes: list, n_years: int = 3) -> pd.DataFrame:
+        df = self._concat(self._each("latest_years_average", countries, sizes, sub_codes, n_years=n_years))
+        if df.empty:
+            return df
+        return df.sort_values(by="average_value", ascending=False, kind="stable").reset_index(drop=True)
+
+    def yoy_trend(self, countries, sizes, sub_codes: list, gap_policy: str = "consecutive"):
+        df_changes = self._concat([
+            df for df, _ in self._each("yoy_trend", countries, sizes, sub_codes, gap_policy=gap_policy)
+        ])
+        if df_changes.empty:
+            return df_changes, analytics.yoy_summary(pd.DataFrame(columns=["year", "yoy_change_pct"]))
+        return df_changes, analytics.yoy_summary(df_changes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write industry-partitioned Parquet snapshots.")
+    parser.add_argument("csv_files", nargs="*",
+                        help="metrics, topics and leaders CSV (default: download from USERS_BI_DATA_URL)")
+    parser.add_argument("--out", default=PARTITION_DIR or "partitions", help="Output directory")
+    parser.add_argument("--by-year", action="store_true", help="Also partition by year")
+    args = parser.parse_args()
+
+    if args.csv_files:
+        frames = [ingest.optimize_dtypes(pd.read_csv(path, dtype=ingest.CSV_DTYPES)) for path in args.csv_files]
+    else:
+        frames = data_cache.fetch_all(data_cache.source_url(SOURCE_FILES[table]) for table in TABLES)
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest = write_partitions(*frames, args.out, by_year=args.by_year)
+    print(f"version {manifest['version']}: {len(manifest['industries'])} industries -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Nearest-peer index over per-company metric vectors.
+
+Every company gets one vector: the average of its latest reporting years
+for each of PEER_FEATURES (GHG scopes, energy, waste, water). Values are
+log-scaled and standardized per feature, so a company with 10x the
+emissions is as far away as one with 1/10 of them. Companies rarely report
+every metric: the distance is the mean squared difference over the
+features both companies report, and pairs with fewer than
+MIN_SHARED_FEATURES of them are not compared at all.
+
+The `n_neighbours` nearest peers of every company are computed once, in
+blocks of rows (matrix products, no Python loop over pairs), so a query is
+a lookup. Only queries restricted to a small part of the companies fall
+back to computing one row of distances.
+"""
+import numpy as np
+import pandas as pd
+
+# Признаки вектора компании: название -> GRI sub_codes
+PEER_FEATURES = {
+    "Scope 1": ['305-1-a'],
+    "Scope 2": ['305-2-a'],
+    "Scope 3": ['305-3-a'],
+    "Energy": ['302-1-e'],
+    "Waste": ['306-3-a'],
+    "Water": ['303-5-a'],
+}
+MIN_SHARED_FEATURES = 2
+N_NEIGHBOURS = 50
+# Строк на блок при подсчете соседей: память ~ BLOCK_ROWS x число компаний
+BLOCK_ROWS = 512
+
+
+def company_features(backend, countries, sizes, features: dict = PEER_FEATURES, n_years: int = 3) -> pd.DataFrame:
+    """One row per company, one column per feature (NaN if not reported)."""
+    columns = {}
+    for name, sub_codes in features.items():
+        df_avg = backend.latest_years_average(countries, sizes, sub_codes, n_years=n_years)
+        columns[name] = df_avg.set_index(df_avg["company"].astype(str))["average_value"]
+    return pd.DataFrame(columns, columns=list(features))
+
+
+def normalize(df_features: pd.DataFrame) -> np.ndarray:
+    """Signed log1p, then z-score per feature; missing values stay NaN."""
+    values = df_features.to_numpy(dtype="float64")
+    values = np.sign(values) * np.log1p(np.abs(values))
+    with np.errstate(invalid="ignore"):
+        std = np.nanstd(values, axis=0)
+        values = (values - np.nanmean(values, axis=0)) / np.where(std > 0, std, 1.0)
+    return values.astype("float32")
+
+
+class PeerIndex:
+    def __init__(self, df_features: pd.DataFrame, df_companies: pd.DataFrame = None,
+                 n_neighbours: int = N_NEIGHBOURS, min_shared: int = MIN_SHARED_FEATURES):
+        """
+        `df_features` is indexed by company (see company_features).
+        `df_companies` (company, country, company_size, ...) is used to
+        restrict queries to the sidebar selection and to label the result.
+        """
+        self.companies = df_features.index.astype(str).to_numpy()
+        self.features = list(df_features.columns)
+        self.min_shared = min_shared
+        self._position = {company: i for i, company in enumerate(self.companies)}
+
+        if df_companies is None:
+            df_companies = pd.DataFrame({"company": self.companies})
+        self.df_companies = (
+            df_companies.astype({"company": str})
+            .drop_duplicates("company")
+            .set_index("company")
+            .reindex(self.companies)
+        )
+
+        values = normalize(df_features)
+        self._mask = (~np.isnan(values)).astype("float32")
+        self._values = np.nan_to_num(values)
+        self._squares = self._values ** 2
+        self._build(min(n_neighbours, max(len(self.companies) - 1, 0)))
+
+    def __len__(self) -> int:
+        return len(self.companies)
+
+    def _distances(self, rows, columns=slice(None)):
+        """Mean squared difference and number of shared features, rows x columns."""
+        mask, values, squares = self._mask, self._values, self._squares
+        shared = mask[rows] @ mask[columns].T
+        # sum (a - b)^2 по общим признакам = a^2 * [b есть] + [a есть] * b^2 - 2ab (пропуски = 0)
+        sq_sum = squares[rows] @ mask[columns].T + mask[rows] @ squares[columns].T \
+            - 2 * values[rows] @ values[columns].T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distance = np.maximum(sq_sum, 0) / shared
+        distance[shared < self.min_shared] = np.inf
+        return distance, shared
+
+    def _build(self, k: int):
+        n = len(self.companies)
+        self._neighbours = np.zeros((n, k), dtype=np.int32)
+        self._neighbour_distances = np.full((n, k), np.inf, dtype=np.float32)
+        self._neighbour_shared = np.zeros((n, k), dtype=np.int8)
+        if k == 0:
+            return
+        for start in range(0, n, BLOCK_ROWS):
+            rows = np.arange(start, min(start + BLOCK_ROWS, n))
+            distance, shared = self._distances(rows)
+            distance[np.arange(len(rows)), rows] = np.inf
+
+            nearest = np.argpartition(distance, k - 1, axis=1)[:, :k]
+            nearest_distance = np.take_along_axis(distance, nearest, axis=1)
+            order = np.argsort(nearest_distance, axis=1, kind="stable")
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            self._neighbours[rows] = nearest
+            self._neighbour_distances[rows] = np.take_along_axis(distance, nearest, axis=1)
+            self._neighbour_shared[rows] = np.take_along_axis(shared, nearest, axis=1)
+
+    def _allowed(self, countries=None, sizes=None) -> np.ndarray:
+        allowed = np.ones(len(self.companies), dtype=bool)
+        if countries is not None and "country" in self.df_companies:
+            allowed &= self.df_companies["country"].astype(str).isin([str(c) for c in countries]).to_numpy()
+        if sizes is not None and "company_size" in self.df_companies:
+            allowed &= self.df_companies["company_size"].astype(str).isin([str(s) for s in sizes]).to_numpy()
+        return allowed
+
+    def peers(self, company: str, n: int = 10, countries=None, sizes=None) -> pd.DataFrame:
+        """
+        `n` most similar companies to `company`, optionally only among those
+        in `countries` x `sizes`. Empty if the company is not in the index.
+        """
+        i = self._position.get(str(company))
+        if i is None:
+            return self._result([], [], [])
+
+        allowed = self._allowed(countries, sizes)
+        allowed[i] = False
+        neighbours = self._neighbours[i]
+        keep = allowed[neighbours] & np.isfinite(self._neighbour_distances[i])
+        # Список соседей кончается бесконечностью - в нем все сравнимые компании
+        complete = len(neighbours) > 0 and not np.isfinite(self._neighbour_distances[i][-1])
+        if keep.sum() >= n or complete:
+            # Хватает заранее посчитанных соседей
+            chosen = neighbours[keep][:n]
+            return self._result(chosen, self._neighbour_distances[i][keep][:n], self._neighbour_shared[i][keep][:n])
+
+        # Выбор в сайдбаре отсекает почти всех соседей - считаем одну строку расстояний
+        candidates = np.flatnonzero(allowed)
+        distance, shared = self._distances([i], candidates)
+        distance, shared = distance[0], shared[0]
+        order = np.argsort(distance, kind="stable")[:n]
+        order = order[np.isfinite(distance[order])]
+        return self._result(candidates[order], distance[order], shared[order])
+
+    def _result(self, positions, distances, shared) -> pd.DataFrame:
+        positions = np.asarray(positions, dtype=np.intp)
+        distances = np.sqrt(np.asarray(distances, dtype="float64"))
+        df = self.df_companies.iloc[positions].reset_index()
+        df["similarity"] = 1 / (1 + distances)
+        df["shared_metrics"] = np.asarray(shared, dtype=int)
+        return df
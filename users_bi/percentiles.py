@@ -0,0 +1,76 @@
+"""
+Precomputed distributions for "where does company X rank" lookups.
+
+The per-company values of one metric (latest-years averages) are split by
+the peer filter partition - (country, company_size, tier) - and kept as
+sorted arrays. A company's percentile within any selection of partitions
+is then a binary search in each selected array, no matter how many
+companies there are and without recomputing the averages.
+"""
+import numpy as np
+import pandas as pd
+
+# tier компаний, которые не входят в лидеры
+NO_TIER = "none"
+PARTITION_KEYS = ["country", "company_size", "tier"]
+
+
+class PercentileIndex:
+    def __init__(self, df_values: pd.DataFrame, df_companies: pd.DataFrame, value_col: str = "average_value"):
+        """
+        `df_values` has one row per company (company, `value_col`),
+        `df_companies` maps company to country, company_size and tier.
+        """
+        df = df_values[["company", value_col]].astype({"company": str}).merge(
+            df_companies[["company", *PARTITION_KEYS]].astype(object).astype({"company": str})
+            .drop_duplicates("company"),
+            on="company",
+            how="left",
+        )
+        df["tier"] = df["tier"].fillna(NO_TIER)
+        df = df.dropna(subset=[value_col]).sort_values(by=value_col, kind="stable")
+
+        self._values = dict(zip(df["company"], df[value_col].to_numpy(dtype="float64")))
+        # groupby сохраняет порядок строк внутри группы - массивы уже отсортированы
+        self._partitions = {
+            key: group[value_col].to_numpy(dtype="float64")
+            for key, group in df.groupby(PARTITION_KEYS, dropna=False, sort=False)
+        }
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def value(self, company: str):
+        return self._values.get(str(company))
+
+    def counts(self, value: float, countries, sizes, tiers=None) -> tuple:
+        """(below, below_or_equal, total) of the selected partitions."""
+        countries = {str(c) for c in countries}
+        sizes = {str(s) for s in sizes}
+        tiers = None if tiers is None else {str(t) for t in tiers}
+        below = below_or_equal = total = 0
+        for (country, size, tier), values in self._partitions.items():
+            if str(country) in countries and str(size) in sizes and (tiers is None or str(tier) in tiers):
+                below += int(np.searchsorted(values, value, side="left"))
+                below_or_equal += int(np.searchsorted(values, value, side="right"))
+                total += len(values)
+        return below, below_or_equal, total
+
+    def percentile(self, company: str, countries, sizes, tiers=None):
+        """
+        Value, percentile (mid-rank, 0-100) and rank (1 = highest) of
+        `company` among the companies in `countries` x `sizes` x `tiers`.
+        None if the company has no value or the peer group is empty.
+        """
+        value = self.value(company)
+        if value is None:
+            return None
+        below, below_or_equal, total = self.counts(value, countries, sizes, tiers)
+        if total == 0:
+            return None
+        return {
+            "value": value,
+            "percentile": 100 * (below + below_or_equal) / 2 / total,
+            "rank": total - below_or_equal + 1,
+            "total": total,
+        }
@@ -0,0 +1,188 @@
+"""
+Stage-level timing of the dashboard script.
+
+    with perf.stage("kpi") as s:
+        kpis = ...
+        s["rows"] = kpis["metric_count"]
+
+Every finished stage is
+- logged as one JSON line (logger "perf", level INFO); `streamlit run` does
+  not configure that logger, so set USERS_BI_PERF_LOG=stderr (or a file
+  path) to get the lines:
+
+      USERS_BI_PERF_LOG=/var/log/users_bi/perf.jsonl streamlit run industry_overview.py
+
+- added to process-wide totals that are written in Prometheus text format
+  to USERS_BI_METRICS_FILE (e.g. for the node_exporter textfile collector),
+- kept in the list of the current script run, which the app shows in the
+  sidebar debug panel.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("perf")
+
+# USERS_BI_PERF_LOG=stderr или путь к файлу - куда писать JSON-строки стадий
+PERF_LOG = os.environ.get("USERS_BI_PERF_LOG")
+METRICS_FILE = os.environ.get("USERS_BI_METRICS_FILE")
+# Файл метрик переписывается не чаще, чем раз в столько секунд
+METRICS_INTERVAL = float(os.environ.get("USERS_BI_METRICS_INTERVAL", 10))
+# USERS_BI_DEBUG=1 - панель с таймингами в сайдбаре (также ?debug=1 в URL)
+DEBUG = os.environ.get("USERS_BI_DEBUG", "0") == "1"
+# Бюджет на первую отрисовку (KPI на экране), секунды; проверяется serve.py и панелью отладки
+FIRST_PAINT_BUDGET = float(os.environ.get("USERS_BI_FIRST_PAINT_BUDGET", 3))
+
+_totals = {}  # stage -> [count, seconds, rows, max_seconds]
+_gauges = {}  # name -> (value, help)
+_lock = threading.Lock()
+_last_write = 0.0
+_run = threading.local()
+
+
+def configure_log(target: str) -> logging.Handler:
+    """Sends the stage lines of the "perf" logger to stderr ("stderr") or appends them to the file `target`."""
+    handler = logging.StreamHandler() if target == "stderr" else logging.FileHandler(target, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    # Модуль импортируется один раз на процесс, но configure_log можно вызвать и снаружи - без дублей
+    for old in [h for h in logger.handlers if getattr(h, "_users_bi_perf", False)]:
+        logger.removeHandler(old)
+        old.close()
+    handler._users_bi_perf = True
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    return handler
+
+
+if PERF_LOG:
+    configure_log(PERF_LOG)
+
+
+def start_run() -> list:
+    """Starts a new list of stage records for the script run in this thread."""
+    _run.records = []
+    _run.start = time.perf_counter()
+    return _run.records
+
+
+def run_elapsed() -> float:
+    """Seconds since start_run() in this thread."""
+    return time.perf_counter() - getattr(_run, "start", time.perf_counter())
+
+
+def run_records() -> list:
+    return getattr(_run, "records", [])
+
+
+def in_run(fn):
+    """
+    Wraps `fn` for another thread (e.g. a ThreadPoolExecutor task): stages it
+    records go to the script run of the calling thread, not to a list of the
+    worker thread that nobody reads.
+    """
+    records, start = getattr(_run, "records", None), getattr(_run, "start", None)
+    if records is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        _run.records, _run.start = records, start
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # Потоки пула переиспользуются - не оставляем им чужой запуск
+            del _run.records, _run.start
+
+    return wrapper
+
+
+@contextmanager
+def stage(name: str, rows: int = None):
+    record = {"stage": name, "rows": rows}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _finish(record)
+
+
+def record_stage(name: str, seconds: float, rows: int = None):
+    """Adds a stage measured elsewhere (e.g. time from the start of the run to first paint)."""
+    _finish({"stage": name, "rows": rows, "seconds": seconds})
+
+
+def _finish(record: dict):
+    run_records().append(record)
+    logger.info(json.dumps({"event": "stage", "ts": time.time(), **record}))
+    with _lock:
+        totals = _totals.setdefault(record["stage"], [0, 0.0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += record["seconds"]
+        totals[2] += record["rows"] or 0
+        totals[3] = max(totals[3], record["seconds"])
+    _maybe_write_metrics()
+
+
+def set_gauge(name: str, value: float, help_text: str = ""):
+    """Extra process-wide value exported next to the stage timings (e.g. cache hits)."""
+    with _lock:
+        _gauges[name] = (value, help_text)
+
+
+def totals() -> dict:
+    """Process-wide totals: stage -> {"count", "seconds", "rows", "max_seconds"}."""
+    with _lock:
+        return {
+            name: dict(zip(("count", "seconds", "rows", "max_seconds"), values))
+            for name, values in _totals.items()
+        }
+
+
+def render_prometheus() -> str:
+    with _lock:
+        totals = {name: list(values) for name, values in _totals.items()}
+        gauges = dict(_gauges)
+
+    lines = [
+        "# HELP users_bi_stage_seconds Time spent in a dashboard stage.",
+        "# TYPE users_bi_stage_seconds summary",
+    ]
+    for name, (count, seconds, _, _) in sorted(totals.items()):
+        lines.append(f'users_bi_stage_seconds_count{{stage="{name}"}} {count}')
+        lines.append(f'users_bi_stage_seconds_sum{{stage="{name}"}} {seconds:.6f}')
+    lines += [
+        "# HELP users_bi_stage_max_seconds Slowest run of a dashboard stage.",
+        "# TYPE users_bi_stage_max_seconds gauge",
+    ]
+    lines += [f'users_bi_stage_max_seconds{{stage="{name}"}} {values[3]:.6f}' for name, values in sorted(totals.items())]
+    lines += [
+        "# HELP users_bi_stage_rows_total Rows processed by a dashboard stage.",
+        "# TYPE users_bi_stage_rows_total counter",
+    ]
+    lines += [f'users_bi_stage_rows_total{{stage="{name}"}} {values[2]}' for name, values in sorted(totals.items())]
+    for name, (value, help_text) in sorted(gauges.items()):
+        lines += [f"# HELP users_bi_{name} {help_text}", f"# TYPE users_bi_{name} gauge", f"users_bi_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def _maybe_write_metrics():
+    global _last_write
+    if not METRICS_FILE:
+        return
+    now = time.time()
+    with _lock:
+        if now - _last_write < METRICS_INTERVAL:
+            return
+        _last_write = now
+    write_metrics(METRICS_FILE)
+
+
+def write_metrics(path: str):
+    # Коллектор может прочитать файл в любой момент - подменяем атомарно
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
@@ -0,0 +1,66 @@
+"""
+Render-prep for the Performance charts.
+
+Reduces per-company series to a bounded number of points on the server
+before they are handed to Plotly, so the figure payload does not grow with
+the number of companies that pass the filter.
+"""
+import numpy as np
+import pandas as pd
+
+HISTOGRAM_BINS = 30
+MAX_VIOLIN_POINTS = 500
+MAX_TREEMAP_TILES = 50
+
+
+def histogram_bins(values: pd.Series, nbins: int = HISTOGRAM_BINS) -> pd.DataFrame:
+    """Counts per bin computed with NumPy: bin_start, bin_end, bin_mid, count."""
+    counts, edges = np.histogram(values.to_numpy(dtype=float), bins=nbins)
+    return pd.DataFrame({
+        "bin_start": edges[:-1],
+        "bin_end": edges[1:],
+        "bin_mid": (edges[:-1] + edges[1:]) / 2,
+        "count": counts,
+    })
+
+
+def sample_by_rank(df: pd.DataFrame, value_col: str, max_points: int = MAX_VIOLIN_POINTS) -> pd.DataFrame:
+    """
+    At most `max_points` rows at evenly spaced ranks of `value_col`.
+    Unlike a random sample it always keeps the minimum and the maximum and
+    follows the shape of the distribution, which is what the violin shows.
+    """
+    if len(df) <= max_points:
+        return df
+    order = np.argsort(df[value_col].to_numpy(), kind="stable")
+    positions = np.unique(np.linspace(0, len(df) - 1, max_points).round().astype(int))
+    return df.iloc[order[positions]]
+
+
+def fold_tail(df: pd.DataFrame, value_col: str, label_col: str = "company",
+              max_items: int = MAX_TREEMAP_TILES, other_label: str = "Other") -> pd.DataFrame:
+    """
+    Keeps the `max_items` - 1 largest rows and sums the rest into a single
+    "Other (N companies)" row.
+    """
+    if len(df) <= max_items:
+        return df[[label_col, value_col]]
+    df_sorted = df.sort_values(by=value_col, ascending=False)
+    df_head = df_sorted.head(max_items - 1)[[label_col, value_col]]
+    df_tail = df_sorted.iloc[max_items - 1:]
+    df_other = pd.DataFrame({
+        label_col: [f"{other_label} ({len(df_tail)} companies)"],
+        value_col: [df_tail[value_col].sum()],
+    })
+    return pd.concat([df_head.astype({label_col: str}), df_other], ignore_index=True)
+
+
+def drop_unused_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Categorical columns carry their whole dictionary into the Arrow payload
+    sent to the browser, even for a handful of rows. Drop unused categories.
+    """
+    df = df.copy()
+    for col in df.select_dtypes(include="category").columns:
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
@@ -0,0 +1,194 @@
+"""
+Process-wide cache of query results shared by all sessions.
+
+Results are keyed by a canonical filter signature: the data snapshot, the
+sorted sidebar selection and the options that define the result (sub_codes,
+window, gap policy, ...). Entries are evicted least-recently-used once the
+total size goes over a memory budget, and dropped as a whole when the
+snapshot changes.
+
+CachedBackend wraps a backend from backends.py with the same methods, so the
+app does not have to know about the cache.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import backends
+
+# Бюджет памяти под результаты, МБ
+DEFAULT_BUDGET_MB = int(os.environ.get("USERS_BI_RESULT_CACHE_MB", 256))
+
+
+def filter_signature(snapshot_key, countries, sizes, **options) -> tuple:
+    """Key that does not depend on the order of the selection or of the options."""
+    return (
+        snapshot_key,
+        tuple(sorted(str(c) for c in countries)),
+        tuple(sorted(str(s) for s in sizes)),
+        tuple(sorted((name, _freeze(value)) for name, value in options.items())),
+    )
+
+
+def _freeze(value):
+    # Списки опций (sub_codes, scopes) - множества: порядок на результат не влияет
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted((_freeze(v) for v in value), key=repr))
+    return value
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+def _share(value):
+    # Вызывающий код добавляет колонки в результат (df['compare'] = ...):
+    # отдаем поверхностные копии, чтобы это не меняло объект в кэше
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        return tuple(_share(v) for v in value)
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+class ResultCache:
+    def __init__(self, budget_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.snapshot_key = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def set_snapshot(self, snapshot_key):
+        """Drops every result when the data snapshot changes."""
+        with self._lock:
+            if snapshot_key != self.snapshot_key:
+                self._entries.clear()
+                self._nbytes = 0
+                self.snapshot_key = snapshot_key
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _share(self._entries[key][0])
+            self.misses += 1
+
+        # Считаем без блокировки: разные ключи считаются параллельно, а один и тот же
+        # ключ в худшем случае посчитается дважды
+        value = compute()
+        nbytes = _nbytes(value)
+
+        with self._lock:
+            if key[0] != self.snapshot_key or nbytes > self.budget_bytes:
+                # Результат для старого снапшота или больше всего бюджета - не храним
+                return _share(value)
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.budget_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_bytes
+                self.evictions += 1
+        return _share(value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": self._nbytes / 1024 / 1024,
+                "budget_mb": self.budget_bytes / 1024 / 1024,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class CachedBackend:
+    """A backend whose results are looked up in `cache` first."""
+
+    def __init__(self, backend, cache: ResultCache, snapshot_key, scope=()):
+        self.backend = backend
+        self.cache = cache
+        self.snapshot_key = snapshot_key
+        # Часть данных, которую видит backend (отрасли); входит в ключ, снимок при смене не сбрасывается
+        self.scope = tuple(scope)
+        cache.set_snapshot(snapshot_key)
+
+    def cached(self, name: str, countries, sizes, compute, **options):
+        """Result of `compute()` cached under (name, selection, options)."""
+        key = filter_signature(self.snapshot_key, countries, sizes, query=name, scope=self.scope, **options)
+        return self.cache.get_or_compute(key, compute)
+
+    def filtered(self, name: str, countries, sizes) -> pd.DataFrame:
+        return self.cached("filtered", countries, sizes,
+                           lambda: self.backend.filtered(name, countries, sizes), table=name)
+
+    def kpi_counts(self, countries, sizes) -> dict:
+        return self.cached("kpi_counts", countries, sizes, lambda: self.backend.kpi_counts(countries, sizes))
+
+    def reports_list(self, countries, sizes) -> pd.DataFrame:
+        return self.cached("reports_list", countries, sizes, lambda: self.backend.reports_list(countries, sizes))
+
+    def reports_page(self, countries, sizes, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = backends.PAGE_SIZE):
+        return self.cached("reports_page", countries, sizes,
+                           lambda: self.backend.reports_page(countries, sizes, search, sort_by, ascending, offset, limit),
+                           search=search, sort_by=sort_by, ascending=ascending, offset=offset, limit=limit)
+
+    def leaders_page(self, countries, sizes, tiers, search: str = "", sort_by: str = None, ascending: bool = True,
+                     offset: int = 0, limit: int = backends.PAGE_SIZE):
+        return self.cached("leaders_page", countries, sizes,
+                           lambda: self.backend.leaders_page(countries, sizes, tiers, search, sort_by, ascending,
+                                                             offset, limit),
+                           tiers=tiers, search=search, sort_by=sort_by, ascending=ascending, offset=offset, limit=limit)
+
+    def geo_counts(self, countries, sizes) -> pd.DataFrame:
+        return self.cached("geo_counts", countries, sizes, lambda: self.backend.geo_counts(countries, sizes))
+
+    def category_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return self.cached("category_shares", countries, sizes,
+                           lambda: self.backend.category_shares(countries, sizes, company_count),
+                           company_count=company_count)
+
+    def topic_shares(self, countries, sizes, company_count: int) -> pd.DataFrame:
+        return self.cached("topic_shares", countries, sizes,
+                           lambda: self.backend.topic_shares(countries, sizes, company_count),
+                           company_count=company_count)
+
+    def company_year_sums(self, countries, sizes, sub_codes: list) -> pd.DataFrame:
+        return self.cached("company_year_sums", countries, sizes,
+                           lambda: self.backend.company_year_sums(countries, sizes, sub_codes),
+                           sub_codes=sub_codes)
+
+    def latest_years_average(self, countries, sizes, sub_codes: list, n_years: int = 3) -> pd.DataFrame:
+        return self.cached("latest_years_average", countries, sizes,
+                           lambda: self.backend.latest_years_average(countries, sizes, sub_codes, n_years=n_years),
+                           sub_codes=sub_codes, n_years=n_years)
+
+    def yoy_trend(self, countries, sizes, sub_codes: list, gap_policy: str = "consecutive"):
+        return self.cached("yoy_trend", countries, sizes,
+                           lambda: self.backend.yoy_trend(countries, sizes, sub_codes, gap_policy=gap_policy),
+                           sub_codes=sub_codes, gap_policy=gap_policy)
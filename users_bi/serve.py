@@ -0,0 +1,128 @@
+"""
+Starts the dashboard with warm caches.
+
+    python serve.py [--no-warmup] [--check] [-- streamlit run options]
+    python serve.py -- --server.port 8501 --server.headless true
+
+Before the server accepts connections the app script is run headless in
+this process (streamlit.testing AppTest) with the default sidebar - all
+countries, all sizes - once per tab. st.cache_data, st.cache_resource and
+the result cache are process-wide, so the first visitor gets the loaded
+snapshot and the default views from memory. The server is started with
+static serving on, for the bundled map geometry (geo_assets.py).
+
+A cold-start report is printed first: the import time of the app's
+libraries and the first paint (KPIs on screen) of the cold and of a warm
+run, checked against perf.FIRST_PAINT_BUDGET (USERS_BI_FIRST_PAINT_BUDGET).
+"""
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import perf
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "industry_overview.py")
+# Библиотеки приложения в порядке импорта; plotly.express и altair приложение импортирует во вкладках
+IMPORTS = ("streamlit", "pandas", "numpy", "requests", "plotly.express", "altair")
+# Вкладки (и подвкладки Performance), которые считаются до старта сервера
+WARMUP_VIEWS = (
+    ("Geography", None),
+    ("Common Disclosures", None),
+    ("Industry Leaders", None),
+    ("Performance", "GHG Emissions"),
+    ("Performance", "Energy Consumption"),
+    ("Performance", "Waste"),
+    ("Performance", "Water"),
+    ("Trends", None),
+)
+WARMUP_TIMEOUT = 600
+
+
+def import_times(modules=IMPORTS) -> list:
+    """(module, seconds) of importing `modules` in order; only a first import in the process costs anything."""
+    times = []
+    for name in modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        times.append((name, time.perf_counter() - start))
+    return times
+
+
+def _stage_seconds(before: dict, after: dict, stage: str) -> float:
+    return after.get(stage, {}).get("seconds", 0.0) - before.get(stage, {}).get("seconds", 0.0)
+
+
+def warm_up(app_path: str = APP_PATH, views=WARMUP_VIEWS, timeout: int = WARMUP_TIMEOUT) -> list:
+    """
+    Runs the app once per view with the default sidebar, then the default
+    view once more (what the first visitor gets). Returns one dict per run
+    with its wall time and first paint.
+    """
+    from streamlit import config
+    from streamlit.testing.v1 import AppTest
+
+    # Как у сервера ниже: без static/ карта не строится (geo_assets.plotly_config)
+    config.set_option("server.enableStaticServing", True)
+    app = AppTest.from_file(app_path, default_timeout=timeout)
+    runs = []
+    for tab, subtab in [*views, views[0]]:
+        # Виджеты вкладок AppTest не запоминает - выбираем вкладку перед каждым запуском
+        app.session_state["main_tab"] = tab
+        if subtab:
+            app.session_state["performance_subtab"] = subtab
+        before = perf.totals()
+        start = time.perf_counter()
+        app.run()
+        if app.exception:
+            raise RuntimeError(f"Warm-up of '{tab}' failed: {app.exception[0].value}")
+        after = perf.totals()
+        runs.append({
+            "view": f"{tab} / {subtab}" if subtab else tab,
+            "seconds": time.perf_counter() - start,
+            "first_paint": _stage_seconds(before, after, "first_paint"),
+        })
+    return runs
+
+
+def report(imports: list, runs: list) -> bool:
+    """Prints the cold-start report, returns False if the warm first paint is over budget."""
+    print("Import time (first import in the process):")
+    for name, seconds in imports:
+        print(f"  {name:<16} {seconds * 1000:8.1f} ms")
+    print(f"  {'total':<16} {sum(seconds for _, seconds in imports) * 1000:8.1f} ms")
+
+    print("Warm-up runs (default sidebar):")
+    for run in runs:
+        print(f"  {run['view']:<36} run {run['seconds']:6.2f} s   first paint {run['first_paint']:6.2f} s")
+
+    cold, warm = runs[0]["first_paint"], runs[-1]["first_paint"]
+    within_budget = warm <= perf.FIRST_PAINT_BUDGET
+    print(f"First paint: cold {cold:.2f} s, warm {warm:.2f} s, budget {perf.FIRST_PAINT_BUDGET:.2f} s"
+          f"{'' if within_budget else ' - OVER BUDGET'}")
+    return within_budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up the dashboard caches, then start the Streamlit server.")
+    parser.add_argument("--no-warmup", action="store_true", help="Start the server right away")
+    parser.add_argument("--check", action="store_true",
+                        help="Only print the report; exit with an error if first paint is over budget")
+    parser.add_argument("streamlit_args", nargs="*", help="Options for 'streamlit run' (after --)")
+    args = parser.parse_args()
+
+    if not args.no_warmup:
+        within_budget = report(import_times(), warm_up())
+        if args.check:
+            raise SystemExit(0 if within_budget else 1)
+
+    from streamlit.web import cli as stcli
+
+    # static/ раздается для геометрии карты (geo_assets.py); аргументы после -- могут это переопределить
+    sys.argv = ["streamlit", "run", APP_PATH, "--server.enableStaticServing", "true", *args.streamlit_args]
+    sys.exit(stcli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Snapshot shared by all Streamlit server processes on one machine.
+
+The source tables and everything derived from them once per snapshot
+(company dimension, topics/leaders with company keys, metric cube, country
+x size company counts) are published as uncompressed Arrow IPC (Feather
+v2) files:
+
+    <USERS_BI_SHARED_DIR>/manifest.json          current version
+    <USERS_BI_SHARED_DIR>/<version>/<table>.arrow
+
+Every worker memory-maps the files read-only and wraps them in DataFrames
+without copying (one record batch per file, so numeric columns and
+category codes are views into the mapping). The pages live in the OS page
+cache once, whatever the number of workers; only per-session results and
+small per-process indexes are private.
+
+A new version is written next to the current one and manifest.json is
+replaced atomically; workers pick it up on their next script run. The
+previous version is kept, so runs still reading it are not affected.
+
+Usage:
+    python shared_store.py                 publish the sources (USERS_BI_DATA_URL / cache)
+    python shared_store.py --status        print the current version
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow.feather as feather
+
+import analytics
+import data_cache
+import ingest
+import perf
+
+SHARED_DIR = os.environ.get("USERS_BI_SHARED_DIR")
+SOURCE_FILES = {
+    "metrics": "comparable_metrics.csv",
+    "topics": "material_topics.csv",
+    "leaders": "industry_leaders.csv",
+}
+MANIFEST = "manifest.json"
+# Сколько версий держать на диске: текущая + предыдущая (ее могут дочитывать запуски скрипта)
+KEEP_VERSIONS = 2
+
+
+def derived_tables(df_metrics: pd.DataFrame, df_topics: pd.DataFrame, df_leaders: pd.DataFrame) -> dict:
+    """All tables of a snapshot: the sources plus what the app derives from them once per snapshot."""
+    # Строки только как category: Arrow-словарь читается без копии, а строковая колонка - это копия в object
+    df_metrics, df_topics, df_leaders = (ingest.optimize_dtypes(df) for df in (df_metrics, df_topics, df_leaders))
+    df_company_dim = ingest.build_company_dim(df_metrics, df_topics, df_leaders)
+    return {
+        "metrics": df_metrics,
+        "topics": df_topics,
+        "leaders": df_leaders,
+        "company_dim": df_company_dim,
+        "topics_merged": ingest.attach_company_keys(df_topics, df_company_dim),
+        "leaders_merged": ingest.attach_company_keys(df_leaders, df_company_dim),
+        "cube": analytics.build_metric_cube(df_metrics),
+        "geo_cells": analytics.build_geo_cells(df_metrics),
+    }
+
+
+def read_manifest(root: str = SHARED_DIR) -> dict:
+    """Current manifest, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def publish(tables: dict, root: str = SHARED_DIR, sources: dict = None) -> dict:
+    """Writes `tables` as a new version and switches the manifest to it."""
+    # mkdtemp дает уникальное имя, даже если две публикации пришлись на одну секунду
+    version_dir = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d-%H%M%S-"), dir=root)
+    version = os.path.basename(version_dir)
+    with perf.stage("shared_publish") as timing:
+        for name, df in tables.items():
+            # Один record batch на файл: при чтении колонки не склеиваются из кусков (без копии)
+            feather.write_feather(
+                df.reset_index(drop=True), os.path.join(version_dir, f"{name}.arrow"),
+                compression="uncompressed", chunksize=max(len(df), 1),
+            )
+        timing["rows"] = sum(len(df) for df in tables.values())
+
+    manifest = {"version": version, "tables": sorted(tables), "sources": sources or {}}
+    tmp_path = os.path.join(root, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(root, MANIFEST))
+    _remove_old_versions(root, version)
+    return manifest
+
+
+def _remove_old_versions(root: str, current: str):
+    versions = sorted(
+        name for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name)) and name[:1].isdigit()
+    )
+    older = [name for name in versions if name != current]
+    # Файлы, уже отображенные в память другими процессами, остаются доступны им и после удаления
+    for name in older[:len(older) - (KEEP_VERSIONS - 1)]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def publish_sources(root: str = SHARED_DIR, force: bool = False) -> dict:
+    """
+    Loads the sources through data_cache and publishes them. Workers that
+    start together call this at once: the first one publishes under a file
+    lock, the others wait and reuse its version (unless `force`).
+    """
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".publish.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest(root)
+        if manifest and not force:
+            return manifest
+        urls = [data_cache.source_url(name) for name in SOURCE_FILES.values()]
+        frames = data_cache.fetch_all(urls)
+        sources = {url: data_cache.snapshot_version(url) for url in urls}
+        return publish(derived_tables(*frames), root, sources=sources)
+
+
+class SharedSnapshot:
+    """Read-only DataFrames over the memory-mapped files of one version."""
+
+    def __init__(self, root: str = SHARED_DIR, manifest: dict = None):
+        manifest = manifest or read_manifest(root)
+        self.version = manifest["version"]
+        self.path = os.path.join(root, self.version)
+        self.tables = {}
+        with perf.stage("shared_map") as timing:
+            for name in manifest["tables"]:
+                table = feather.read_table(os.path.join(self.path, f"{name}.arrow"), memory_map=True)
+                # split_blocks: каждая колонка - отдельный блок, pandas не склеивает их в копию
+                self.tables[name] = table.to_pandas(split_blocks=True)
+            timing["rows"] = sum(len(df) for df in self.tables.values())
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        return self.tables[name]
+
+
+def memory_usage() -> dict:
+    """Resident (rss) and proportional (pss) memory of this process in MB; empty where /proc is missing."""
+    try:
+        with open("/proc/self/smaps_rollup", encoding="utf-8") as f:
+            # Первая строка - диапазон адресов, дальше "Rss:   1234 kB"
+            fields = dict(line.split(":", 1) for line in f.readlines()[1:])
+    except OSError:
+        return {}
+    # Разделяемые страницы в Pss поделены между процессами - сумма Pss воркеров = реальная память
+    return {
+        name.lower(): int(fields[name].split()[0]) / 1024
+        for name in ("Rss", "Pss", "Shared_Clean", "Private_Dirty")
+        if name in fields
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the dashboard snapshot for all server processes.")
+    parser.add_argument("--root", default=SHARED_DIR or "shared", help="Shared snapshot directory")
+    parser.add_argument("--status", action="store_true", help="Only print the current version")
+    args = parser.parse_args()
+
+    if args.status:
+        manifest = read_manifest(args.root)
+        print(f"version {manifest['version']}" if manifest else "nothing published")
+        return
+    manifest = publish_sources(args.root, force=True)
+    print(f"version {manifest['version']} -> {args.root}")
+
+
+if __name__ == "__main__":
+    main()
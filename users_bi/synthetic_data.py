@@ -0,0 +1,252 @@
+"""
+Seeded generator of synthetic source tables for local runs and benchmarks.
+
+Writes comparable_metrics, material_topics and industry_leaders with the
+same schemas as the real files. Values are heavy-tailed (a few very large
+companies, many small ones), companies report over a span of years with
+occasional gaps, and every report (bundle_id) has a subset of the GRI
+sub_codes used by the dashboard.
+
+Tables are generated company batch by company batch and written chunk by
+chunk, so tens of millions of rows never sit in memory at once.
+
+Usage:
+    python synthetic_data.py --rows 1M --out data
+    python synthetic_data.py --rows 20M --format parquet --out snapshots --seed 7
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+METRIC_COLUMNS = [
+    "company", "company_id", "company_size", "country", "country_iso3",
+    "industry", "bundle_id", "year", "sub_code", "value",
+]
+TOPIC_COLUMNS = ["topic_name", "category_name", "bundle_id", "year", "company", "industry", "country"]
+LEADER_COLUMNS = ["bundle_id", "company", "year", "tier", "country"]
+
+# sub_code -> (доля отчетов с этим кодом, масштаб значения)
+SUB_CODES = {
+    "305-1-a": (0.85, 1.0),
+    "305-2-a": (0.85, 0.8),
+    "305-3-a": (0.45, 6.0),
+    "302-1-a": (0.50, 10.0),
+    "302-1-b": (0.30, 4.0),
+    "302-1-c": (0.55, 8.0),
+    "302-1-e": (0.70, 20.0),
+    "306-3-a": (0.65, 0.3),
+    "306-4-a": (0.45, 0.15),
+    "306-5-a": (0.25, 0.05),
+    "306-5-c": (0.35, 0.08),
+    "303-5-a": (0.60, 2.0),
+    "303-5-b": (0.20, 0.4),
+}
+
+# (страна, ISO3, вес) - примерно как в material_topics.csv
+COUNTRIES = [
+    ("United States", "USA", 20), ("Japan", "JPN", 12), ("United Kingdom", "GBR", 7),
+    ("Singapore", "SGP", 6), ("South Africa", "ZAF", 5), ("Switzerland", "CHE", 5),
+    ("Sweden", "SWE", 4), ("Taiwan", "TWN", 4), ("Canada", "CAN", 4), ("France", "FRA", 4),
+    ("Germany", "DEU", 3), ("India", "IND", 3), ("China", "CHN", 3), ("Brazil", "BRA", 2),
+    ("Mexico", "MEX", 2), ("Netherlands", "NLD", 2), ("Spain", "ESP", 2), ("Italy", "ITA", 2),
+    ("Australia", "AUS", 2), ("Korea, Rep.", "KOR", 2), ("Thailand", "THA", 1),
+    ("Malaysia", "MYS", 1), ("Indonesia", "IDN", 1), ("Philippines", "PHL", 1),
+    ("Poland", "POL", 1), ("Norway", "NOR", 1), ("Finland", "FIN", 1), ("Ireland", "IRL", 1),
+    ("Chile", "CHL", 1), ("Russian Federation", "RUS", 1),
+]
+COMPANY_SIZES = [("Large", 0.3, 50.0), ("Medium", 0.4, 5.0), ("Small", 0.3, 0.5)]
+INDUSTRIES = ["Processed Foods"]
+CATEGORIES = [
+    "Climate change and GHG emissions", "Energy", "Water management", "Waste management",
+    "Product quality and safety", "Occupational health and safety", "Anti-corruption",
+    "Supply chain and procurement practices", "Diversity, equal opportunity and non-discrimination",
+    "Training, education and development", "Customer health and safety", "Animal welfare & testing",
+    "Biodiversity", "Local communities and rights of indigenous peoples", "Economic performance",
+    "Responsible marketing and labeling", "Material use and circular economy", "Corporate governance",
+    "Human rights, child labor, forced or compulsory labor", "Innovation and R&D",
+]
+TOPICS_PER_CATEGORY = 40
+FIRST_YEAR, LAST_YEAR = 2016, 2025
+# Примерное число строк метрик на одну компанию, чтобы получить --rows
+ROWS_PER_COMPANY = 40
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+def make_companies(n_companies: int, rng: np.random.Generator, first_id: int = 1) -> pd.DataFrame:
+    """Company attributes plus the hidden 'scale' that drives its metric values."""
+    country_weights = np.array([w for _, _, w in COUNTRIES], dtype=float)
+    country_idx = rng.choice(len(COUNTRIES), n_companies, p=country_weights / country_weights.sum())
+    size_idx = rng.choice(len(COMPANY_SIZES), n_companies, p=[p for _, p, _ in COMPANY_SIZES])
+    size_scale = np.array([s for _, _, s in COMPANY_SIZES])[size_idx]
+
+    company_ids = np.arange(first_id, first_id + n_companies)
+    n_years = rng.integers(1, LAST_YEAR - FIRST_YEAR + 2, n_companies)
+    first_year = LAST_YEAR + 1 - n_years - rng.integers(0, 2, n_companies)
+    return pd.DataFrame({
+        "company_id": company_ids,
+        "company": [f"Synthetic Company {i}" for i in company_ids],
+        "company_size": np.array([s for s, _, _ in COMPANY_SIZES])[size_idx],
+        "country": np.array([c for c, _, _ in COUNTRIES])[country_idx],
+        "country_iso3": np.array([iso for _, iso, _ in COUNTRIES])[country_idx],
+        "industry": rng.choice(INDUSTRIES, n_companies),
+        "first_year": np.maximum(first_year, FIRST_YEAR),
+        "n_years": n_years,
+        # Тяжелый хвост: немного очень крупных компаний
+        "scale": size_scale * rng.lognormal(mean=8.0, sigma=1.5, size=n_companies),
+        "trend": rng.normal(-0.02, 0.08, n_companies),
+    })
+
+
+def make_reports(df_companies: pd.DataFrame, rng: np.random.Generator, first_bundle_id: int) -> pd.DataFrame:
+    """One row per (company, year) report with its bundle_id; ~10% of years are skipped."""
+    company_pos = np.repeat(np.arange(len(df_companies)), df_companies["n_years"].to_numpy())
+    year_offset = np.arange(len(company_pos)) - np.repeat(
+        np.cumsum(df_companies["n_years"].to_numpy()) - df_companies["n_years"].to_numpy(),
+        df_companies["n_years"].to_numpy(),
+    )
+    df_reports = df_companies.iloc[company_pos].reset_index(drop=True)
+    df_reports["year"] = df_reports["first_year"].to_numpy() + year_offset
+    df_reports["year_offset"] = year_offset
+    df_reports = df_reports[(df_reports["year"] <= LAST_YEAR) & (rng.random(len(df_reports)) > 0.1)]
+    df_reports = df_reports.reset_index(drop=True)
+    df_reports["bundle_id"] = np.arange(first_bundle_id, first_bundle_id + len(df_reports))
+    return df_reports
+
+
+def make_metrics(df_reports: pd.DataFrame, rng: np.random.Generator) -> pd.DataFrame:
+    codes = np.array(list(SUB_CODES))
+    code_prob = np.array([p for p, _ in SUB_CODES.values()])
+    code_scale = np.array([s for _, s in SUB_CODES.values()])
+
+    report_pos = np.repeat(np.arange(len(df_reports)), len(codes))
+    code_pos = np.tile(np.arange(len(codes)), len(df_reports))
+    keep = rng.random(len(report_pos)) < code_prob[code_pos]
+    report_pos, code_pos = report_pos[keep], code_pos[keep]
+
+    df = df_reports.iloc[report_pos].reset_index(drop=True)
+    growth = (1 + df["trend"].to_numpy()) ** df["year_offset"].to_numpy()
+    value = df["scale"].to_numpy() * code_scale[code_pos] * growth * rng.lognormal(0, 0.35, len(df))
+    # Немного нулевых значений, как в реальных отчетах
+    value[rng.random(len(df)) < 0.02] = 0.0
+    df["sub_code"] = codes[code_pos]
+    df["value"] = np.round(value, 2)
+    return df[METRIC_COLUMNS]
+
+
+def make_topics(df_reports: pd.DataFrame, rng: np.random.Generator, topics_per_report: float = 5) -> pd.DataFrame:
+    n_topics = rng.poisson(topics_per_report, len(df_reports))
+    report_pos = np.repeat(np.arange(len(df_reports)), n_topics)
+    # Популярность категорий и топиков внутри категории убывает (Zipf)
+    category_pos = np.minimum(rng.zipf(1.3, len(report_pos)) - 1, len(CATEGORIES) - 1)
+    topic_pos = np.minimum(rng.zipf(1.5, len(report_pos)) - 1, TOPICS_PER_CATEGORY - 1)
+
+    df = df_reports.iloc[report_pos].reset_index(drop=True)
+    df["category_name"] = np.array(CATEGORIES)[category_pos]
+    topic_names = np.array([f"{category} topic {t + 1}" for category in CATEGORIES for t in range(TOPICS_PER_CATEGORY)])
+    df["topic_name"] = topic_names[category_pos * TOPICS_PER_CATEGORY + topic_pos]
+    return df.drop_duplicates(subset=["bundle_id", "topic_name"])[TOPIC_COLUMNS]
+
+
+def make_leaders(df_reports: pd.DataFrame, rng: np.random.Generator, leader_share: float = 0.15) -> pd.DataFrame:
+    company_ids = df_reports["company_id"].unique()
+    leader_ids = company_ids[rng.random(len(company_ids)) < leader_share]
+    is_tier_a = pd.Series(rng.random(len(leader_ids)) < 0.2, index=leader_ids)
+
+    df = df_reports[df_reports["company_id"].isin(leader_ids)].copy()
+    df["tier"] = np.where(is_tier_a.reindex(df["company_id"]).to_numpy(), "A", "B")
+    return df[LEADER_COLUMNS]
+
+
+def iter_tables(n_rows: int, seed: int = 0, chunk_rows: int = 1_000_000):
+    """
+    Yields (metrics, topics, leaders) chunks until `n_rows` metric rows have
+    been produced. Every chunk is a fresh batch of companies with about
+    `chunk_rows` metric rows, which bounds the memory used.
+    """
+    rng = np.random.default_rng(seed)
+    companies_per_chunk = max(1, chunk_rows // ROWS_PER_COMPANY)
+    rows_left = n_rows
+    next_company_id, next_bundle_id = 1, 1
+
+    while rows_left > 0:
+        df_companies = make_companies(companies_per_chunk, rng, first_id=next_company_id)
+        df_reports = make_reports(df_companies, rng, first_bundle_id=next_bundle_id)
+        next_company_id += companies_per_chunk
+        next_bundle_id += len(df_reports)
+
+        df_metrics = make_metrics(df_reports, rng).head(rows_left)
+        rows_left -= len(df_metrics)
+        # Темы и лидеры только для отчетов, попавших в метрики
+        df_reports = df_reports[df_reports["bundle_id"].isin(df_metrics["bundle_id"])]
+        yield df_metrics, make_topics(df_reports, rng), make_leaders(df_reports, rng)
+
+
+class _ChunkWriter:
+    """Appends DataFrame chunks to one CSV or Parquet file."""
+
+    def __init__(self, path: str, file_format: str):
+        self.path = path
+        self.file_format = file_format
+        self._parquet_writer = None
+        self._has_header = False
+
+    def write(self, df: pd.DataFrame):
+        if self.file_format == "csv":
+            df.to_csv(self.path, mode="a" if self._has_header else "w", header=not self._has_header, index=False)
+            self._has_header = True
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def write_tables(out_dir: str, n_rows: int, seed: int = 0, chunk_rows: int = 1_000_000,
+                 file_format: str = "csv") -> dict:
+    """Streams the three tables into `out_dir`, returns row counts per table."""
+    os.makedirs(out_dir, exist_ok=True)
+    names = ["comparable_metrics", "material_topics", "industry_leaders"]
+    writers = [_ChunkWriter(os.path.join(out_dir, f"{name}.{file_format}"), file_format) for name in names]
+    counts = dict.fromkeys(names, 0)
+    try:
+        for chunks in iter_tables(n_rows, seed=seed, chunk_rows=chunk_rows):
+            for name, writer, df in zip(names, writers, chunks):
+                writer.write(df)
+                counts[name] += len(df)
+    finally:
+        for writer in writers:
+            writer.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic dashboard source tables.")
+    parser.add_argument("--rows", default="100k", help="Number of metric rows, e.g. 10k, 1M, 20M")
+    parser.add_argument("--out", default="synthetic", help="Output directory")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-rows", default="1M", help="Metric rows generated and written per chunk")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    args = parser.parse_args()
+
+    counts = write_tables(args.out, parse_size(args.rows), seed=args.seed,
+                          chunk_rows=parse_size(args.chunk_rows), file_format=args.format)
+    for name, count in counts.items():
+        print(f"{name}: {count:,} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import http.server
+import os
+import sys
+import threading
+
+import pandas as pd
+import pytest
+
+# Модули приложения лежат плоско в users_bi/ и импортируют друг друга по имени
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+import synthetic_data  # noqa: E402
+
+SOURCE_FILES = ("comparable_metrics.csv", "material_topics.csv", "industry_leaders.csv")
+
+
+@pytest.fixture(scope="session")
+def source_dir(tmp_path_factory) -> str:
+    """Synthetic source CSVs: several batches of companies, ~20k metric rows."""
+    out_dir = str(tmp_path_factory.mktemp("sources"))
+    synthetic_data.write_tables(out_dir, 20_000, seed=1, chunk_rows=5_000)
+    return out_dir
+
+
+@pytest.fixture(scope="session")
+def sources(source_dir) -> tuple:
+    """(metrics, topics, leaders) parsed the way data_cache parses a download."""
+    return tuple(
+        ingest.optimize_dtypes(pd.read_csv(os.path.join(source_dir, name), dtype=ingest.CSV_DTYPES))
+        for name in SOURCE_FILES
+    )
+
+
+@pytest.fixture(scope="session")
+def snapshot_paths(source_dir, tmp_path_factory) -> tuple:
+    """Parquet snapshots of the sources (ingest.py)."""
+    out_dir = str(tmp_path_factory.mktemp("snapshots"))
+    return tuple(ingest.csv_to_snapshot(os.path.join(source_dir, name), out_dir) for name in SOURCE_FILES)
+
+
+class SourceServer:
+    """
+    Local stand-in for the data host: serves `files` with ETag/304, gzip,
+    Range requests and injected failures, and records every request.
+    """
+
+    def __init__(self):
+        self.files = {}  # name -> bytes
+        self.failures = {}  # name -> статусы, которыми ответить на ближайшие запросы
+        self.range_support = True
+        self.requests = []  # (name, headers)
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/{name}"
+
+    def requests_for(self, name: str) -> list:
+        return [headers for request_name, headers in self.requests if request_name == name]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                name = self.path.lstrip("/")
+                server.requests.append((name, dict(self.headers)))
+                if server.failures.get(name):
+                    return self._reply(server.failures[name].pop(0))
+                if name not in server.files:
+                    return self._reply(404)
+
+                body = server.files[name]
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    return self._reply(304, headers={"ETag": etag})
+
+                byte_range = self.headers.get("Range")
+                if byte_range and server.range_support:
+                    start = int(byte_range.removeprefix("bytes=").rstrip("-"))
+                    if start >= len(body):
+                        return self._reply(416, headers={"Content-Range": f"bytes */{len(body)}"})
+                    return self._reply(206, body[start:], {
+                        "ETag": etag, "Content-Range": f"bytes {start}-{len(body) - 1}/{len(body)}",
+                    })
+
+                headers = {"ETag": etag}
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    headers["Content-Encoding"] = "gzip"
+                return self._reply(200, body, headers)
+
+            def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+@pytest.fixture
+def source_server():
+    server = SourceServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch) -> str:
+    """Empty data_cache directory; prebuilt snapshots are off."""
+    import data_cache
+
+    monkeypatch.setattr(data_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(data_cache, "SNAPSHOT_DIR", None)
+    return str(tmp_path)
@@ -0,0 +1,107 @@
+import pandas as pd
+import pytest
+
+import analytics
+
+
+def _company_years(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["company", "year", "value"])
+
+
+def _changes(df: pd.DataFrame) -> dict:
+    return {(row.company, row.year): round(row.yoy_change_pct, 6) for row in df.itertuples()}
+
+
+def test_latest_years_average_takes_the_newest_years():
+    df = _company_years([
+        ("A", 2019, 100.0), ("A", 2020, 10.0), ("A", 2021, 20.0), ("A", 2022, 30.0),
+        ("B", 2022, 50.0),
+        ("C", 2018, 1.0), ("C", 2021, 5.0),
+    ])
+
+    df_avg = analytics.latest_years_average(df, n_years=3)
+
+    assert list(df_avg["company"]) == ["B", "A", "C"]
+    by_company = df_avg.set_index("company")
+    assert by_company.loc["A", "average_value"] == 20.0
+    assert by_company.loc["A", "years"] == [2022, 2021, 2020]
+    assert list(by_company["years_of_data"]) == [1, 3, 2]
+    assert by_company.loc["C", "average_value"] == 3.0
+
+
+def test_latest_years_average_keeps_ties_in_company_order():
+    df = _company_years([("B", 2020, 5.0), ("A", 2020, 5.0), ("C", 2020, 7.0)])
+
+    assert list(analytics.latest_years_average(df)["company"]) == ["C", "A", "B"]
+
+
+# 2019 -> 2020 - соседние годы, 2020 -> 2022 - разрыв в 2 года, у B база 0
+GAPPED = [
+    ("A", 2019, 100.0), ("A", 2020, 110.0), ("A", 2022, 133.1),
+    ("B", 2020, 0.0), ("B", 2021, 10.0), ("B", 2022, 5.0),
+    ("C", 2020, -10.0), ("C", 2022, 10.0),
+]
+
+
+@pytest.mark.parametrize("gap_policy, expected", [
+    ("consecutive", {("A", 2020): 10.0, ("B", 2022): -50.0}),
+    ("annualized", {("A", 2020): 10.0, ("A", 2022): 10.0, ("B", 2022): -50.0}),
+    ("previous", {("A", 2020): 10.0, ("A", 2022): 21.0, ("B", 2022): -50.0, ("C", 2022): -200.0}),
+])
+def test_yoy_gap_policies(gap_policy, expected):
+    df_changes = analytics.yoy_changes(_company_years(GAPPED), gap_policy=gap_policy)
+
+    assert list(df_changes.columns) == ["company", "year", "yoy_change_pct"]
+    assert _changes(df_changes) == expected
+
+
+def test_yoy_unknown_gap_policy_is_an_error():
+    with pytest.raises(ValueError):
+        analytics.yoy_changes(_company_years(GAPPED), gap_policy="nearest")
+
+
+def test_yoy_summary_per_year():
+    df_changes, df_avg = analytics.yoy_trend(_company_years(GAPPED), gap_policy="previous")
+
+    assert list(df_avg["year"]) == [2020, 2022]
+    summary = df_avg.set_index("year")
+    assert summary.loc[2020, "company_count"] == 1
+    assert summary.loc[2022, "company_count"] == 3
+    assert summary.loc[2022, "median_yoy_change"] == pytest.approx(-50.0)
+    assert summary.loc[2022, "mean_yoy_change"] == pytest.approx((21.0 - 50.0 - 200.0) / 3)
+
+
+def _metrics(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["company_id", "country", "country_iso3", "company_size"]).astype(
+        {"country": "category", "country_iso3": "category", "company_size": "category"}
+    )
+
+
+# Компания 2 указана в Германии с двумя размерами, компания 4 - в двух странах
+METRICS = [
+    (1, "Germany", "DEU", "Large"), (1, "Germany", "DEU", "Large"),
+    (2, "Germany", "DEU", "Large"), (2, "Germany", "DEU", "Small"),
+    (3, "France", "FRA", "Small"),
+    (4, "France", "FRA", "Large"), (4, "Germany", "DEU", "Large"),
+]
+
+
+def test_geo_counts_counts_unique_companies_per_country():
+    df_geo = analytics.geo_counts(_metrics(METRICS))
+
+    assert dict(zip(df_geo["country_iso3"], df_geo["company_count"])) == {"DEU": 3, "FRA": 2}
+
+
+@pytest.mark.parametrize("sizes", [["Large", "Small"], ["Large"], ["Small"]])
+def test_geo_counts_from_cells_matches_geo_counts(sizes):
+    df_metrics = _metrics(METRICS)
+    df_cells = analytics.build_geo_cells(df_metrics)
+
+    expected = analytics.geo_counts(df_metrics[df_metrics["company_size"].isin(sizes)])
+    actual = analytics.geo_counts_from_cells(df_cells[df_cells["company_size"].isin(sizes)])
+
+    pd.testing.assert_frame_equal(
+        actual.sort_values("country_iso3").reset_index(drop=True),
+        expected.sort_values("country_iso3").reset_index(drop=True),
+        check_dtype=False,
+    )
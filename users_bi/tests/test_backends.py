@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+import backends
+import ingest
+
+duckdb = pytest.importorskip("duckdb")
+
+# Метрики Trends и подвкладки Energy: одиночные и составные наборы sub_code
+SUB_CODE_SETS = [
+    ['305-1-a', '305-2-a', '305-3-a'], ['302-1-e'], ['306-3-a'], ['303-5-a'], ['302-1-c'], ['302-1-a', '302-1-b'],
+]
+TREND_SUB_CODE_SETS = SUB_CODE_SETS[:4]
+
+
+def _plain(value):
+    # Списки лет: у pandas элементы np.int16, у DuckDB - int
+    return str([int(v) for v in value]) if isinstance(value, (list, tuple, np.ndarray)) else str(value)
+
+
+def _normalized(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    # Категории у бэкендов разные (pandas - из фрейма, DuckDB - из результата), сравниваем значения
+    df = df.assign(**{col: df[col].astype(object).map(_plain) for col in df.columns if df[col].dtype in ("category", object)})
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+def assert_same(expected: pd.DataFrame, actual: pd.DataFrame, keys: list):
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        _normalized(actual, keys), _normalized(expected, keys), check_dtype=False, check_exact=False, rtol=1e-9,
+    )
+
+
+@pytest.fixture(scope="module")
+def pandas_backend(sources):
+    return backends.build_pandas_backend(*sources)
+
+
+@pytest.fixture(scope="module", params=["frames", "parquet"])
+def duckdb_backend(request, sources, snapshot_paths):
+    if request.param == "frames":
+        return backends.DuckDBBackend.from_frames(*sources, ingest.build_company_dim(*sources))
+    return backends.DuckDBBackend.from_parquet(*snapshot_paths)
+
+
+def _selections(df_metrics: pd.DataFrame) -> list:
+    countries = sorted(df_metrics["country"].unique())
+    sizes = sorted(df_metrics["company_size"].unique())
+    return [
+        (countries, sizes),
+        (countries[:3], sizes),
+        (countries, sizes[:1]),
+        (countries[1::2], sizes[1:]),
+        ([], sizes),
+    ]
+
+
+def test_parquet_company_dim_matches_ingest(sources, snapshot_paths):
+    backend = backends.DuckDBBackend.from_parquet(*snapshot_paths)
+    pd.testing.assert_frame_equal(backend.company_dim(), ingest.build_company_dim(*sources))
+    metrics = sources[0]
+    assert backend.filter_values() == (sorted(metrics["country"].unique()), sorted(metrics["company_size"].unique()))
+
+
+def test_kpis_geo_and_shares(pandas_backend, duckdb_backend, sources):
+    for countries, sizes in _selections(sources[0]):
+        expected = pandas_backend.kpi_counts(countries, sizes)
+        actual = duckdb_backend.kpi_counts(countries, sizes)
+        for name in ("metric_count", "bundle_count", "company_count", "country_count"):
+            assert actual[name] == expected[name], (name, countries, sizes)
+        if not expected["metric_count"]:
+            continue
+        assert (actual["min_year"], actual["max_year"]) == (expected["min_year"], expected["max_year"])
+
+        assert_same(pandas_backend.geo_counts(countries, sizes), duckdb_backend.geo_counts(countries, sizes),
+                    ["country", "country_iso3"])
+        company_count = expected["company_count"]
+        assert_same(pandas_backend.category_shares(countries, sizes, company_count),
+                    duckdb_backend.category_shares(countries, sizes, company_count), ["category_name"])
+        assert_same(pandas_backend.topic_shares(countries, sizes, company_count),
+                    duckdb_backend.topic_shares(countries, sizes, company_count), ["category_name", "topic_name"])
+
+
+def test_metric_aggregations(pandas_backend, duckdb_backend, sources):
+    for countries, sizes in _selections(sources[0])[:-1]:
+        for sub_codes in SUB_CODE_SETS:
+            assert_same(pandas_backend.company_year_sums(countries, sizes, sub_codes),
+                        duckdb_backend.company_year_sums(countries, sizes, sub_codes), ["company", "year"])
+            assert_same(pandas_backend.latest_years_average(countries, sizes, sub_codes, n_years=3),
+                        duckdb_backend.latest_years_average(countries, sizes, sub_codes, n_years=3), ["company"])
+
+
+@pytest.mark.parametrize("gap_policy", analytics.YOY_GAP_POLICIES)
+def test_yoy_trend(pandas_backend, duckdb_backend, sources, gap_policy):
+    for countries, sizes in _selections(sources[0])[:-1]:
+        for sub_codes in TREND_SUB_CODE_SETS:
+            expected_changes, expected_avg = pandas_backend.yoy_trend(countries, sizes, sub_codes, gap_policy)
+            actual_changes, actual_avg = duckdb_backend.yoy_trend(countries, sizes, sub_codes, gap_policy)
+            assert_same(expected_changes, actual_changes, ["company", "year"])
+            assert_same(expected_avg, actual_avg, ["year"])
+
+
+def test_pages(pandas_backend, duckdb_backend, sources):
+    countries, sizes = _selections(sources[0])[1]
+    for search, sort_by, ascending in [("", None, True), ("a", "year", False), ("zzz", None, True)]:
+        expected, expected_total = pandas_backend.reports_page(countries, sizes, search, sort_by, ascending, 0, 10_000)
+        actual, actual_total = duckdb_backend.reports_page(countries, sizes, search, sort_by, ascending, 0, 10_000)
+        assert actual_total == expected_total
+        assert_same(expected, actual, ["company", "year", "country", "industry"])
+
+        expected, expected_total = pandas_backend.leaders_page(countries, sizes, ["A", "B"], search, sort_by,
+                                                               ascending, 0, 10_000)
+        actual, actual_total = duckdb_backend.leaders_page(countries, sizes, ["A", "B"], search, sort_by,
+                                                           ascending, 0, 10_000)
+        assert actual_total == expected_total
+        assert_same(expected, actual, ["company", "year", "country", "tier"])
+
+
+def test_pandas_pages_are_sliced_from_a_cached_list(sources):
+    backend = backends.build_pandas_backend(*sources)
+    countries, sizes = _selections(sources[0])[1]
+    expected, expected_total = backends.paginate(backend.reports_list(countries, sizes), "a", "year", False, 0, 10_000)
+
+    pages = [backend.reports_page(list(reversed(countries)), sizes, "a", "year", False, offset, 7)
+             for offset in range(0, expected_total, 7)]
+
+    assert len(backend._lists) == 1
+    assert sum(total == expected_total for _, total in pages) == len(pages)
+    pd.testing.assert_frame_equal(pd.concat([page for page, _ in pages], ignore_index=True), expected)
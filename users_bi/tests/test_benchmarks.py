@@ -0,0 +1,63 @@
+"""
+pytest-benchmark suite for the headless analytics core (analytics.py) on
+synthetic tables (synthetic_data.py).
+
+    python -m pytest users_bi/tests/test_benchmarks.py --benchmark-only
+    USERS_BI_BENCH_SIZES=10k,1M,10M python -m pytest users_bi/tests/test_benchmarks.py \
+        --benchmark-only --benchmark-autosave
+    python -m pytest users_bi/tests/test_benchmarks.py --benchmark-only \
+        --benchmark-compare --benchmark-compare-fail=min:20%
+
+Sizes are metric row counts (default 10k, so the suite stays fast in a
+plain test run). Skipped when pytest-benchmark is not installed.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import analytics
+import ingest
+import synthetic_data
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [synthetic_data.parse_size(size) for size in os.environ.get("USERS_BI_BENCH_SIZES", "10k").split(",")]
+GHG_CODES = ["305-1-a", "305-2-a", "305-3-a"]
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n_rows: f"{n_rows}rows")
+def tables(request) -> dict:
+    """Synthetic tables (typed as by ingest.py) and the derived frames the cases start from."""
+    chunks = list(synthetic_data.iter_tables(request.param, seed=0))
+    df_metrics = ingest.optimize_dtypes(pd.concat([metrics for metrics, _, _ in chunks], ignore_index=True))
+    df_topics = ingest.optimize_dtypes(pd.concat([topics for _, topics, _ in chunks], ignore_index=True))
+    df_cube = analytics.build_metric_cube(df_metrics)
+    return {
+        "metrics": df_metrics,
+        "topics": df_topics,
+        "cube": df_cube,
+        "geo_cells": analytics.build_geo_cells(df_metrics),
+        "annual_sums": analytics.company_year_sums(df_cube, GHG_CODES),
+        "company_count": df_metrics["company_id"].nunique(),
+    }
+
+
+CASES = {
+    "kpi_counts": lambda t: analytics.kpi_counts(t["metrics"]),
+    "geo_counts": lambda t: analytics.geo_counts(t["metrics"]),
+    "geo_counts_from_cells": lambda t: analytics.geo_counts_from_cells(t["geo_cells"]),
+    "category_shares": lambda t: analytics.category_shares(t["topics"], t["company_count"]),
+    "topic_shares": lambda t: analytics.topic_shares(t["topics"], t["company_count"]),
+    "build_metric_cube": lambda t: analytics.build_metric_cube(t["metrics"]),
+    "company_year_sums": lambda t: analytics.company_year_sums(t["cube"], GHG_CODES),
+    "latest_years_average": lambda t: analytics.latest_years_average(t["annual_sums"]),
+    "yoy_trend": lambda t: analytics.yoy_trend(t["annual_sums"]),
+}
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_analytics(benchmark, tables, case):
+    benchmark.group = f"{len(tables['metrics'])} rows"
+    result = benchmark(CASES[case], tables)
+    assert result is not None
@@ -0,0 +1,139 @@
+import os
+
+import pandas as pd
+import pytest
+
+import data_cache
+import perf
+
+
+@pytest.fixture
+def metrics_csv(source_dir) -> bytes:
+    with open(os.path.join(source_dir, "comparable_metrics.csv"), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def served(source_server, metrics_csv, cache_dir):
+    source_server.files["comparable_metrics.csv"] = metrics_csv
+    return source_server, source_server.url("comparable_metrics.csv")
+
+
+def test_download_is_gzipped_and_parsed(served, sources):
+    server, url = served
+    df = data_cache.fetch_csv(url, ttl=3600)
+
+    pd.testing.assert_frame_equal(df, sources[0])
+    (headers,) = server.requests_for("comparable_metrics.csv")
+    assert "gzip" in headers["Accept-Encoding"]
+    assert data_cache.snapshot_path(url)
+
+
+def test_fresh_snapshot_is_not_revalidated(served):
+    server, url = served
+    data_cache.fetch_csv(url, ttl=3600)
+    df = data_cache.fetch_csv(url, ttl=3600)
+
+    assert len(server.requests_for("comparable_metrics.csv")) == 1
+    assert len(df)
+
+
+def test_stale_snapshot_is_revalidated_with_304(served, sources):
+    server, url = served
+    data_cache.fetch_csv(url, ttl=3600)
+    version = data_cache.snapshot_version(url)
+    df = data_cache.fetch_csv(url, ttl=0)
+
+    first, second = server.requests_for("comparable_metrics.csv")
+    assert "If-None-Match" not in first
+    assert second["If-None-Match"]
+    # 304: снапшот не переписывается, ключи кэшей не меняются
+    assert data_cache.snapshot_version(url) == version
+    pd.testing.assert_frame_equal(df, sources[0])
+
+
+def test_changed_source_is_downloaded_again(served, metrics_csv):
+    server, url = served
+    data_cache.fetch_csv(url, ttl=3600)
+    lines = metrics_csv.splitlines(keepends=True)
+    server.files["comparable_metrics.csv"] = b"".join(lines[:101])
+
+    df = data_cache.fetch_csv(url, ttl=0)
+
+    assert len(df) == 100
+
+
+def test_server_errors_are_retried(served, sources):
+    server, url = served
+    server.failures["comparable_metrics.csv"] = [503, 503]
+
+    df = data_cache.fetch_csv(url, ttl=3600)
+
+    assert len(server.requests_for("comparable_metrics.csv")) == 3
+    pd.testing.assert_frame_equal(df, sources[0])
+
+
+def test_unreachable_server_serves_last_snapshot(served, sources):
+    server, url = served
+    data_cache.fetch_csv(url, ttl=3600)
+    server.stop()
+
+    df = data_cache.fetch_csv(url, ttl=0)
+
+    pd.testing.assert_frame_equal(df, sources[0])
+
+
+def test_failing_server_serves_last_snapshot(served, sources):
+    server, url = served
+    data_cache.fetch_csv(url, ttl=3600)
+    server.failures["comparable_metrics.csv"] = [500] * (data_cache.MAX_RETRIES + 1)
+
+    df = data_cache.fetch_csv(url, ttl=0)
+
+    pd.testing.assert_frame_equal(df, sources[0])
+
+
+def test_no_snapshot_and_no_server_is_an_error(served):
+    server, url = served
+    server.failures["comparable_metrics.csv"] = [404]
+
+    with pytest.raises(data_cache.DataUnavailableError):
+        data_cache.fetch_csv(url, ttl=3600)
+
+
+def test_offline_mode_never_goes_to_the_network(served):
+    server, url = served
+    with pytest.raises(data_cache.DataUnavailableError):
+        data_cache.fetch_csv(url, ttl=0, offline=True)
+    data_cache.fetch_csv(url, ttl=3600)
+
+    df = data_cache.fetch_csv(url, ttl=0, offline=True)
+
+    assert len(server.requests_for("comparable_metrics.csv")) == 1
+    assert len(df)
+
+
+def test_fetch_all_keeps_order_and_reports_download_stages(source_server, source_dir, cache_dir, sources):
+    names = ("comparable_metrics.csv", "material_topics.csv", "industry_leaders.csv")
+    for name in names:
+        with open(os.path.join(source_dir, name), "rb") as f:
+            source_server.files[name] = f.read()
+    records = perf.start_run()
+
+    frames = data_cache.fetch_all([source_server.url(name) for name in names], ttl=3600)
+
+    for df, expected in zip(frames, sources):
+        pd.testing.assert_frame_equal(df, expected)
+    # Стадии потоков пула попадают в запуск вызывающего потока
+    assert sorted(record["rows"] for record in records if record["stage"] == "download_parse") == \
+        sorted(len(df) for df in sources)
+
+
+def test_fetch_snapshot_returns_the_path(served, sources):
+    server, url = served
+    path = data_cache.fetch_snapshot(url, ttl=3600)
+
+    assert path == data_cache.snapshot_path(url)
+    assert data_cache.fetch_snapshot(url, ttl=3600) == path
+    assert len(server.requests_for("comparable_metrics.csv")) == 1
+    pd.testing.assert_frame_equal(pd.read_parquet(path), sources[0])
@@ -0,0 +1,176 @@
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+import analytics
+import incremental
+import ingest
+import perf
+
+NAME = "comparable_metrics.csv"
+
+
+def _parse(csv: bytes) -> pd.DataFrame:
+    return ingest.optimize_dtypes(pd.read_csv(BytesIO(csv), dtype=ingest.CSV_DTYPES))
+
+
+def _cut(csv: bytes, fraction: float, split_bundle: bool = False) -> int:
+    """
+    Offset of the first line of the bundle that starts after `fraction` of
+    the file, or with `split_bundle` of a line inside a bundle.
+    """
+    lines = csv.splitlines(keepends=True)
+    bundle_ids = _parse(csv)["bundle_id"].to_numpy()
+    row = int(len(bundle_ids) * fraction)
+    while (bundle_ids[row] == bundle_ids[row - 1]) != split_bundle:
+        row += 1
+    # +1: строка заголовка
+    return sum(len(line) for line in lines[:row + 1])
+
+
+def _sorted(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    df = df.astype({col: str for col in df.columns if df[col].dtype == "category"})
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+@pytest.fixture
+def metrics_csv(sources) -> bytes:
+    # Таблица только растет: новые отчеты (bundle_id) дописываются в конец файла
+    df = sources[0].sort_values("bundle_id", kind="stable")
+    return df.to_csv(index=False).encode("utf-8")
+
+
+@pytest.fixture
+def store(source_server, cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, "STORE_DIR", str(tmp_path / "incremental"))
+    return source_server, source_server.url(NAME)
+
+
+def _refresh(url: str) -> pd.DataFrame:
+    incremental.invalidate(url)
+    return incremental.fetch_csv(url, ttl=3600)
+
+
+def assert_same_as_full_load(url: str, csv: bytes):
+    expected = _parse(csv)
+    pd.testing.assert_frame_equal(incremental.fetch_csv(url, ttl=3600), expected)
+    pd.testing.assert_frame_equal(
+        _sorted(incremental.metric_cube(url), analytics.CUBE_KEYS),
+        _sorted(analytics.build_metric_cube(expected), analytics.CUBE_KEYS),
+        check_dtype=False,
+    )
+    kpis = analytics.kpi_counts(expected)
+    assert incremental.kpi_counts(url) == {name: int(value) for name, value in kpis.items()}
+
+
+def test_appended_reports_are_downloaded_as_a_range(store, metrics_csv):
+    server, url = store
+    cut = _cut(metrics_csv, 0.5)
+    server.files[NAME] = metrics_csv[:cut]
+    incremental.fetch_csv(url, ttl=3600)
+    assert_same_as_full_load(url, metrics_csv[:cut])
+
+    server.files[NAME] = metrics_csv
+    _refresh(url)
+
+    assert server.requests_for(NAME)[-1]["Range"].startswith("bytes=")
+    assert_same_as_full_load(url, metrics_csv)
+
+
+def test_unfinished_last_line_is_read_on_the_next_refresh(store, metrics_csv):
+    server, url = store
+    cut = _cut(metrics_csv, 0.3)
+    server.files[NAME] = metrics_csv[:cut + 10]
+    incremental.fetch_csv(url, ttl=3600)
+    assert_same_as_full_load(url, metrics_csv[:cut])
+
+    for fraction in (0.6, 1.0):
+        end = _cut(metrics_csv, fraction) if fraction < 1 else len(metrics_csv)
+        server.files[NAME] = metrics_csv[:end]
+        _refresh(url)
+    assert_same_as_full_load(url, metrics_csv)
+
+
+def test_server_without_range_support(store, metrics_csv):
+    server, url = store
+    server.range_support = False
+    # Бандл разрезан между двумя обновлениями: его хвост тоже должен попасть в хранилище
+    cut = _cut(metrics_csv, 0.5, split_bundle=True)
+    server.files[NAME] = metrics_csv[:cut]
+    incremental.fetch_csv(url, ttl=3600)
+    assert_same_as_full_load(url, metrics_csv[:cut])
+
+    server.files[NAME] = metrics_csv
+    _refresh(url)
+
+    assert_same_as_full_load(url, metrics_csv)
+
+
+def test_bundle_split_across_range_refreshes(store, metrics_csv):
+    server, url = store
+    cut = _cut(metrics_csv, 0.5, split_bundle=True)
+    server.files[NAME] = metrics_csv[:cut]
+    incremental.fetch_csv(url, ttl=3600)
+
+    server.files[NAME] = metrics_csv
+    _refresh(url)
+
+    assert_same_as_full_load(url, metrics_csv)
+
+
+def test_bundle_below_the_watermark_is_counted(store, metrics_csv):
+    server, url = store
+    # Отчет с меньшим bundle_id дописан после более новых
+    lines = metrics_csv.splitlines(keepends=True)
+    bundle_ids = _parse(metrics_csv)["bundle_id"].to_numpy()
+    late = bundle_ids == bundle_ids[len(bundle_ids) // 2]
+    body = lines[1:]
+    csv = lines[0] + b"".join(line for line, is_late in zip(body, late) if not is_late)
+    server.files[NAME] = csv
+    incremental.fetch_csv(url, ttl=3600)
+
+    csv += b"".join(line for line, is_late in zip(body, late) if is_late)
+    server.files[NAME] = csv
+    _refresh(url)
+
+    assert_same_as_full_load(url, csv)
+
+
+def test_rewritten_file_is_loaded_again(store, metrics_csv):
+    server, url = store
+    cut = _cut(metrics_csv, 0.5)
+    server.files[NAME] = metrics_csv[:cut]
+    incremental.fetch_csv(url, ttl=3600)
+
+    # Файл переписан (первая строка данных удалена) и дополнен новыми отчетами
+    header_end = metrics_csv.index(b"\n") + 1
+    first_line_end = metrics_csv.index(b"\n", header_end) + 1
+    rewritten = metrics_csv[:header_end] + metrics_csv[first_line_end:]
+    server.files[NAME] = rewritten
+    _refresh(url)
+
+    # Прежние части не соответствуют файлу - хранилище собрано заново из всего файла
+    assert_same_as_full_load(url, rewritten)
+
+
+def test_unchanged_file_adds_nothing(store, metrics_csv):
+    server, url = store
+    server.files[NAME] = metrics_csv
+    incremental.fetch_csv(url, ttl=3600)
+    version = incremental.snapshot_version(url)
+
+    _refresh(url)
+
+    assert incremental.snapshot_version(url) == version
+    assert_same_as_full_load(url, metrics_csv)
+
+
+def test_fetch_all_reports_stages_in_the_callers_run(store, metrics_csv):
+    server, url = store
+    server.files[NAME] = metrics_csv
+    records = perf.start_run()
+
+    (df,) = incremental.fetch_all([url], ttl=3600)
+
+    assert [record["rows"] for record in records if record["stage"] == "download_parse"] == [len(df)]
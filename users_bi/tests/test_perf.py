@@ -0,0 +1,21 @@
+import json
+
+import perf
+
+
+def test_configure_log_writes_stage_lines(tmp_path):
+    path = tmp_path / "perf.jsonl"
+    handler = perf.configure_log(str(path))
+    try:
+        perf.configure_log(str(path))  # повторный вызов заменяет обработчик, строки не дублируются
+        with perf.stage("test_stage") as timing:
+            timing["rows"] = 3
+    finally:
+        for h in list(perf.logger.handlers):
+            if getattr(h, "_users_bi_perf", False):
+                perf.logger.removeHandler(h)
+                h.close()
+
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [(line["event"], line["stage"], line["rows"]) for line in lines] == [("stage", "test_stage", 3)]
+    assert handler not in perf.logger.handlers